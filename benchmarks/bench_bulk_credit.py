@@ -0,0 +1,108 @@
+"""
+Массовое начисление (/add_std, /add_tch): прежний цикл хендлера (get_chat_id и add_coins по очереди для каждого
+пользователя) против bulk_add_coins (те же запросы на ограниченном пуле потоков, метка операции в журнале) и повторная
+доставка той же команды.
+
+DynamoDB заменяет LookupResource из bench_username_lookup (Query по индексу username), дополненный
+TransactWriteItems с условиями начисления и записи в журнал. Каждый запрос добавляет задержку --latency-ms.
+
+    python benchmarks/bench_bulk_credit.py --users 300 1000 --workers 8
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from botocore.exceptions import ClientError  # noqa: E402
+
+from bench_username_lookup import IndexedStore, LookupDatabase, LookupResource, LookupTable  # noqa: E402
+from db_manager import BulkResult  # noqa: E402
+
+
+class BulkTable(LookupTable):
+    def transact_write_items(self, TransactItems, ClientRequestToken=None):
+        self.store.stats['requests'] += 1
+        time.sleep(self.store.latency)
+        operations = [next(iter(item.items())) for item in TransactItems]
+        keys = [self.store.key(op['TableName'], op.get('Key') or {name: op['Item'][name] for name in ('chat_id', 'ts')})
+                for kind, op in operations]
+        # все записи транзакции относятся к одному пользователю, достаточно блокировки его записи
+        with self.store.lock(keys[0]):
+            # Update требует существующей записи, Put (метка и журнал) - отсутствующей
+            reasons = [{'Code': 'None' if (key in self.store.items) == (kind == 'Update') else 'ConditionalCheckFailed'}
+                       for (kind, op), key in zip(operations, keys)]
+            if any(reason['Code'] != 'None' for reason in reasons):
+                raise ClientError({'Error': {'Code': 'TransactionCanceledException'},
+                                   'CancellationReasons': reasons}, 'TransactWriteItems')
+            for (kind, op), key in zip(operations, keys):
+                if kind == 'Update':
+                    self.store.apply(op['TableName'], op)
+                else:
+                    self.store.items[key] = dict(op['Item'])
+
+
+class BulkResource(LookupResource):
+    def Table(self, name):
+        return BulkTable(self.store, name)
+
+
+class BulkDatabase(LookupDatabase):
+    def __init__(self, store: IndexedStore):
+        super().__init__(store, ledger_table_name='Ledger')
+
+    def _make_resource(self):
+        return BulkResource(self.store)
+
+
+def handler_loop(db: BulkDatabase, usernames: list, amount: int) -> int:
+    """cmd_add_std до bulk_add_coins"""
+    added = 0
+    for username in usernames:
+        chat_id = db.get_chat_id(username)
+        if chat_id:
+            db.add_coins(chat_id, amount)
+            added += 1
+    return added
+
+
+def run(users: int, workers: int, latency: float) -> list:
+    store = IndexedStore(latency)
+    store.load(users + 1)
+    db = BulkDatabase(store)
+    # chat_id 0 не найден прежним циклом (if chat_id), поэтому начисляем пользователям 1..users
+    usernames = [f'user{chat_id}' for chat_id in range(1, users + 1)]
+    total = lambda: sum(item['coins'] for key, item in store.items.items() if key[0] == 'Users')  # noqa: E731
+    scenarios = [
+        ('per-user loop (before)', lambda: handler_loop(db, usernames, 1)),
+        ('per-user loop, redelivered', lambda: handler_loop(db, usernames, 1)),
+        ('bulk_add_coins', lambda: db.bulk_add_coins(usernames, 1, 'op-1', max_workers=workers)),
+        ('bulk_add_coins, redelivered', lambda: db.bulk_add_coins(usernames, 1, 'op-1', max_workers=workers)),
+    ]
+    rows = []
+    for name, scenario in scenarios:
+        store.stats.clear()
+        coins = total()
+        start = time.perf_counter()
+        result = scenario()
+        elapsed = time.perf_counter() - start
+        if isinstance(result, dict):
+            assert set(result.values()) <= {BulkResult.CREDITED, BulkResult.ALREADY_CREDITED}
+        rows.append((users, name, elapsed, users / elapsed, store.stats['requests'] / users, total() - coins))
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, nargs='+', default=[300, 1000])
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--latency-ms', type=float, default=5)
+    args = parser.parse_args()
+    print(f'workers={args.workers} latency={args.latency_ms:g}ms amount=1')
+    print('| users | credit | seconds | users/s | requests/user | coins credited |')
+    print('|---|---|---|---|---|---|')
+    for users in args.users:
+        for row in run(users, args.workers, args.latency_ms / 1000):
+            print('| {} | {} | {:.2f} | {:.0f} | {:.2f} | {} |'.format(*row))
@@ -0,0 +1,106 @@
+"""
+Время и пиковая память выгрузки /table: прежняя реализация (get_data читает таблицу в список, обычный Workbook
+строится в памяти и сохраняется в BytesIO) против текущей (iter_data постранично читает сегменты, write-only
+Workbook пишет строки сразу во временный файл).
+
+DynamoDB заменяет SnapshotResource из bench_snapshot (Scan с сегментами и страницами до 1 МБ). Память измеряется
+tracemalloc и включает только аллокации Python, каждая реализация запускается в отдельном процессе.
+
+    python benchmarks/bench_export.py --users 100000 200000 --segments 4
+"""
+import argparse
+import importlib
+import csv
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_hot_account import StandInStore  # noqa: E402
+from bench_snapshot import SnapshotDatabase  # noqa: E402
+from roster import Roster  # noqa: E402
+import utils  # noqa: E402
+
+
+def old_get_table(table: list, roster: Roster) -> io.BytesIO:
+    """get_table до потоковой выгрузки"""
+    from openpyxl import Workbook
+    wb = Workbook()
+    ws = wb.active
+    ws.title = 'Пользователи и балансы'
+    for row, (coins, username) in enumerate(table, start=1):
+        student = roster.get(username)
+        if student:
+            ws[f'A{row}'], ws[f'B{row}'] = student['ФИ'], student['Класс']
+        else:
+            ws[f'A{row}'], ws[f'B{row}'] = '_', '_'
+        ws[f'C{row}'] = username
+        ws[f'D{row}'] = str(coins)
+    ws.column_dimensions['A'].width = 20
+    ws.column_dimensions['C'].width = 20
+    excel_file = io.BytesIO()
+    wb.save(excel_file)
+    excel_file.seek(0)
+    return excel_file
+
+
+def measure(method: str, users: int, segments: int, latency: float):
+    store = StandInStore(latency=0, item_write=0)
+    store.unprocessed, store.pages = 0, 0
+    db = SnapshotDatabase(store)
+    db.put_items({'chat_id': chat_id, 'coins': chat_id % 1000, 'username': f'user{chat_id}'}
+                 for chat_id in range(users))
+    store.latency = latency
+    directory = tempfile.mkdtemp()
+    roster_file = os.path.join(directory, 'students.csv')
+    with open(roster_file, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['ФИ', 'Класс', 'телеграм'])
+        # половина пользователей есть в списке учеников
+        writer.writerows([f'Ученик {chat_id}', f'{chat_id % 11 + 1}А', f'@user{chat_id}']
+                         for chat_id in range(0, users, 2))
+    roster = Roster(roster_file)
+    roster.refresh()
+    importlib.import_module('openpyxl')  # импорт не входит в измерение
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    if method == 'before':
+        excel_file = old_get_table(db.get_data(), roster)
+    else:
+        excel_file = utils._write_table(db.iter_data(segments), roster)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    size = excel_file.seek(0, io.SEEK_END)
+    print(f'{elapsed:.3f} {peak} {size}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, nargs='+', default=[100_000, 200_000])
+    parser.add_argument('--segments', type=int, default=4)
+    parser.add_argument('--latency-ms', type=float, default=5)
+    parser.add_argument('--child', nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        measure(args.child[0], int(args.child[1]), args.segments, args.latency_ms / 1000)
+        sys.exit()
+
+    print(f'segments={args.segments} latency={args.latency_ms:g}ms')
+    print('| users | export | seconds | rows/s | peak Python memory, MB | xlsx, KB |')
+    print('|---|---|---|---|---|---|')
+    for users in args.users:
+        for method in ('before', 'streaming'):
+            output = subprocess.run([sys.executable, __file__, '--child', method, str(users),
+                                     '--segments', str(args.segments), '--latency-ms', str(args.latency_ms)],
+                                    check=True, capture_output=True, text=True).stdout
+            seconds, peak, size = output.split()
+            print(f'| {users} | {method} | {float(seconds):.2f} | {users / float(seconds):.0f} '
+                  f'| {int(peak) / 2 ** 20:.1f} | {int(size) / 1024:.0f} |')
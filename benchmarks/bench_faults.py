@@ -0,0 +1,139 @@
+"""
+Поведение ResilientClient при сбоях хранилища, два сценария:
+- overload: get_balance и transaction с нагрузкой выше емкости таблицы, запросы сверх --capacity в секунду
+  завершаются ProvisionedThroughputExceededException;
+- tail: только get_balance без троттлинга, каждый запрос с вероятностью --slow отвечает на --slow-ms дольше.
+
+DynamoDB заменяет StandInResource из bench_hot_account, в который добавлены эти сбои.
+
+    python benchmarks/bench_faults.py --requests 20000 --capacity 1000 --slow 0.02
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from botocore.exceptions import ClientError  # noqa: E402
+
+from bench_hot_account import StandInDatabase, StandInResource, StandInStore, StandInTable  # noqa: E402
+from db_manager import TransferResult  # noqa: E402
+from dynamo_client import ResilientClient, StorageError  # noqa: E402
+
+
+class FaultyStore(StandInStore):
+    def __init__(self, latency: float, capacity: float, slow: float, slow_time: float):
+        super().__init__(latency=latency, item_write=0)
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.slow = slow
+        self.slow_time = slow_time
+        self.enabled = False
+
+    def inject(self, operation: str):
+        if not self.enabled:
+            return
+        with self.guard:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.capacity)
+            self.updated = now
+            throttled = self.tokens < 1
+            if not throttled:
+                self.tokens -= 1
+        if throttled:
+            time.sleep(self.latency)
+            raise ClientError({'Error': {'Code': 'ProvisionedThroughputExceededException'}}, operation)
+        if random.random() < self.slow:
+            time.sleep(self.slow_time)
+
+    def transact(self, operations):
+        self.inject('TransactWriteItems')
+        super().transact(operations)
+
+
+class FaultyTable(StandInTable):
+    def get_item(self, Key):
+        self.store.inject('GetItem')
+        return super().get_item(Key)
+
+
+class FaultyResource(StandInResource):
+    def Table(self, name):
+        return FaultyTable(self.store, name)
+
+
+class FaultyDatabase(StandInDatabase):
+    def _make_resource(self):
+        return FaultyResource(self.store)
+
+
+def run(scenario: str, config: str, client: ResilientClient, args) -> dict:
+    if scenario == 'overload':
+        store = FaultyStore(args.latency_ms / 1000, args.capacity, 0, 0)
+    else:
+        store = FaultyStore(args.latency_ms / 1000, float('inf'), args.slow, args.slow_ms / 1000)
+    db = FaultyDatabase(store, client=client)
+    for chat_id in range(args.users):
+        db.add_user(chat_id, 1_000_000, f'user{chat_id}')
+    store.enabled = True
+
+    def request(i: int):
+        start = time.perf_counter()
+        try:
+            if i % 2 or scenario == 'tail':
+                ok = db.get_balance(i % args.users) is not None
+            else:
+                ok = db.transaction(i % args.users, (i + 1) % args.users, 1) is TransferResult.OK
+        except StorageError:
+            ok = False
+        return ok, time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        results = list(executor.map(request, range(args.requests)))
+    elapsed = time.perf_counter() - start
+    latencies = sorted(latency for _, latency in results)
+    return {
+        'scenario': scenario,
+        'config': config,
+        'success': sum(ok for ok, _ in results) / len(results) * 100,
+        'requests_per_sec': len(results) / elapsed,
+        'p50_ms': statistics.median(latencies) * 1000,
+        'p99_ms': latencies[int(len(latencies) * 0.99) - 1] * 1000,
+        'attempts': dict(client.stats),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--latency-ms', type=float, default=5)
+    parser.add_argument('--capacity', type=float, default=1000, help='запросов в секунду без троттлинга')
+    parser.add_argument('--slow', type=float, default=0.02, help='доля медленных ответов')
+    parser.add_argument('--slow-ms', type=float, default=200)
+    args = parser.parse_args()
+    runs = [
+        ('overload', 'no retries', lambda: ResilientClient(max_attempts=1)),
+        ('overload', 'retries', lambda: ResilientClient()),
+        ('tail', 'retries', lambda: ResilientClient()),
+        # второй get_item через 4 обычные задержки; в пуле выполняются оба запроса, поэтому он вдвое больше потоков
+        ('tail', 'retries + hedged get_item',
+         lambda: ResilientClient(hedge_after=args.latency_ms * 4 / 1000, hedge_workers=2 * args.threads)),
+    ]
+    print(f'requests={args.requests} threads={args.threads} latency={args.latency_ms:g}ms '
+          f'capacity={args.capacity:g}/s slow={args.slow:g} slow_ms={args.slow_ms:g}')
+    print('| scenario | client | success, % | requests/s | p50, ms | p99, ms | retries | hedged |')
+    print('|---|---|---|---|---|---|---|---|')
+    for scenario, name, make_client in runs:
+        row = run(scenario, name, make_client(), args)
+        print(f"| {row['scenario']} | {row['config']} | {row['success']:.1f} | {row['requests_per_sec']:.0f} "
+              f"| {row['p50_ms']:.2f} | {row['p99_ms']:.2f} | {row['attempts'].get('retries', 0)} "
+              f"| {row['attempts'].get('hedged', 0)} |")
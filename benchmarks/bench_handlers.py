@@ -0,0 +1,268 @@
+"""
+Нагрузочный тест хендлеров main.py без Telegram и DynamoDB.
+
+Синтетические апдейты подаются в Dispatcher через dp.feed_update, ответы Bot API имитирует
+BenchSession, хранилище - MemoryDatabase в памяти с настраиваемой задержкой запроса.
+
+    python benchmarks/bench_handlers.py --users 1000 --db-latency 5
+    python benchmarks/bench_handlers.py --users 1000 --backend sqlite
+"""
+import argparse
+import asyncio
+import datetime
+import itertools
+import os
+import statistics
+import sys
+import threading
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('BOT_TOKEN', '42:bench')
+os.environ.setdefault('ADMINS', 'admin')
+
+from aiogram import types  # noqa: E402
+from aiogram.client.session.base import BaseSession  # noqa: E402
+
+import main  # noqa: E402
+from bot.outbox import Outbox  # noqa: E402
+from db_manager import AsyncDatabase, TransferResult, BulkResult  # noqa: E402
+from metrics import DB_LATENCY  # noqa: E402
+from sqlite_db import SQLiteDatabase  # noqa: E402
+from user_cache import CachedDatabase  # noqa: E402
+
+
+class MemoryDatabase:
+    """Хранилище с интерфейсом Database; каждый вызов считается одним обращением к БД"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.users = {}
+        self.calls = Counter()
+        self.lock = threading.Lock()
+
+    def _call(self, name: str):
+        self.calls[name] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def user_exist(self, chat_id):
+        self._call('user_exist')
+        user = self.users.get(chat_id)
+        return dict(user) if user else None
+
+    def add_user(self, chat_id, coins, username):
+        self._call('add_user')
+        self.users[chat_id] = {'chat_id': chat_id, 'coins': coins, 'username': username}
+        return True
+
+    def is_username_correct(self, chat_id, username):
+        user = self.user_exist(chat_id)
+        return bool(user) and user['username'] == username
+
+    def update_username(self, chat_id, new_username):
+        self._call('update_username')
+        self.users[chat_id]['username'] = new_username
+        return True
+
+    def add_coins(self, chat_id, amount, kind='admin'):
+        self._call('add_coins')
+        with self.lock:
+            self.users[chat_id]['coins'] += amount
+        return True
+
+    def subtract_coins(self, chat_id, amount, kind='admin'):
+        self._call('subtract_coins')
+        with self.lock:
+            self.users[chat_id]['coins'] -= amount
+        return True
+
+    def get_transaction_verdict(self, chat_id, amount):
+        user = self.user_exist(chat_id)
+        return bool(user) and user['coins'] >= amount
+
+    def transaction(self, chat_id, to_chat_id, amount):
+        self._call('transaction')
+        if chat_id == to_chat_id:
+            return TransferResult.SAME_USER
+        with self.lock:
+            if self.users.get(chat_id, {}).get('coins', 0) < amount:
+                return TransferResult.INSUFFICIENT_FUNDS
+            if to_chat_id not in self.users:
+                return TransferResult.RECIPIENT_MISSING
+            self.users[chat_id]['coins'] -= amount
+            self.users[to_chat_id]['coins'] += amount
+        return TransferResult.OK
+
+    def bulk_add_coins(self, usernames, amount, operation_id):
+        results = {}
+        for username in usernames:
+            chat_id = self.get_chat_id(username)
+            if chat_id is None:
+                results[username] = BulkResult.NOT_FOUND
+            else:
+                self.add_coins(chat_id, amount)
+                results[username] = BulkResult.CREDITED
+        return results
+
+    def get_username(self, chat_id):
+        user = self.user_exist(chat_id)
+        return user['username'] if user else None
+
+    def get_chat_id(self, username):
+        self._call('get_chat_id')
+        return next((chat_id for chat_id, user in self.users.items() if user['username'] == username), None)
+
+    def get_balance(self, chat_id):
+        user = self.user_exist(chat_id)
+        return user['coins'] if user else None
+
+    def iter_data(self):
+        self._call('scan')
+        for user in list(self.users.values()):
+            yield user['coins'], user['username']
+
+
+class BenchSession(BaseSession):
+    """Отвечает на любой метод Bot API без сети"""
+
+    def __init__(self):
+        super().__init__()
+        self.requests = Counter()
+        self.callback_data = {}
+
+    async def make_request(self, bot, method, timeout=None):
+        self.requests[type(method).__name__] += 1
+        markup = getattr(method, 'reply_markup', None)
+        if isinstance(markup, types.InlineKeyboardMarkup):
+            self.callback_data[method.chat_id] = markup.inline_keyboard[0][0].callback_data
+        if method.__returning__ is bool:
+            return True
+        return types.Message(
+            message_id=1, date=datetime.datetime.now(), chat=types.Chat(id=1, type='private'),
+            photo=[types.PhotoSize(file_id='photo', file_unique_id='photo', width=1, height=1)])
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b''
+
+    async def close(self):
+        pass
+
+
+class Unlimited:
+    async def allow(self, key, limit):
+        return True
+
+
+ids = itertools.count(1)
+
+
+def user(chat_id):
+    return types.User(id=chat_id, is_bot=False, first_name='bench', username=f'user{chat_id}')
+
+
+def message(chat_id, text):
+    return types.Update(update_id=next(ids), message=types.Message(
+        message_id=next(ids), date=datetime.datetime.now(), chat=types.Chat(id=chat_id, type='private'),
+        from_user=user(chat_id), text=text))
+
+
+def callback(chat_id, data, message_id):
+    return types.Update(update_id=next(ids), callback_query=types.CallbackQuery(
+        id=str(next(ids)), chat_instance='bench', from_user=user(chat_id), data=data,
+        message=types.Message(message_id=message_id, date=datetime.datetime.now(),
+                              chat=types.Chat(id=chat_id, type='private'), text='confirm')))
+
+
+def flows(users: int, session: BenchSession):
+    """Фазы нагрузки: имя и функция, строящая апдейты, которые отправляются одновременно"""
+    chat_ids = range(1, users + 1)
+    recipients = [(i % users) + 1 for i in chat_ids]
+    # повторное нажатие приходит с тем же сообщением, что и первое
+    confirm_message_id = next(ids)
+    return [
+        ('start', lambda: [message(i, '/start') for i in chat_ids]),
+        ('balance', lambda: [message(i, 'Баланс💵') for i in chat_ids]),
+        ('get', lambda: [message(i, '/get 10') for i in chat_ids]),
+        ('send_link', lambda: [message(i, f'/start {main.links.sign(to, 1, f"user{to}")}')
+                               for i, to in zip(chat_ids, recipients)]),
+        ('confirm', lambda: [callback(i, session.callback_data[i], confirm_message_id) for i in chat_ids]),
+        ('confirm_duplicate', lambda: [callback(i, session.callback_data[i], confirm_message_id) for i in chat_ids]),
+    ]
+
+
+def db_calls(backend: str, memory: MemoryDatabase) -> int:
+    if backend == 'memory':
+        return sum(memory.calls.values())
+    return sum(data[-1] for data in DB_LATENCY.values.values())
+
+
+async def run(users: int, db_latency: float, workers: int, backend: str = 'memory'):
+    memory = MemoryDatabase(latency=db_latency)
+    if backend == 'sqlite':
+        storage = AsyncDatabase(SQLiteDatabase(':memory:'), max_workers=1)
+    else:
+        storage = AsyncDatabase(memory, max_workers=workers)
+    main.database = CachedDatabase(storage)
+    session = main.bot.session = BenchSession()
+    # уведомления получателей отправляются через Outbox; лимиты Telegram в бенчмарке не нужны
+    main.outbox = Outbox(main.bot, rate=1_000_000, per_chat_interval=0)
+    main.outbox.start()
+    main.setup_dispatcher(limiter=Unlimited())
+    main.warm_up_morph()
+
+    async def timed(update, latencies):
+        start = time.perf_counter()
+        await main.dp.feed_update(main.bot, update)
+        latencies.append(time.perf_counter() - start)
+
+    results = []
+    for name, make_updates in flows(users, session):
+        updates = make_updates()
+        if name == 'send_link':
+            for chat_id in list(memory.users):
+                memory.users[chat_id]['coins'] = 100
+            if backend == 'sqlite':
+                storage.database.connection.execute('UPDATE users SET coins = 100')
+        memory.calls.clear()
+        calls_before = db_calls(backend, memory)
+        latencies = []
+        start = time.perf_counter()
+        await asyncio.gather(*(timed(update, latencies) for update in updates))
+        elapsed = time.perf_counter() - start
+        latencies.sort()
+        results.append({
+            'flow': name,
+            'updates': len(updates),
+            'updates_per_sec': len(updates) / elapsed,
+            'p50_ms': statistics.median(latencies) * 1000,
+            'p99_ms': latencies[int(len(latencies) * 0.99) - 1] * 1000,
+            'db_calls_per_update': (db_calls(backend, memory) - calls_before) / len(updates),
+        })
+    await main.outbox.stop()
+    return results
+
+
+def print_table(results, users, db_latency, workers, backend='memory'):
+    if backend == 'sqlite':
+        print(f'users={users} backend=sqlite')
+    else:
+        print(f'users={users} db_latency={db_latency * 1000:g}ms db_workers={workers}')
+    print('| flow | updates | updates/s | p50, ms | p99, ms | DB calls/update |')
+    print('|---|---|---|---|---|---|')
+    for row in results:
+        print(f"| {row['flow']} | {row['updates']} | {row['updates_per_sec']:.0f} | {row['p50_ms']:.2f} "
+              f"| {row['p99_ms']:.2f} | {row['db_calls_per_update']:.2f} |")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--db-latency', type=float, default=5, help='задержка одного запроса к БД, мс')
+    parser.add_argument('--db-workers', type=int, default=10)
+    parser.add_argument('--backend', choices=['memory', 'sqlite'], default='memory',
+                        help='sqlite - SQLiteDatabase в памяти, --db-latency и --db-workers не используются')
+    args = parser.parse_args()
+    print_table(asyncio.run(run(args.users, args.db_latency / 1000, args.db_workers, args.backend)),
+                args.users, args.db_latency / 1000, args.db_workers, args.backend)
@@ -0,0 +1,170 @@
+"""
+Пропускная способность переводов одному получателю (учителю, QR код которого сканирует весь класс)
+без шардов баланса и с шардами.
+
+Вместо DynamoDB используется StandInResource: запись одного ключа занимает его на --item-write-ms
+(как лимит записи в один ключ), запросы добавляют сетевую задержку --latency-ms вне блокировки.
+Поддерживаются только выражения, которые использует Database.
+
+    python benchmarks/bench_hot_account.py --senders 2000 --shards 8
+"""
+import argparse
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from botocore.exceptions import ClientError  # noqa: E402
+
+from db_manager import Database, TransferResult  # noqa: E402
+
+UPDATE = re.compile(r'SET coins = (coins|if_not_exists\(coins, :zero\)) ([+-]) (:\w+)')
+
+
+class StandInStore:
+    def __init__(self, latency: float, item_write: float):
+        self.latency = latency
+        self.item_write = item_write
+        self.items = {}
+        self.locks = {}
+        self.guard = threading.Lock()
+
+    def lock(self, key):
+        with self.guard:
+            return self.locks.setdefault(key, threading.Lock())
+
+    @staticmethod
+    def key(table_name: str, key: dict) -> tuple:
+        return (table_name,) + tuple(sorted(key.items()))
+
+    def check(self, item, condition: str, values: dict) -> bool:
+        if condition is None:
+            return True
+        if condition == 'attribute_exists(chat_id)':
+            return item is not None
+        match = re.fullmatch(r'coins >= (:\w+)', condition)
+        return item is not None and item.get('coins', 0) >= values[match.group(1)]
+
+    def apply(self, table_name: str, update: dict):
+        key = self.key(table_name, update['Key'])
+        item = self.items.get(key)
+        match = UPDATE.fullmatch(update['UpdateExpression'])
+        if item is None and match.group(1) == 'coins':
+            raise KeyError(key)
+        coins = (item or {}).get('coins', 0)
+        amount = update['ExpressionAttributeValues'][match.group(3)]
+        self.items[key] = {**(item or update['Key']), 'coins': coins + amount if match.group(2) == '+' else coins - amount}
+
+    def transact(self, operations):
+        time.sleep(self.latency)
+        # ConditionCheck только читает запись и не занимает ключ
+        keys = sorted({self.key(op['TableName'], op['Key']) for kind, op in operations if kind != 'ConditionCheck'})
+        locks = [self.lock(key) for key in keys]
+        for lock in locks:
+            lock.acquire()
+        try:
+            reasons = []
+            for kind, op in operations:
+                item = self.items.get(self.key(op['TableName'], op['Key']))
+                passed = self.check(item, op.get('ConditionExpression'), op.get('ExpressionAttributeValues', {}))
+                reasons.append({'Code': 'None' if passed else 'ConditionalCheckFailed'})
+            if any(reason['Code'] != 'None' for reason in reasons):
+                raise ClientError({'Error': {'Code': 'TransactionCanceledException'},
+                                   'CancellationReasons': reasons}, 'TransactWriteItems')
+            for kind, op in operations:
+                if kind == 'Update':
+                    self.apply(op['TableName'], op)
+                elif kind == 'Put':
+                    self.items[self.key(op['TableName'], op['Key'])] = dict(op['Item'])
+            # записанные ключи заняты на время записи
+            time.sleep(self.item_write)
+        finally:
+            for lock in locks:
+                lock.release()
+
+
+class StandInTable:
+    def __init__(self, store: StandInStore, name: str):
+        self.store = store
+        self.name = name
+        self.meta = self
+        self.client = self
+
+    def get_item(self, Key):
+        time.sleep(self.store.latency)
+        item = self.store.items.get(self.store.key(self.name, Key))
+        return {'Item': dict(item)} if item else {}
+
+    def put_item(self, Item):
+        self.store.transact([('Put', {'TableName': self.name, 'Key': {'chat_id': Item['chat_id']}, 'Item': Item})])
+
+    def update_item(self, **update):
+        self.store.transact([('Update', {'TableName': self.name, **update})])
+
+    def transact_write_items(self, TransactItems, ClientRequestToken=None):
+        self.store.transact([next(iter(item.items())) for item in TransactItems])
+
+
+class StandInResource:
+    def __init__(self, store: StandInStore):
+        self.store = store
+
+    def Table(self, name):
+        return StandInTable(self.store, name)
+
+    def batch_get_item(self, RequestItems):
+        time.sleep(self.store.latency)
+        responses = {}
+        for table_name, request in RequestItems.items():
+            items = (self.store.items.get(self.store.key(table_name, key)) for key in request['Keys'])
+            responses[table_name] = [dict(item) for item in items if item]
+        return {'Responses': responses}
+
+
+class StandInDatabase(Database):
+    def __init__(self, store: StandInStore, **kwargs):
+        self.store = store
+        super().__init__('Users', None, 'bench', 'bench', **kwargs)
+
+    def _make_resource(self):
+        return StandInResource(self.store)
+
+
+def run(senders: int, shards: int, threads: int, latency: float, item_write: float):
+    store = StandInStore(latency=0, item_write=0)
+    kwargs = {'shard_table_name': 'Shards', 'hot_accounts': [0], 'balance_shards': shards} if shards else {}
+    db = StandInDatabase(store, **kwargs)
+    for chat_id in range(senders + 1):
+        db.add_user(chat_id, 10, f'user{chat_id}')
+    store.latency, store.item_write = latency, item_write
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        results = list(executor.map(lambda chat_id: db.transaction(chat_id, 0, 1), range(1, senders + 1)))
+    elapsed = time.perf_counter() - start
+    balance_start = time.perf_counter()
+    balance = db.get_balance(0)
+    balance_ms = (time.perf_counter() - balance_start) * 1000
+    assert all(result is TransferResult.OK for result in results) and balance == 10 + senders
+    return senders / elapsed, balance_ms
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--senders', type=int, default=2000)
+    parser.add_argument('--shards', type=int, default=8)
+    parser.add_argument('--threads', type=int, default=64)
+    parser.add_argument('--latency-ms', type=float, default=5)
+    parser.add_argument('--item-write-ms', type=float, default=2, help='время записи одного ключа')
+    args = parser.parse_args()
+    print(f'senders={args.senders} threads={args.threads} latency={args.latency_ms:g}ms '
+          f'item_write={args.item_write_ms:g}ms')
+    print('| balance shards | transfers/s | get_balance, ms |')
+    print('|---|---|---|')
+    for shards in (0, args.shards):
+        rate, balance_ms = run(args.senders, shards, args.threads, args.latency_ms / 1000, args.item_write_ms / 1000)
+        print(f'| {shards or "off"} | {rate:.0f} | {balance_ms:.2f} |')
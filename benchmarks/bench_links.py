@@ -0,0 +1,39 @@
+"""
+Скорость подписи и проверки ссылок на оплату (LinkSigner) и длина payload.
+
+    python benchmarks/bench_links.py --count 100000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from links import MAX_USERNAME, LinkSigner, LinkStatus  # noqa: E402
+
+
+def run(count: int):
+    signer = LinkSigner(os.urandom(32))
+    username = 'u' * MAX_USERNAME
+    start = time.perf_counter()
+    payloads = [signer.sign(chat_id, chat_id % 1000 + 1, username) for chat_id in range(count)]
+    sign_us = (time.perf_counter() - start) / count * 1e6
+    start = time.perf_counter()
+    statuses = [signer.verify(payload)[0] for payload in payloads]
+    verify_us = (time.perf_counter() - start) / count * 1e6
+    assert all(status is LinkStatus.VALID for status in statuses)
+    return sign_us, verify_us, max(len(payload) for payload in payloads)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=100_000)
+    args = parser.parse_args()
+    sign_us, verify_us, length = run(args.count)
+    print(f'count={args.count}')
+    print('| operation | µs |')
+    print('|---|---|')
+    print(f'| sign | {sign_us:.2f} |')
+    print(f'| verify | {verify_us:.2f} |')
+    print(f'max payload length: {length} (callback_data limit 64)')
@@ -0,0 +1,66 @@
+"""
+Скорость agree_with_num: прежняя реализация (новый pymorphy3.MorphAnalyzer на каждый вызов), общий анализатор
+без кэша форм и текущая (анализатор создается один раз, формы кэшируются по слову и двум последним цифрам числа).
+
+    python benchmarks/bench_morph.py --calls 100000
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import utils  # noqa: E402
+
+WORDS = ('Токен', 'Токенов', 'токенов', 'пользователям')
+
+
+def per_call_analyzer(word: str, number: int) -> str:
+    """agree_with_num до общего анализатора"""
+    import pymorphy3
+    return pymorphy3.MorphAnalyzer().parse(word)[0].make_agree_with_number(number).word
+
+
+def shared_analyzer(word: str, number: int) -> str:
+    return utils.get_morph().parse(word)[0].make_agree_with_number(number).word
+
+
+def rate(func, calls) -> float:
+    start = time.perf_counter()
+    for word, number in calls:
+        func(word, number)
+    return len(calls) / (time.perf_counter() - start)
+
+
+async def cached_rate(calls) -> float:
+    start = time.perf_counter()
+    for word, number in calls:
+        await utils.agree_with_num(word, number)
+    return len(calls) / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--calls', type=int, default=100_000)
+    parser.add_argument('--slow-calls', type=int, default=20, help='вызовов прежней реализации')
+    args = parser.parse_args()
+    random.seed(1)
+    # суммы переводов и балансы - произвольные числа, не только 0..99
+    calls = [(random.choice(WORDS), random.randrange(100_000)) for _ in range(args.calls)]
+
+    start = time.perf_counter()
+    utils.warm_up_morph()
+    warm_up = time.perf_counter() - start
+    rows = [
+        ('MorphAnalyzer per call (before)', rate(per_call_analyzer, calls[:args.slow_calls])),
+        ('shared analyzer, no cache', rate(shared_analyzer, calls)),
+        ('shared analyzer + form cache (agree_with_num)', asyncio.run(cached_rate(calls))),
+    ]
+    print(f'calls={args.calls} slow_calls={args.slow_calls} warm_up_morph={warm_up:.2f}s')
+    print('| implementation | calls/s |')
+    print('|---|---|')
+    for name, value in rows:
+        print(f'| {name} | {value:.0f} |')
@@ -0,0 +1,126 @@
+"""
+Скорость выгрузки и загрузки снимка таблицы пользователей (snapshot.py) и проверка, что круговой проход
+export -> delete_all -> import -> export не теряет и не меняет записи, в том числе на границах страниц сканирования.
+
+DynamoDB заменяет StandInResource из bench_hot_account, дополненный Scan (сегменты, ProjectionExpression,
+страницы не больше 1 МБ, как в DynamoDB) и BatchWriteItem, который возвращает долю запросов в UnprocessedItems.
+
+    python benchmarks/bench_snapshot.py --users 50000 --segments 4 --writers 8
+"""
+import argparse
+import gzip
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_hot_account import StandInDatabase, StandInResource, StandInStore, StandInTable  # noqa: E402
+import snapshot  # noqa: E402
+
+PAGE_BYTES = 1024 * 1024
+
+
+class ScanTable(StandInTable):
+    def scan(self, Segment=0, TotalSegments=1, ExclusiveStartKey=None, ProjectionExpression=None,
+             ExpressionAttributeNames=None):
+        time.sleep(self.store.latency)
+        with self.store.guard:
+            items = sorted((item for key, item in self.store.items.items()
+                            if key[0] == self.name and item['chat_id'] % TotalSegments == Segment),
+                           key=lambda item: item['chat_id'])
+        if ExclusiveStartKey is not None:
+            items = [item for item in items if item['chat_id'] > ExclusiveStartKey['chat_id']]
+        names = [ExpressionAttributeNames[name.strip()] for name in ProjectionExpression.split(',')] \
+            if ProjectionExpression else None
+        page, size, last = [], 0, None
+        for item in items:
+            # как в DynamoDB: страница заканчивается, когда прочитан 1 МБ, ключ возвращается и без проекции chat_id
+            if size >= PAGE_BYTES:
+                self.store.pages += 1
+                return {'Items': page, 'LastEvaluatedKey': {'chat_id': last}}
+            size += len(json.dumps(item))
+            last = item['chat_id']
+            page.append({name: item[name] for name in names if name in item} if names else dict(item))
+        self.store.pages += 1
+        return {'Items': page}
+
+
+class SnapshotResource(StandInResource):
+    def Table(self, name):
+        return ScanTable(self.store, name)
+
+    def batch_write_item(self, RequestItems):
+        time.sleep(self.store.latency)
+        unprocessed = {}
+        for table_name, requests in RequestItems.items():
+            for request in requests:
+                if random.random() < self.store.unprocessed:
+                    unprocessed.setdefault(table_name, []).append(request)
+                elif 'PutRequest' in request:
+                    item = request['PutRequest']['Item']
+                    self.store.items[self.store.key(table_name, {'chat_id': item['chat_id']})] = dict(item)
+                else:
+                    self.store.items.pop(self.store.key(table_name, request['DeleteRequest']['Key']), None)
+        return {'UnprocessedItems': unprocessed}
+
+
+class SnapshotDatabase(StandInDatabase):
+    def _make_resource(self):
+        return SnapshotResource(self.store)
+
+
+def read_items(path: str) -> dict:
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        return {item['chat_id']: item for item in map(json.loads, f)}
+
+
+def run(args):
+    store = StandInStore(latency=0, item_write=0)
+    store.unprocessed, store.pages = 0, 0
+    db = SnapshotDatabase(store)
+    note = 'x' * args.item_bytes
+    db.put_items(({'chat_id': chat_id, 'coins': chat_id % 1000, 'username': f'user{chat_id}', 'note': note}
+                  for chat_id in range(args.users)), writers=args.writers)
+    store.latency, store.unprocessed = args.latency_ms / 1000, args.unprocessed
+
+    directory = tempfile.mkdtemp()
+    first, second = os.path.join(directory, 'first.jsonl.gz'), os.path.join(directory, 'second.jsonl.gz')
+    start = time.perf_counter()
+    manifest = snapshot.export_snapshot(db, first, args.segments)
+    export_seconds = time.perf_counter() - start
+    pages = store.pages
+    # каждый сегмент должен занять несколько страниц, иначе граница страниц не проверяется
+    assert pages > args.segments, 'increase --users or --item-bytes'
+
+    assert db.delete_all(args.segments) == args.users and not store.items
+    start = time.perf_counter()
+    imported = snapshot.import_items(db, first, args.writers)
+    import_seconds = time.perf_counter() - start
+    assert imported == args.users
+
+    snapshot.export_snapshot(db, second, args.segments)
+    assert read_items(first) == read_items(second), 'round trip changed the table'
+    print(f'users={args.users} item_bytes={args.item_bytes} latency={args.latency_ms:g}ms '
+          f'unprocessed={args.unprocessed:g} segments={args.segments} writers={args.writers}')
+    print(f'snapshot: {os.path.getsize(first) / 1024:.0f} KB gzip, {pages} scan pages of up to 1 MB, '
+          f'{manifest["items"]} items, round trip OK')
+    print('| direction | seconds | items/s |')
+    print('|---|---|---|')
+    print(f'| export | {export_seconds:.2f} | {args.users / export_seconds:.0f} |')
+    print(f'| import | {import_seconds:.2f} | {args.users / import_seconds:.0f} |')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=50_000)
+    parser.add_argument('--item-bytes', type=int, default=200, help='размер дополнительного атрибута записи')
+    parser.add_argument('--segments', type=int, default=4)
+    parser.add_argument('--writers', type=int, default=8)
+    parser.add_argument('--latency-ms', type=float, default=5)
+    parser.add_argument('--unprocessed', type=float, default=0.05, help='доля записей в UnprocessedItems')
+    run(parser.parse_args())
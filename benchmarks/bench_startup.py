@@ -0,0 +1,85 @@
+"""
+Время запуска бота: импорт main.py (по `python -X importtime`) и время до обработки первого апдейта.
+
+Каждый замер выполняется в отдельном процессе. Хранилище - SQLiteDatabase в памяти, Bot API имитирует BenchSession,
+поэтому учитывается только время импорта, прогрева и первых хендлеров.
+
+    python benchmarks/bench_startup.py --runs 5
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+# пакеты, которые не должны загружаться при импорте main.py
+LAZY_MODULES = ('boto3', 'openpyxl', 'qrcode', 'segno', 'PIL', 'pymorphy3')
+ENV = {**os.environ, 'BOT_TOKEN': '42:bench', 'ADMINS': 'user1', 'STORAGE_BACKEND': 'sqlite', 'SQLITE_PATH': ':memory:'}
+
+
+def import_profile():
+    """Суммарное время импорта main и время пакетов из LAZY_MODULES, загруженных при импорте, мкс"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import main'],
+                            cwd=ROOT, env=ENV, capture_output=True, text=True, check=True)
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative_us, name = line.removeprefix('import time:').split('|')
+        cumulative[name.strip()] = int(cumulative_us)
+    return cumulative['main'], {name: cumulative[name] for name in LAZY_MODULES if name in cumulative}
+
+
+async def first_updates(started: float):
+    """Выполняется в дочернем процессе: этапы запуска, секунды от старта процесса"""
+    import main
+    marks = {'import': time.time() - started}
+    sys.path.insert(0, BENCH_DIR)
+    from bench_handlers import BenchSession, Unlimited, message
+
+    main.bot.session = BenchSession()
+    main.setup_dispatcher(limiter=Unlimited())
+    await main.warm_up()
+    marks['warm_up'] = time.time() - started
+    for name, text in (('first_update', '/start'), ('first_get', '/get 10'), ('first_table', '/table')):
+        await main.dp.feed_update(main.bot, message(1, text))
+        marks[name] = time.time() - started
+    return marks
+
+
+def measure_startup():
+    started = time.time()
+    result = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', str(started)],
+                            cwd=ROOT, env=ENV, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main(runs: int):
+    profiles = [import_profile() for _ in range(runs)]
+    print(f'import main: {statistics.median(total for total, _ in profiles) / 1000:.0f} ms (median of {runs})')
+    loaded = profiles[-1][1]
+    print('heavy packages loaded at import: ' +
+          (', '.join(f'{name} {us / 1000:.0f} ms' for name, us in loaded.items()) if loaded else 'none'))
+
+    marks = [measure_startup() for _ in range(runs)]
+    print('| stage | seconds since process start |')
+    print('|---|---|')
+    for stage in marks[0]:
+        print(f'| {stage} | {statistics.median(mark[stage] for mark in marks):.3f} |')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--child', type=float, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        sys.path.insert(0, ROOT)
+        print(json.dumps(asyncio.run(first_updates(args.child))))
+    else:
+        main(args.runs)
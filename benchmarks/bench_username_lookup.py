@@ -0,0 +1,140 @@
+"""
+Стоимость get_chat_id в зависимости от размера таблицы: запрос к индексу username против прежнего Scan с
+FilterExpression (здесь он дочитывает все страницы, прежний код читал только первую и не находил пользователей
+за ее пределами).
+
+DynamoDB заменяет StandInResource из bench_hot_account, дополненный Query по индексу username и Scan страницами
+до 1 МБ, как в DynamoDB. Каждый запрос добавляет задержку --latency-ms. Единицы чтения считаются по правилам
+DynamoDB для eventually consistent чтения: 0.5 RCU на каждые начатые 4 КБ прочитанных записей.
+
+    python benchmarks/bench_username_lookup.py --users 10000 100000 --lookups 200
+"""
+import argparse
+import math
+import os
+import random
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_hot_account import StandInDatabase, StandInResource, StandInStore, StandInTable  # noqa: E402
+
+PAGE_BYTES = 1024 * 1024
+
+
+def item_size(item: dict) -> int:
+    """Размер записи DynamoDB: имена атрибутов и значения"""
+    return sum(len(name) + len(str(value)) for name, value in item.items())
+
+
+class IndexedStore(StandInStore):
+    def __init__(self, latency: float):
+        super().__init__(latency=latency, item_write=0)
+        self.usernames = {}
+        self.ordered = []
+        self.stats = Counter()
+
+    def load(self, users: int):
+        for chat_id in range(users):
+            item = {'chat_id': chat_id, 'coins': chat_id % 1000, 'username': f'user{chat_id}'}
+            self.items[self.key('Users', {'chat_id': chat_id})] = item
+            self.usernames[item['username']] = chat_id
+            self.ordered.append(item)
+
+    def read(self, items: list):
+        self.stats['requests'] += 1
+        self.stats['items'] += len(items)
+        self.stats['rcu'] += math.ceil(sum(map(item_size, items)) / 4096) * 0.5 if items else 0.5
+
+
+class LookupTable(StandInTable):
+    def query(self, IndexName, KeyConditionExpression, ProjectionExpression=None, Limit=None):
+        time.sleep(self.store.latency)
+        username = KeyConditionExpression.get_expression()['values'][1]
+        chat_id = self.store.usernames.get(username)
+        # индекс KEYS_ONLY: читаются только ключи
+        items = [{'chat_id': chat_id, 'username': username}] if chat_id is not None else []
+        self.store.read(items)
+        return {'Items': [{'chat_id': chat_id}] if chat_id is not None else []}
+
+    def scan(self, FilterExpression, ExpressionAttributeValues, ExclusiveStartKey=None):
+        time.sleep(self.store.latency)
+        start = ExclusiveStartKey['chat_id'] + 1 if ExclusiveStartKey else 0
+        page, size = [], 0
+        for item in self.store.ordered[start:]:
+            if size >= PAGE_BYTES:
+                break
+            size += item_size(item)
+            page.append(item)
+        self.store.read(page)
+        # фильтр применяется после чтения, единицы чтения тратятся на всю страницу
+        username = ExpressionAttributeValues[':username']
+        response = {'Items': [dict(item) for item in page if item['username'] == username]}
+        if start + len(page) < len(self.store.ordered):
+            response['LastEvaluatedKey'] = {'chat_id': page[-1]['chat_id']}
+        return response
+
+
+class LookupResource(StandInResource):
+    def Table(self, name):
+        return LookupTable(self.store, name)
+
+
+class LookupDatabase(StandInDatabase):
+    def _make_resource(self):
+        return LookupResource(self.store)
+
+
+def scan_chat_id(db: LookupDatabase, username: str):
+    """get_chat_id до индекса username, дочитывающий все страницы Scan"""
+    kwargs = {'FilterExpression': 'username = :username', 'ExpressionAttributeValues': {':username': username}}
+    while True:
+        response = db.table.scan(**kwargs)
+        if response['Items']:
+            return response['Items'][0]['chat_id']
+        if 'LastEvaluatedKey' not in response:
+            return None
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def run(users: int, lookups: int, latency: float) -> list:
+    store = IndexedStore(latency)
+    store.load(users)
+    db = LookupDatabase(store)
+    names = [f'user{random.randrange(users)}' for _ in range(lookups)]
+    rows = []
+    for method, lookup in (('scan', lambda name: scan_chat_id(db, name)), ('index', db.get_chat_id)):
+        store.stats.clear()
+        start = time.perf_counter()
+        found = [lookup(name) for name in names]
+        elapsed = time.perf_counter() - start
+        assert found == [int(name[4:]) for name in names]
+        rows.append({
+            'users': users,
+            'method': method,
+            'ms': elapsed / lookups * 1000,
+            'requests': store.stats['requests'] / lookups,
+            'items': store.stats['items'] / lookups,
+            'rcu': store.stats['rcu'] / lookups,
+        })
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, nargs='+', default=[10_000, 100_000])
+    parser.add_argument('--lookups', type=int, default=200)
+    parser.add_argument('--latency-ms', type=float, default=5)
+    args = parser.parse_args()
+    random.seed(1)
+    print(f'lookups={args.lookups} latency={args.latency_ms:g}ms item_bytes~'
+          f'{item_size({"chat_id": 99999, "coins": 999, "username": "user99999"})}')
+    print('| users | lookup | ms/lookup | requests/lookup | items read/lookup | RCU/lookup |')
+    print('|---|---|---|---|---|---|')
+    for users in args.users:
+        for row in run(users, args.lookups, args.latency_ms / 1000):
+            print(f"| {row['users']} | {row['method']} | {row['ms']:.2f} | {row['requests']:.2f} "
+                  f"| {row['items']:.0f} | {row['rcu']:.1f} |")
@@ -0,0 +1,28 @@
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from metrics import HANDLER_LATENCY, HANDLER_ERRORS
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """Замеряет время выполнения каждого хендлера (регистрируется как inner middleware)"""
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any],
+    ) -> Any:
+        handler_object = data.get('handler')
+        name = handler_object.callback.__name__ if handler_object else 'unknown'
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - start, name)
@@ -1,22 +1,141 @@
-from typing import Any, Awaitable, Callable, Dict
+import asyncio
+import threading
+import time
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, NamedTuple, Union
 
 from aiogram import BaseMiddleware
-from aiogram.types import Message
+from aiogram.types import CallbackQuery, TelegramObject
+from botocore.exceptions import BotoCoreError, ClientError
 from cachetools import TTLCache
 
 
+class Limit(NamedTuple):
+    """interval - секунд на одно событие, burst - сколько событий можно отправить подряд"""
+    interval: float
+    burst: int = 1
+
+
+class MemoryRateLimiter:
+    """GCRA (token bucket) в памяти процесса. Хранится одно число на ключ, устаревшие ключи удаляются"""
+
+    def __init__(self, purge_every: int = 10_000):
+        self.tat: Dict[str, float] = {}
+        self.purge_every = purge_every
+        self.calls = 0
+
+    def _purge(self, now: float):
+        # ключ с tat <= now неотличим от нового, его можно удалить
+        self.tat = {key: tat for key, tat in self.tat.items() if tat > now}
+
+    async def allow(self, key: str, limit: Limit) -> bool:
+        now = time.monotonic()
+        self.calls += 1
+        if self.calls % self.purge_every == 0:
+            self._purge(now)
+        tat = max(self.tat.get(key, now), now)
+        if tat - now > limit.interval * (limit.burst - 1):
+            return False
+        self.tat[key] = tat + limit.interval
+        return True
+
+
+class DynamoRateLimiter:
+    """
+    GCRA в общей таблице DynamoDB, чтобы лимиты соблюдались между репликами бота.
+    Таблица: ключ `key` (S), устаревшие записи удаляются TTL по атрибуту `expires_at`.
+    """
+
+    def __init__(self, table_name: str, endpoint_url: str, access_key: str, secret_key: str, attempts: int = 3):
+        self.table_name = table_name
+        self.endpoint_url = endpoint_url
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.attempts = attempts
+        self._local = threading.local()
+
+    @property
+    def table(self):
+        """_allow выполняется в потоках asyncio.to_thread, а ресурсы boto3 не потокобезопасны: у каждого потока свой"""
+        table = getattr(self._local, 'table', None)
+        if table is None:
+            import boto3
+            table = self._local.table = boto3.session.Session().resource(
+                'dynamodb',
+                endpoint_url=self.endpoint_url,
+                region_name='us-east-1',
+                aws_access_key_id=self.access_key,
+                aws_secret_access_key=self.secret_key
+            ).Table(self.table_name)
+        return table
+
+    def _allow(self, key: str, limit: Limit) -> bool:
+        for _ in range(self.attempts):
+            now = time.time()
+            try:
+                item = self.table.get_item(Key={'key': key}, ConsistentRead=True).get('Item')
+                old_tat = float(item['tat']) if item else None
+                tat = max(old_tat or now, now)
+                if tat - now > limit.interval * (limit.burst - 1):
+                    return False
+                new_tat = tat + limit.interval
+                self.table.put_item(
+                    Item={'key': key, 'tat': str(new_tat), 'expires_at': int(new_tat) + 1},
+                    ConditionExpression='attribute_not_exists(#key) OR tat = :old_tat',
+                    ExpressionAttributeNames={'#key': 'key'},
+                    ExpressionAttributeValues={':old_tat': item['tat'] if item else '-'}
+                )
+                return True
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    # при недоступности хранилища не блокируем пользователей
+                    print(f"Error in DynamoRateLimiter: {e}")
+                    return True
+            except BotoCoreError as e:
+                print(f"Error in DynamoRateLimiter: {e}")
+                return True
+        return False
+
+    async def allow(self, key: str, limit: Limit) -> bool:
+        return await asyncio.to_thread(self._allow, key, limit)
+
+
 class ThrottlingMiddleware(BaseMiddleware):
-    def __init__(self, time_limit: int = 2):
-        self.limit = TTLCache(maxsize=10_000, ttl=time_limit)
+    def __init__(self, limiter: Union[MemoryRateLimiter, DynamoRateLimiter, None] = None,
+                 limits: Union[Dict[str, Limit], None] = None, default: Limit = Limit(2)):
+        """
+        :param limiter: Хранилище лимитов, по умолчанию в памяти процесса.
+        :param limits: Лимиты по команде (`get`, `table`) или префиксу callback_data до `_`
+            (`c` - подтверждение перевода).
+        :param default: Лимит для остальных сообщений и callback.
+        """
+        self.limiter = limiter or MemoryRateLimiter()
+        self.limits = limits or {}
+        self.default = default
+        self.notified = TTLCache(maxsize=10_000, ttl=default.interval)
+        self.stats = Counter()
+
+    @staticmethod
+    def event_name(event: TelegramObject) -> str:
+        if isinstance(event, CallbackQuery):
+            return (event.data or '').split('_')[0]
+        text = getattr(event, 'text', None) or ''
+        if text.startswith('/'):
+            return text.split()[0][1:].split('@')[0]
+        return 'message'
 
     async def __call__(
             self,
-            handler: Callable[[Message, Dict[str, Any]], Awaitable[Any]],
-            event: Message,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
             data: Dict[str, Any],
     ) -> Any:
-        if event.chat.id in self.limit:
-            return
-        else:
-            self.limit[event.chat.id] = None
-        return await handler(event, data)
+        name = self.event_name(event)
+        key = f'{event.from_user.id}:{name}'
+        if await self.limiter.allow(key, self.limits.get(name, self.default)):
+            self.stats['allowed'] += 1
+            return await handler(event, data)
+        self.stats['rejected'] += 1
+        if key not in self.notified:
+            self.notified[key] = None
+            await event.answer('Слишком много запросов, подождите')
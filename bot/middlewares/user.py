@@ -0,0 +1,27 @@
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+
+class UserMiddleware(BaseMiddleware):
+    """
+    Загружает запись пользователя один раз на апдейт и передает ее в хендлер как `user`.
+    Хендлеры без параметра `user` (подтверждение перевода, страницы истории) не обращаются к хранилищу.
+    """
+
+    def __init__(self, database):
+        self.database = database
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any],
+    ) -> Any:
+        handler_object = data.get('handler')
+        if handler_object is not None and 'user' not in handler_object.params:
+            return await handler(event, data)
+        from_user = getattr(event, 'from_user', None)
+        data['user'] = await self.database.user_exist(from_user.id) if from_user else None
+        return await handler(event, data)
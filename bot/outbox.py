@@ -0,0 +1,179 @@
+import asyncio
+import itertools
+import logging
+import time
+from collections import Counter
+from typing import Iterator, List, NamedTuple, Union
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramNetworkError, TelegramRetryAfter
+from cachetools import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+class OutgoingMessage(NamedTuple):
+    chat_id: int
+    text: str
+    attempt: int = 0
+
+
+class TokenBucket:
+    """
+    Глобальный лимит отправки: rate сообщений в секунду с запасом burst.
+    pause() останавливает выдачу токенов, пока действует retry_after от Telegram.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class Outbox:
+    """
+    Очередь исходящих сообщений. Хендлеры только ставят сообщения в очередь (send),
+    воркеры отправляют их с соблюдением глобального лимита Telegram и интервала между сообщениями в один чат.
+    При 429 (TelegramRetryAfter) отправка приостанавливается на retry_after и сообщение возвращается в очередь.
+    """
+
+    def __init__(self, bot: Bot, rate: float = 25, per_chat_interval: float = 1.0, workers: int = 4,
+                 maxsize: int = 10_000, max_attempts: int = 5):
+        """
+        :param rate: Сообщений в секунду для всего бота (лимит Telegram - около 30).
+        :param per_chat_interval: Минимальный интервал между сообщениями в один чат, секунд.
+        :param workers: Количество одновременных запросов к Bot API.
+        :param maxsize: Размер очереди для новых сообщений: send при переполнении отклоняет сообщение,
+            broadcast ждет освобождения места. Повторные попытки возвращаются в очередь без ограничения.
+        :param max_attempts: Количество попыток отправки при сетевых ошибках и 429.
+        """
+        self.bot = bot
+        self.bucket = TokenBucket(rate, burst=max(1, int(rate)))
+        self.per_chat_interval = per_chat_interval
+        self.max_attempts = max_attempts
+        self.maxsize = maxsize
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.has_space = asyncio.Event()
+        self.workers = workers
+        self.tasks: List[asyncio.Task] = []
+        # chat_id -> время, раньше которого нельзя отправлять в этот чат
+        self.next_send = TTLCache(maxsize=100_000, ttl=max(per_chat_interval * 10, 60))
+        self.stats = Counter()
+
+    def depth(self) -> int:
+        return self.queue.qsize()
+
+    def send(self, chat_id: int, text: str) -> bool:
+        """
+        Ставит сообщение в очередь, не дожидаясь отправки.
+        :return: False, если очередь переполнена.
+        """
+        if self.queue.qsize() >= self.maxsize:
+            self.stats['rejected'] += 1
+            logger.warning('Outbox is full, message to %s dropped', chat_id)
+            return False
+        self.queue.put_nowait(OutgoingMessage(chat_id, text))
+        self.stats['queued'] += 1
+        return True
+
+    async def broadcast(self, recipients: Iterator[dict], text: str, batch_size: int = 100) -> int:
+        """
+        Рассылка по потоковому обходу таблицы пользователей.
+        Пачки chat_id читаются из синхронного генератора в отдельном потоке, а постановка в очередь
+        ждет свободного места, поэтому в памяти одновременно находится не больше очереди и одной пачки.
+        :param recipients: Генератор записей с ключом chat_id (например, database.scan_items(['chat_id'])).
+        :return: Количество поставленных в очередь сообщений.
+        """
+        queued = 0
+        while batch := await asyncio.to_thread(lambda: list(itertools.islice(recipients, batch_size))):
+            for item in batch:
+                while self.queue.qsize() >= self.maxsize:
+                    self.has_space.clear()
+                    await self.has_space.wait()
+                self.queue.put_nowait(OutgoingMessage(int(item['chat_id']), text))
+            queued += len(batch)
+            self.stats['queued'] += len(batch)
+        return queued
+
+    async def _wait_for_chat(self, chat_id: int):
+        # слот резервируется после получения глобального токена, чтобы после паузы 429
+        # сообщения в один чат не ушли одновременно
+        now = time.monotonic()
+        slot = max(now, self.next_send.get(chat_id, now))
+        self.next_send[chat_id] = slot + self.per_chat_interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    def _retry(self, message: OutgoingMessage, reason: str) -> bool:
+        if message.attempt + 1 >= self.max_attempts:
+            self.stats['failed'] += 1
+            logger.warning('Message to %s dropped after %s attempts: %s', message.chat_id, self.max_attempts, reason)
+            return False
+        self.queue.put_nowait(message._replace(attempt=message.attempt + 1))
+        self.stats['retried'] += 1
+        return True
+
+    async def _deliver(self, message: OutgoingMessage):
+        await self.bucket.acquire()
+        await self._wait_for_chat(message.chat_id)
+        try:
+            await self.bot.send_message(chat_id=message.chat_id, text=message.text)
+            self.stats['sent'] += 1
+        except TelegramRetryAfter as e:
+            self.stats['retry_after'] += 1
+            self.bucket.pause(e.retry_after)
+            self._retry(message, 'retry after')
+        except (TelegramForbiddenError, TelegramBadRequest) as e:
+            # пользователь заблокировал бота или чат не существует - повтор не поможет
+            self.stats['undeliverable'] += 1
+            logger.info('Message to %s is undeliverable: %s', message.chat_id, e)
+        except TelegramNetworkError as e:
+            if message.attempt + 1 < self.max_attempts:
+                await asyncio.sleep(min(2 ** message.attempt, 30))
+            self._retry(message, str(e))
+
+    async def _worker(self):
+        while True:
+            message = await self.queue.get()
+            self.has_space.set()
+            try:
+                await self._deliver(message)
+            except Exception:
+                self.stats['failed'] += 1
+                logger.exception('Error while sending message to %s', message.chat_id)
+            finally:
+                self.queue.task_done()
+
+    def start(self):
+        self.tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, timeout: Union[float, None] = None):
+        """Дожидается отправки сообщений из очереди (не дольше timeout) и останавливает воркеры"""
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning('Outbox stopped with %s unsent messages', self.depth())
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
@@ -0,0 +1,115 @@
+import asyncio
+import logging
+from collections import Counter
+from typing import List, Union
+
+from aiogram import Bot, Dispatcher, types
+from aiohttp import web
+
+from metrics import Gauge
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateQueue:
+    """
+    Ограниченная очередь апдейтов с пулом воркеров.
+    Апдейты одного чата всегда попадают к одному воркеру, поэтому обрабатываются по порядку.
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot, workers: int = 8, maxsize: int = 1000):
+        """
+        :param workers: Количество одновременно работающих воркеров.
+        :param maxsize: Суммарный размер очередей; при переполнении новые апдейты отклоняются.
+        """
+        self.dp = dp
+        self.bot = bot
+        self.queues: List[asyncio.Queue] = [asyncio.Queue(maxsize=max(1, maxsize // workers)) for _ in range(workers)]
+        self.tasks: List[asyncio.Task] = []
+        self.stats = Counter()
+
+    @staticmethod
+    def chat_key(update: types.Update) -> int:
+        event = update.event
+        chat = getattr(event, 'chat', None)
+        if chat is not None:
+            return chat.id
+        from_user = getattr(event, 'from_user', None)
+        return from_user.id if from_user is not None else update.update_id
+
+    def depth(self) -> int:
+        return sum(queue.qsize() for queue in self.queues)
+
+    def submit(self, update: types.Update) -> bool:
+        """
+        :return: False, если очередь воркера переполнена (Telegram повторит доставку позже).
+        """
+        queue = self.queues[self.chat_key(update) % len(self.queues)]
+        try:
+            queue.put_nowait(update)
+        except asyncio.QueueFull:
+            self.stats['rejected'] += 1
+            return False
+        self.stats['accepted'] += 1
+        return True
+
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            update = await queue.get()
+            try:
+                await self.dp.feed_update(self.bot, update)
+                self.stats['processed'] += 1
+            except Exception:
+                self.stats['failed'] += 1
+                logger.exception('Error while processing update %s', update.update_id)
+            finally:
+                queue.task_done()
+
+    def start(self):
+        self.tasks = [asyncio.create_task(self._worker(queue)) for queue in self.queues]
+
+    async def stop(self):
+        """Дожидается обработки принятых апдейтов и останавливает воркеры"""
+        for queue in self.queues:
+            await queue.join()
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+
+def create_app(update_queue: UpdateQueue, path: str = '/webhook', secret_token: Union[str, None] = None) -> web.Application:
+    """
+    aiohttp-приложение, принимающее апдейты Telegram (или записанные JSON апдейты при локальном тестировании).
+    Порт вебхука открыт наружу, поэтому метрики и счетчики очереди отдает только start_metrics_server.
+    """
+
+    async def handle_update(request: web.Request) -> web.Response:
+        if secret_token and request.headers.get('X-Telegram-Bot-Api-Secret-Token') != secret_token:
+            return web.Response(status=401)
+        update = types.Update.model_validate(await request.json(), context={'bot': update_queue.bot})
+        if not update_queue.submit(update):
+            return web.Response(status=503)
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(path, handle_update)
+    return app
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, url: str, host: str = '0.0.0.0', port: int = 8080,
+                      path: str = '/webhook', secret_token: Union[str, None] = None,
+                      workers: int = 8, maxsize: int = 1000):
+    update_queue = UpdateQueue(dp, bot, workers=workers, maxsize=maxsize)
+    Gauge('litoken_webhook_updates', 'Webhook queue counters and depth', 'event',
+          lambda: {**update_queue.stats, 'depth': update_queue.depth()})
+    runner = web.AppRunner(create_app(update_queue, path, secret_token))
+    await runner.setup()
+    update_queue.start()
+    await web.TCPSite(runner, host, port).start()
+    # в отличие от polling, накопившиеся апдейты не сбрасываются
+    await bot.set_webhook(url + path, secret_token=secret_token, drop_pending_updates=False)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+        await update_queue.stop()
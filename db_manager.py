@@ -1,26 +1,340 @@
-import boto3
-from botocore.exceptions import ClientError
+import asyncio
+import queue
+import random
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 
-from typing import Union, List, Tuple
+from botocore.exceptions import BotoCoreError, ClientError
 
+from enum import Enum
+from typing import Union, List, Tuple, Iterator, Iterable, Dict, Protocol
 
+from dynamo_client import THROTTLING_ERRORS, ResilientClient, StorageError, StorageThrottled
+from metrics import instrument_methods, DB_LATENCY, DB_ERRORS, DB_THROTTLES
+
+
+class TransferResult(Enum):
+    """
+    Результат перевода токенов между пользователями.
+    """
+    OK = 'ok'
+    INSUFFICIENT_FUNDS = 'insufficient_funds'
+    RECIPIENT_MISSING = 'recipient_missing'
+    SAME_USER = 'same_user'
+    THROTTLED = 'throttled'
+    ERROR = 'error'
+
+    @classmethod
+    def from_error(cls, error: ClientError) -> 'TransferResult':
+        """
+        Определяет причину отмены TransactWriteItems (списание - первая операция, зачисление - вторая).
+        """
+        code = error.response.get('Error', {}).get('Code')
+        if code in THROTTLING_ERRORS:
+            return cls.THROTTLED
+        reasons = [reason.get('Code') for reason in error.response.get('CancellationReasons', [])]
+        if any(reason in THROTTLING_ERRORS for reason in reasons):
+            return cls.THROTTLED
+        if reasons and reasons[0] == 'ConditionalCheckFailed':
+            return cls.INSUFFICIENT_FUNDS
+        if len(reasons) > 1 and reasons[1] == 'ConditionalCheckFailed':
+            return cls.RECIPIENT_MISSING
+        return cls.ERROR
+
+
+def report_error(method: str, error: ClientError):
+    code = error.response.get('Error', {}).get('Code', 'Unknown')
+    DB_ERRORS.inc(method, code)
+    if code in THROTTLING_ERRORS:
+        DB_THROTTLES.inc(method)
+    print(f"Error in {method}: {error}")
+
+
+# префикс ts меток массовых начислений в журнале: '#' сортируется перед цифрами ts записей журнала
+BULK_MARKER = '#bulk:'
+
+
+class BulkResult(Enum):
+    """
+    Результат зачисления одному пользователю при массовом начислении.
+    """
+    CREDITED = 'credited'
+    ALREADY_CREDITED = 'already_credited'
+    NOT_FOUND = 'not_found'
+    ERROR = 'error'
+
+
+class Storage(Protocol):
+    """
+    Синхронный интерфейс хранилища пользователей. Реализации: Database (DynamoDB) и SQLiteDatabase.
+    """
+
+    def warm_up(self) -> bool: ...
+
+    def user_exist(self, chat_id: int) -> Union[dict, None]: ...
+
+    def add_user(self, chat_id: int, coins: int, username: str) -> bool: ...
+
+    def is_username_correct(self, chat_id: int, username: str) -> bool: ...
+
+    def update_username(self, chat_id: int, new_username: str) -> bool: ...
+
+    def add_coins(self, chat_id: int, amount: int, kind: str = 'admin') -> bool: ...
+
+    def subtract_coins(self, chat_id: int, amount: int, kind: str = 'admin') -> bool: ...
+
+    def get_transaction_verdict(self, chat_id: int, amount: int) -> Union[bool, None]: ...
+
+    def transaction(self, chat_id: int, to_chat_id: int, amount: int) -> 'TransferResult': ...
+
+    def bulk_add_coins(self, usernames: Iterable[str], amount: int, operation_id: str) -> Dict[str, 'BulkResult']: ...
+
+    def get_username(self, chat_id: int) -> Union[str, None]: ...
+
+    def get_chat_id(self, username: str) -> Union[int, None]: ...
+
+    def create_username_index(self) -> bool: ...
+
+    def get_balance(self, chat_id: int) -> Union[int, None]: ...
+
+    def get_history(self, chat_id: int, limit: int = 10,
+                    cursor: Union[str, None] = None) -> Tuple[List[dict], Union[str, None]]: ...
+
+    def reconcile(self) -> Dict[int, Tuple[int, int]]: ...
+
+    def scan_items(self, projection: Union[List[str], None] = None, segments: int = 1) -> Iterator[dict]: ...
+
+    def iter_data(self, segments: int = 1) -> Iterator[Tuple[int, str]]: ...
+
+    def get_data(self) -> List[Tuple[int, str]]: ...
+
+    def print_all(self): ...
+
+    def delete_all(self, segments: int = 4) -> int: ...
+
+    def put_items(self, items: Iterable[dict], writers: int = 4) -> int: ...
+
+    def insert_items(self, items: Iterable[dict], writers: int = 4) -> int: ...
+
+    def clear_all(self): ...
+
+    def compact_balances(self) -> Dict[int, bool]: ...
+
+
+@instrument_methods(DB_LATENCY)
 class Database:
-    def __init__(self, table_name: str, endpoint_url: str, access_key: str, secret_key: str):
+    def __init__(self, table_name: str, endpoint_url: str, access_key: str, secret_key: str,
+                 max_pool_connections: int = 10, username_index: str = 'username-index',
+                 ledger_table_name: Union[str, None] = None, shard_table_name: Union[str, None] = None,
+                 hot_accounts: Iterable[int] = (), balance_shards: int = 8,
+                 client: Union[ResilientClient, None] = None, bulk_op_ttl: int = 7 * 86400):
         """
         Инициализация подключения к DynamoDB.
         :param table_name: Имя таблицы в DynamoDB.
         :param access_key: AWS Access Key ID.
         :param secret_key: AWS Secret Access Key.
+        :param max_pool_connections: Размер пула HTTP-соединений.
+        :param username_index: Имя глобального вторичного индекса по username.
+        :param ledger_table_name: Таблица журнала операций (ключи chat_id (N) и ts (S)); None - журнал не ведется.
+        :param shard_table_name: Таблица шардов баланса (ключи chat_id (N) и shard (N)) для горячих аккаунтов.
+        :param hot_accounts: chat_id получателей, зачисления которым распределяются по шардам
+            (учитель, QR код которого одновременно сканирует весь класс).
+        :param balance_shards: Количество шардов на горячий аккаунт.
+        :param client: Повторы, бюджет повторов, автомат отключения и hedged get_item для всех запросов.
+            Ошибки троттлинга и недоступности после повторов пробрасываются как StorageThrottled и StorageUnavailable.
+        :param bulk_op_ttl: Сколько секунд хранится метка массового начисления; повторная доставка команды позже
+            начислит монеты еще раз.
         """
         self.table_name = table_name
-        self.dynamodb = boto3.resource(
+        self.ledger_table_name = ledger_table_name
+        self.shard_table_name = shard_table_name
+        self.hot_accounts = frozenset(hot_accounts) if shard_table_name else frozenset()
+        self.balance_shards = balance_shards
+        self.bulk_op_ttl = bulk_op_ttl
+        self.username_index = username_index
+        self.endpoint_url = endpoint_url
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.max_pool_connections = max_pool_connections
+        self.dynamo = client or ResilientClient()
+        # boto3 импортируется и ресурс создается при первом запросе или в warm_up, а не при импорте модуля
+        self._local = threading.local()
+
+    def _make_resource(self):
+        import boto3
+        from botocore.config import Config
+        return boto3.session.Session().resource(
             'dynamodb',
-            endpoint_url=endpoint_url,
+            endpoint_url=self.endpoint_url,
             region_name='us-east-1',
-            aws_access_key_id=access_key,
-            aws_secret_access_key=secret_key
+            aws_access_key_id=self.access_key,
+            aws_secret_access_key=self.secret_key,
+            # повторяет запросы ResilientClient, встроенные повторы botocore умножили бы их количество
+            config=Config(max_pool_connections=self.max_pool_connections, retries={'total_max_attempts': 1})
         )
-        self.table = self.dynamodb.Table(table_name)
+
+    @property
+    def resource(self):
+        """
+        Ресурсы boto3 не потокобезопасны, поэтому у каждого потока свой экземпляр ресурса и таблиц.
+        """
+        resource = getattr(self._local, 'resource', None)
+        if resource is None:
+            resource = self._local.resource = self._make_resource()
+        return resource
+
+    def _thread_table(self, attr: str, table_name: str):
+        table = getattr(self._local, attr, None)
+        if table is None:
+            table = self.resource.Table(table_name)
+            setattr(self._local, attr, table)
+        return table
+
+    @property
+    def table(self):
+        return self._thread_table('table', self.table_name)
+
+    def warm_up(self) -> bool:
+        """
+        Создает ресурс boto3 текущего потока и открывает соединение запросом DescribeTable,
+        при включенном втором get_item - один раз во всех потоках его пула.
+        :return: True, если таблица доступна и индекс username создан.
+        """
+        try:
+            self.dynamo.call('DescribeTable', self.table.load)
+        except ClientError as e:
+            report_error('warm_up', e)
+            return False
+        except (BotoCoreError, StorageError) as e:
+            print(f"Error in warm_up: {e}")
+            return False
+        # потоки пула второго get_item создают свои ресурсы boto3 сейчас, а не во время медленного ответа
+        self.dynamo.warm_up_hedges(lambda: self.dynamo.call('DescribeTable', self.table.load))
+        indexes = {index['IndexName']: index.get('IndexStatus') for index in self.table.global_secondary_indexes or []}
+        if indexes.get(self.username_index) != 'ACTIVE':
+            # без индекса get_chat_id не находит пользователей: /add, /sub и /add_std не работают
+            print(f"Error in warm_up: index {self.username_index} is {indexes.get(self.username_index, 'missing')}, "
+                  f"run create_username_index")
+            return False
+        return True
+
+    @property
+    def ledger_table(self):
+        return self._thread_table('ledger_table', self.ledger_table_name)
+
+    @property
+    def shard_table(self):
+        return self._thread_table('shard_table', self.shard_table_name)
+
+    def _ledger_put(self, chat_id: int, delta: int, kind: str, counterparty: Union[int, None] = None) -> dict:
+        # ts сортируется по времени, суффикс исключает совпадение записей одного пользователя
+        ts = f'{time.time_ns():020d}-{secrets.token_hex(3)}'
+        item = {'chat_id': chat_id, 'ts': ts, 'delta': delta, 'kind': kind}
+        if counterparty is not None:
+            item['counterparty'] = counterparty
+        return {'Put': {'TableName': self.ledger_table_name, 'Item': item,
+                        'ConditionExpression': 'attribute_not_exists(ts)'}}
+
+    def _update_balance(self, update: dict, entries: List[dict], shard: bool = False):
+        """
+        Изменяет баланс и записывает операции в журнал одной транзакцией.
+        Без журнала выполняется обычный update_item; он не повторяется после таймаута или 5xx,
+        потому что coins = coins + :amount мог уже примениться. Транзакция повторяется с тем же токеном.
+        :param shard: update относится к таблице шардов.
+        """
+        table, table_name = (self.shard_table, self.shard_table_name) if shard else (self.table, self.table_name)
+        if self.ledger_table_name is None:
+            self.dynamo.call('UpdateItem', table.update_item, idempotent=False, **update)
+        else:
+            self._transact([{'Update': {'TableName': table_name, **update}}] + entries)
+
+    def _transact(self, items: List[dict]):
+        """
+        TransactWriteItems через ResilientClient. ClientRequestToken один на все попытки, поэтому повтор
+        после таймаута или 5xx не применит транзакцию второй раз.
+        """
+        self.dynamo.call('TransactWriteItems', self.table.meta.client.transact_write_items,
+                         TransactItems=items, ClientRequestToken=secrets.token_hex(16))
+
+    def _shard_credit(self, chat_id: int, amount: int) -> dict:
+        """
+        Зачисление горячему аккаунту в случайный шард: одновременные зачисления пишут в разные записи
+        и не упираются в лимит записи одного ключа.
+        """
+        return {
+            'Key': {'chat_id': chat_id, 'shard': random.randrange(self.balance_shards)},
+            'UpdateExpression': 'SET coins = if_not_exists(coins, :zero) + :amount',
+            'ExpressionAttributeValues': {':amount': amount, ':zero': 0},
+        }
+
+    def _batch_get(self, request_items: dict) -> Dict[str, List[dict]]:
+        """
+        BatchGetItem через ResilientClient; необработанные ключи (UnprocessedKeys) запрашиваются повторно
+        с растущей задержкой.
+        :raises StorageThrottled: Ключи остались необработанными после max_attempts запросов.
+        """
+        responses, attempt = {}, 0
+        while request_items:
+            response = self.dynamo.call('BatchGetItem', self.resource.batch_get_item, RequestItems=request_items)
+            for table_name, items in response.get('Responses', {}).items():
+                responses.setdefault(table_name, []).extend(items)
+            request_items = response.get('UnprocessedKeys')
+            if request_items:
+                attempt += 1
+                if attempt >= self.dynamo.max_attempts:
+                    raise StorageThrottled('BatchGetItem', f'keys unprocessed after {attempt} attempts')
+                time.sleep(self.dynamo.backoff(attempt))
+        return responses
+
+    def _shard_keys(self, chat_id: int) -> List[dict]:
+        return [{'chat_id': chat_id, 'shard': shard} for shard in range(self.balance_shards)]
+
+    def _read_shards(self, chat_id: int) -> Dict[int, int]:
+        items = self._batch_get({self.shard_table_name: {'Keys': self._shard_keys(chat_id)}})
+        return {int(item['shard']): item.get('coins', 0) for item in items.get(self.shard_table_name, [])}
+
+    def compact(self, chat_id: int) -> bool:
+        """
+        Переносит накопленные в шардах зачисления в запись пользователя одной транзакцией.
+        Шард уменьшается ровно на прочитанную сумму, поэтому зачисления, пришедшие во время компактации, не теряются.
+        :return: True, если переносить нечего или перенос выполнен.
+        """
+        try:
+            moving = {shard: coins for shard, coins in self._read_shards(chat_id).items() if coins}
+            if not moving:
+                return True
+            self._transact([
+                {'Update': {
+                    'TableName': self.table_name,
+                    'Key': {'chat_id': chat_id},
+                    'UpdateExpression': 'SET coins = coins + :amount',
+                    'ConditionExpression': 'attribute_exists(chat_id)',
+                    'ExpressionAttributeValues': {':amount': sum(moving.values())},
+                }},
+            ] + [{'Update': {
+                'TableName': self.shard_table_name,
+                'Key': {'chat_id': chat_id, 'shard': shard},
+                'UpdateExpression': 'SET coins = coins - :amount',
+                'ConditionExpression': 'coins >= :amount',
+                'ExpressionAttributeValues': {':amount': coins},
+            }} for shard, coins in moving.items()])
+            return True
+        except ClientError as e:
+            report_error('compact', e)
+            return False
+        except StorageError as e:
+            print(f"Error in compact: {e}")
+            return False
+
+    def compact_balances(self) -> Dict[int, bool]:
+        """
+        Периодическая компактация всех горячих аккаунтов.
+        :return: Результат compact для каждого горячего аккаунта.
+        """
+        return {chat_id: self.compact(chat_id) for chat_id in self.hot_accounts}
 
     def user_exist(self, chat_id: int) -> Union[dict, None]:
         """
@@ -29,10 +343,24 @@ class Database:
         :return: Данные пользователя или None, если пользователь не найден.
         """
         try:
-            response = self.table.get_item(Key={'chat_id': chat_id})
-            return response.get('Item')
+            if chat_id not in self.hot_accounts:
+                # get_item идемпотентен, поэтому медленный ответ можно продублировать вторым запросом
+                return self.dynamo.hedged(
+                    'GetItem', lambda: self.table.get_item(Key={'chat_id': chat_id})).get('Item')
+            # запись пользователя и все шарды читаются одним BatchGetItem
+            responses = self._batch_get({
+                self.table_name: {'Keys': [{'chat_id': chat_id}]},
+                self.shard_table_name: {'Keys': self._shard_keys(chat_id)},
+            })
+            users = responses.get(self.table_name)
+            if not users:
+                return None
+            user = users[0]
+            user['coins'] = user.get('coins', 0) + sum(item.get('coins', 0)
+                                                       for item in responses.get(self.shard_table_name, []))
+            return user
         except ClientError as e:
-            print(f"Error in user_exist: {e}")
+            report_error('user_exist', e)
             return None
 
     def add_user(self, chat_id: int, coins: int, username: str) -> bool:
@@ -44,16 +372,21 @@ class Database:
         :return: True, если операция успешна, иначе False.
         """
         try:
-            self.table.put_item(
-                Item={
-                    'chat_id': chat_id,
-                    'coins': coins,
-                    'username': username
-                }
-            )
+            item = {
+                'chat_id': chat_id,
+                'coins': coins,
+                'username': username
+            }
+            if self.ledger_table_name is None:
+                self.dynamo.call('PutItem', self.table.put_item, Item=item)
+            else:
+                self._transact([
+                    {'Put': {'TableName': self.table_name, 'Item': item}},
+                    self._ledger_put(chat_id, coins, 'open'),
+                ])
             return True
         except ClientError as e:
-            print(f"Error in add_user: {e}")
+            report_error('add_user', e)
             return False
 
     def is_username_correct(self, chat_id: int, username: str) -> bool:
@@ -67,7 +400,7 @@ class Database:
             user = self.user_exist(chat_id)
             return user and user.get('username') == username
         except ClientError as e:
-            print(f"Error in is_username_correct: {e}")
+            report_error('is_username_correct', e)
             return False
 
     def update_username(self, chat_id: int, new_username: str) -> bool:
@@ -78,50 +411,57 @@ class Database:
         :return: True, если операция успешна, иначе False.
         """
         try:
-            self.table.update_item(
+            self.dynamo.call(
+                'UpdateItem', self.table.update_item,
                 Key={'chat_id': chat_id},
                 UpdateExpression='SET username = :username',
                 ExpressionAttributeValues={':username': new_username}
             )
             return True
         except ClientError as e:
-            print(f"Error in update_username: {e}")
+            report_error('update_username', e)
             return False
 
-    def add_coins(self, chat_id: int, amount: int) -> bool:
+    def add_coins(self, chat_id: int, amount: int, kind: str = 'admin') -> bool:
         """
         Добавляет монеты к балансу пользователя.
         :param chat_id: Уникальный идентификатор пользователя.
         :param amount: Количество монет для добавления.
+        :param kind: Тип операции для журнала.
         :return: True, если операция успешна, иначе False.
         """
         try:
-            self.table.update_item(
-                Key={'chat_id': chat_id},
-                UpdateExpression='SET coins = coins + :amount',
-                ExpressionAttributeValues={':amount': amount}
-            )
+            if chat_id in self.hot_accounts:
+                self._update_balance(self._shard_credit(chat_id, amount), [self._ledger_put(chat_id, amount, kind)],
+                                     shard=True)
+                return True
+            self._update_balance({
+                'Key': {'chat_id': chat_id},
+                'UpdateExpression': 'SET coins = coins + :amount',
+                'ExpressionAttributeValues': {':amount': amount},
+            }, [self._ledger_put(chat_id, amount, kind)])
             return True
         except ClientError as e:
-            print(f"Error in add_coins: {e}")
+            report_error('add_coins', e)
             return False
 
-    def subtract_coins(self, chat_id: int, amount: int) -> bool:
+    def subtract_coins(self, chat_id: int, amount: int, kind: str = 'admin') -> bool:
         """
         Вычитает монеты из баланса пользователя.
         :param chat_id: Уникальный идентификатор пользователя.
         :param amount: Количество монет для вычитания.
+        :param kind: Тип операции для журнала.
         :return: True, если операция успешна, иначе False.
         """
         try:
-            self.table.update_item(
-                Key={'chat_id': chat_id},
-                UpdateExpression='SET coins = coins - :amount',
-                ExpressionAttributeValues={':amount': amount}
-            )
+            self._update_balance({
+                'Key': {'chat_id': chat_id},
+                'UpdateExpression': 'SET coins = coins - :amount',
+                'ExpressionAttributeValues': {':amount': amount},
+            }, [self._ledger_put(chat_id, -amount, kind)])
             return True
         except ClientError as e:
-            print(f"Error in subtract_coins: {e}")
+            report_error('subtract_coins', e)
             return False
 
     def get_transaction_verdict(self, chat_id: int, amount: int) -> Union[bool, None]:
@@ -137,26 +477,132 @@ class Database:
                 return True
             return False
         except ClientError as e:
-            print(f"Error in get_transaction_verdict: {e}")
+            report_error('get_transaction_verdict', e)
             return None
 
-    def transaction(self, chat_id: int, to_chat_id: int, amount: int) -> bool:
+    def transaction(self, chat_id: int, to_chat_id: int, amount: int) -> 'TransferResult':
         """
-        Выполняет транзакцию между двумя пользователями.
+        Выполняет транзакцию между двумя пользователями одним запросом TransactWriteItems:
+        списание выполняется только при достаточном балансе, зачисление - только существующему получателю.
+        Горячему получателю сумма зачисляется в шард, а существование записи проверяется ConditionCheck.
+        Если у горячего отправителя не хватает средств в записи пользователя, шарды компактируются
+        и перевод повторяется.
         :param chat_id: Уникальный идентификатор отправителя.
         :param to_chat_id: Уникальный идентификатор получателя.
         :param amount: Количество монет для перевода.
-        :return: True, если транзакция успешна, иначе False.
+        :return: Результат перевода TransferResult.
         """
+        if chat_id == to_chat_id:
+            return TransferResult.SAME_USER
+        entries = []
+        if self.ledger_table_name is not None:
+            entries = [self._ledger_put(chat_id, -amount, 'transfer', to_chat_id),
+                       self._ledger_put(to_chat_id, amount, 'transfer', chat_id)]
+        # порядок важен для TransferResult.from_error: списание - первая операция, проверка получателя - вторая
+        items = [{'Update': {
+            'TableName': self.table_name,
+            'Key': {'chat_id': chat_id},
+            'UpdateExpression': 'SET coins = coins - :amount',
+            'ConditionExpression': 'coins >= :amount',
+            'ExpressionAttributeValues': {':amount': amount},
+        }}]
+        if to_chat_id in self.hot_accounts:
+            items += [
+                {'ConditionCheck': {
+                    'TableName': self.table_name,
+                    'Key': {'chat_id': to_chat_id},
+                    'ConditionExpression': 'attribute_exists(chat_id)',
+                }},
+                {'Update': {'TableName': self.shard_table_name, **self._shard_credit(to_chat_id, amount)}},
+            ]
+        else:
+            items.append({'Update': {
+                'TableName': self.table_name,
+                'Key': {'chat_id': to_chat_id},
+                'UpdateExpression': 'SET coins = coins + :amount',
+                'ConditionExpression': 'attribute_exists(chat_id)',
+                'ExpressionAttributeValues': {':amount': amount},
+            }})
+        result = self._transact_transfer(items + entries)
+        if result is TransferResult.INSUFFICIENT_FUNDS and chat_id in self.hot_accounts and self.compact(chat_id):
+            result = self._transact_transfer(items + entries)
+        return result
+
+    def _transact_transfer(self, items: List[dict]) -> 'TransferResult':
         try:
-            if self.get_transaction_verdict(chat_id, amount):
-                self.subtract_coins(chat_id, amount)
-                self.add_coins(to_chat_id, amount)
-                return True
-            return False
-        except ClientError as e:
+            self._transact(items)
+            return TransferResult.OK
+        except StorageThrottled:
+            return TransferResult.THROTTLED
+        except StorageError as e:
             print(f"Error in transaction: {e}")
-            return False
+            return TransferResult.ERROR
+        except ClientError as e:
+            result = TransferResult.from_error(e)
+            if result is TransferResult.THROTTLED:
+                DB_THROTTLES.inc('transaction')
+            elif result is TransferResult.ERROR:
+                report_error('transaction', e)
+            return result
+
+    def _bulk_marker(self, chat_id: int, operation_id: str) -> dict:
+        """
+        Метка массового начисления в журнале: своя запись на пару (operation_id, chat_id) вместо списка операций
+        в записи пользователя. Записи журнала не удаляются, метку через bulk_op_ttl удаляет TTL DynamoDB
+        по атрибуту `expires_at`.
+        """
+        item = {'chat_id': chat_id, 'ts': f'{BULK_MARKER}{operation_id}',
+                'expires_at': int(time.time()) + self.bulk_op_ttl}
+        return {'Put': {'TableName': self.ledger_table_name, 'Item': item,
+                        'ConditionExpression': 'attribute_not_exists(ts)'}}
+
+    def _bulk_credit(self, username: str, amount: int, operation_id: str) -> BulkResult:
+        try:
+            chat_id = self.get_chat_id(username)
+        except StorageError as e:
+            print(f"Error in bulk_add_coins: {e}")
+            return BulkResult.ERROR
+        if chat_id is None:
+            return BulkResult.NOT_FOUND
+        try:
+            # порядок важен для разбора CancellationReasons: начисление, метка операции, запись журнала.
+            # Без журнала метку хранить негде: повторная доставка команды начислит монеты еще раз
+            self._update_balance({
+                'Key': {'chat_id': chat_id},
+                'UpdateExpression': 'SET coins = coins + :amount',
+                'ConditionExpression': 'attribute_exists(chat_id)',
+                'ExpressionAttributeValues': {':amount': amount},
+            }, [self._bulk_marker(chat_id, operation_id), self._ledger_put(chat_id, amount, 'bulk')])
+            return BulkResult.CREDITED
+        except ClientError as e:
+            reasons = [reason.get('Code') for reason in e.response.get('CancellationReasons', [])]
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException' or \
+                    reasons[:1] == ['ConditionalCheckFailed']:
+                # пользователь удален после поиска по индексу
+                return BulkResult.NOT_FOUND
+            if reasons[1:2] == ['ConditionalCheckFailed']:
+                return BulkResult.ALREADY_CREDITED
+            report_error('bulk_add_coins', e)
+            return BulkResult.ERROR
+        except StorageError as e:
+            print(f"Error in bulk_add_coins: {e}")
+            return BulkResult.ERROR
+
+    def bulk_add_coins(self, usernames: Iterable[str], amount: int, operation_id: str,
+                       max_workers: int = 8) -> Dict[str, BulkResult]:
+        """
+        Начисляет монеты списку пользователей с ограниченной параллельностью.
+        Повторный вызов с тем же operation_id в течение bulk_op_ttl не начисляет монеты второй раз (нужен журнал).
+        :param usernames: Имена пользователей.
+        :param amount: Количество монет для добавления.
+        :param operation_id: Идентификатор операции (например, id сообщения с командой).
+        :param max_workers: Максимальное количество одновременных запросов.
+        :return: Результат для каждого имени пользователя.
+        """
+        usernames = list(dict.fromkeys(usernames))
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='dynamodb-bulk') as executor:
+            results = executor.map(lambda username: self._bulk_credit(username, amount, operation_id), usernames)
+            return dict(zip(usernames, results))
 
     def get_username(self, chat_id: int) -> Union[str, None]:
         """
@@ -168,24 +614,53 @@ class Database:
             user = self.user_exist(chat_id)
             return user.get('username') if user else None
         except ClientError as e:
-            print(f"Error in get_username: {e}")
+            report_error('get_username', e)
             return None
 
     def get_chat_id(self, username: str) -> Union[int, None]:
         """
-        Получает chat_id по имени пользователя.
+        Получает chat_id по имени пользователя через индекс username.
+        Индекс поддерживается DynamoDB автоматически при add_user и update_username.
         :param username: Имя пользователя.
         :return: chat_id или None, если пользователь не найден.
+        :raises StorageError: Индекса нет или он еще создается.
         """
+        from boto3.dynamodb.conditions import Key
         try:
-            response = self.table.scan(FilterExpression='username = :username',
-                                       ExpressionAttributeValues={':username': username})
+            response = self.dynamo.call('Query', self.table.query, IndexName=self.username_index,
+                                        KeyConditionExpression=Key('username').eq(username),
+                                        ProjectionExpression='chat_id',
+                                        Limit=1)
             items = response.get('Items')
             return items[0].get('chat_id') if items else None
         except ClientError as e:
-            print(f"Error in get_chat_id: {e}")
+            report_error('get_chat_id', e)
+            if e.response['Error']['Code'] in ('ValidationException', 'ResourceNotFoundException'):
+                # None означал бы "пользователь не существует" для каждого имени
+                raise StorageError('Query', f'index {self.username_index} is not available: {e}') from e
             return None
 
+    def create_username_index(self) -> bool:
+        """
+        Создает глобальный вторичный индекс по username (однократная миграция таблицы).
+        :return: True, если операция успешна, иначе False.
+        """
+        try:
+            self.dynamo.call(
+                'UpdateTable', self.table.meta.client.update_table,
+                TableName=self.table_name,
+                AttributeDefinitions=[{'AttributeName': 'username', 'AttributeType': 'S'}],
+                GlobalSecondaryIndexUpdates=[{'Create': {
+                    'IndexName': self.username_index,
+                    'KeySchema': [{'AttributeName': 'username', 'KeyType': 'HASH'}],
+                    'Projection': {'ProjectionType': 'KEYS_ONLY'},
+                }}]
+            )
+            return True
+        except ClientError as e:
+            report_error('create_username_index', e)
+            return False
+
     def get_balance(self, chat_id: int) -> Union[int, None]:
         """
         Получает баланс пользователя по chat_id.
@@ -196,20 +671,151 @@ class Database:
             user = self.user_exist(chat_id)
             return user.get('coins') if user else None
         except ClientError as e:
-            print(f"Error in get_balance: {e}")
+            report_error('get_balance', e)
             return None
 
+    def get_history(self, chat_id: int, limit: int = 10,
+                    cursor: Union[str, None] = None) -> Tuple[List[dict], Union[str, None]]:
+        """
+        Возвращает операции пользователя из журнала, начиная с последних.
+        :param chat_id: Уникальный идентификатор пользователя.
+        :param limit: Размер страницы.
+        :param cursor: ts последней записи предыдущей страницы.
+        :return: Записи журнала и курсор следующей страницы (None, если страниц больше нет).
+        """
+        if self.ledger_table_name is None:
+            return [], None
+        from boto3.dynamodb.conditions import Key
+        # метки массовых начислений (BULK_MARKER) сортируются перед записями журнала и не входят в историю
+        kwargs = {'KeyConditionExpression': Key('chat_id').eq(chat_id) & Key('ts').gte('0'), 'ScanIndexForward': False,
+                  'Limit': limit}
+        if cursor:
+            kwargs['ExclusiveStartKey'] = {'chat_id': chat_id, 'ts': cursor}
+        try:
+            response = self.dynamo.call('Query', self.ledger_table.query, **kwargs)
+            last_key = response.get('LastEvaluatedKey')
+            return response.get('Items', []), last_key['ts'] if last_key else None
+        except ClientError as e:
+            report_error('get_history', e)
+            return [], None
+
+    def reconcile(self) -> Dict[int, Tuple[int, int]]:
+        """
+        Сверяет суммы операций журнала с балансами, обходя обе таблицы постранично.
+        :return: chat_id -> (баланс, сумма по журналу) для расхождений.
+        """
+        if self.ledger_table_name is None:
+            return {}
+        sums = {}
+        for item in self.scan_items(['chat_id', 'delta'], table_attr='ledger_table'):
+            # у меток массовых начислений нет delta
+            sums[item['chat_id']] = sums.get(item['chat_id'], 0) + item.get('delta', 0)
+        mismatches = {}
+        for item in self.scan_items(['chat_id', 'coins']):
+            ledger_sum = sums.pop(item['chat_id'], 0)
+            if ledger_sum != item['coins']:
+                mismatches[item['chat_id']] = (item['coins'], ledger_sum)
+        # записи журнала без пользователя
+        mismatches.update({chat_id: (0, ledger_sum) for chat_id, ledger_sum in sums.items() if ledger_sum})
+        return mismatches
+
+    def _scan_pages(self, table_attr: str, projection: Union[List[str], None], segment: Union[int, None] = None,
+                    total_segments: Union[int, None] = None) -> Iterator[List[dict]]:
+        kwargs = {}
+        if projection:
+            kwargs['ProjectionExpression'] = ', '.join(f'#p{i}' for i in range(len(projection)))
+            kwargs['ExpressionAttributeNames'] = {f'#p{i}': name for i, name in enumerate(projection)}
+        if total_segments:
+            kwargs['Segment'], kwargs['TotalSegments'] = segment, total_segments
+        table = getattr(self, table_attr)
+        while True:
+            response = self.dynamo.call('Scan', table.scan, **kwargs)
+            yield response.get('Items', [])
+            if 'LastEvaluatedKey' not in response:
+                return
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    def scan_items(self, projection: Union[List[str], None] = None, segments: int = 1,
+                   table_attr: str = 'table') -> Iterator[dict]:
+        """
+        Постранично обходит таблицу (LastEvaluatedKey), не загружая ее целиком в память.
+        При segments > 1 сегменты сканируются параллельно, в памяти держится не больше 2 * segments страниц.
+        Балансы горячих аккаунтов в таблице пользователей дополняются суммой шардов.
+        :param projection: Читаемые атрибуты (None - все).
+        :param segments: Количество параллельных сегментов.
+        :param table_attr: 'table' или 'ledger_table'.
+        :return: Генератор записей.
+        """
+        if not self.hot_accounts or table_attr != 'table' or (projection and 'coins' not in projection):
+            yield from self._scan_all(projection, segments, table_attr)
+            return
+        if projection and 'chat_id' not in projection:
+            projection = projection + ['chat_id']
+        for item in self._scan_all(projection, segments, table_attr):
+            if item['chat_id'] in self.hot_accounts:
+                item['coins'] = item.get('coins', 0) + sum(self._read_shards(item['chat_id']).values())
+            yield item
+
+    def _scan_all(self, projection: Union[List[str], None], segments: int, table_attr: str) -> Iterator[dict]:
+        if segments <= 1:
+            for page in self._scan_pages(table_attr, projection):
+                yield from page
+            return
+
+        pages = queue.Queue(maxsize=segments * 2)
+        stop = threading.Event()
+
+        def put(item) -> bool:
+            while not stop.is_set():
+                try:
+                    pages.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def scan_segment(segment: int):
+            try:
+                for page in self._scan_pages(table_attr, projection, segment, segments):
+                    if not put(page):
+                        return
+                put(None)
+            except Exception as e:
+                put(e)
+
+        with ThreadPoolExecutor(max_workers=segments, thread_name_prefix='dynamodb-scan') as executor:
+            for segment in range(segments):
+                executor.submit(scan_segment, segment)
+            try:
+                finished = 0
+                while finished < segments:
+                    page = pages.get()
+                    if page is None:
+                        finished += 1
+                    elif isinstance(page, Exception):
+                        raise page
+                    else:
+                        yield from page
+            finally:
+                stop.set()
+
+    def iter_data(self, segments: int = 1) -> Iterator[Tuple[int, str]]:
+        """
+        :param segments: Количество параллельных сегментов сканирования.
+        :return: Генератор кортежей (coins, username).
+        """
+        for item in self.scan_items(['coins', 'username'], segments):
+            yield item['coins'], item['username']
+
     def get_data(self) -> List[Tuple[int, str]]:
         """
         Возвращает все данные из таблицы.
         :return: Список кортежей с данными (coins, username).
         """
         try:
-            response = self.table.scan()
-            items = response.get('Items')
-            return [(item['coins'], item['username']) for item in items]
+            return list(self.iter_data())
         except ClientError as e:
-            print(f"Error in get_data: {e}")
+            report_error('get_data', e)
             return []
 
     def print_all(self):
@@ -217,20 +823,239 @@ class Database:
         Выводит все данные из таблицы.
         """
         try:
-            response = self.table.scan()
-            items = response.get('Items')
-            print(items)
+            for item in self.scan_items():
+                print(item)
         except ClientError as e:
-            print(f"Error in print_all: {e}")
+            report_error('print_all', e)
+
+    def delete_all(self, segments: int = 4) -> int:
+        """
+        Удаляет все записи: сегменты сканируются параллельно, ключи удаляются через _batch_write.
+        :param segments: Количество параллельных сегментов.
+        :return: Количество удаленных записей.
+        """
+
+        def delete_segment(segment: int) -> int:
+            return self._batch_write(self.table_name, (
+                {'DeleteRequest': {'Key': {'chat_id': item['chat_id']}}}
+                for page in self._scan_pages('table', ['chat_id'], segment, segments) for item in page))
+
+        with ThreadPoolExecutor(max_workers=segments, thread_name_prefix='dynamodb-delete') as executor:
+            deleted = sum(executor.map(delete_segment, range(segments)))
+        if self.hot_accounts:
+            self._batch_write(self.shard_table_name, ({'DeleteRequest': {'Key': key}} for chat_id in self.hot_accounts
+                                                      for key in self._shard_keys(chat_id)))
+        return deleted
+
+    def _batch_write(self, table_name: str, requests: Iterable[dict]) -> int:
+        """
+        Отправляет PutRequest/DeleteRequest по 25 в запросе BatchWriteItem (как batch_writer, но через ResilientClient).
+        Необработанные записи (UnprocessedItems) отправляются повторно сразу, а если не записано ничего -
+        с растущей задержкой.
+        :raises StorageThrottled: Пачка не записана за max_attempts запросов без продвижения.
+        :return: Количество записанных запросов.
+        """
+        requests = iter(requests)
+        written = 0
+        for batch in iter(lambda: list(islice(requests, 25)), []):
+            pending, attempt = batch, 0
+            while pending:
+                response = self.dynamo.call('BatchWriteItem', self.resource.batch_write_item,
+                                            RequestItems={table_name: pending})
+                unprocessed = response.get('UnprocessedItems', {}).get(table_name, [])
+                if len(unprocessed) == len(pending):
+                    attempt += 1
+                    if attempt >= self.dynamo.max_attempts:
+                        raise StorageThrottled('BatchWriteItem', f'{len(pending)} requests unprocessed '
+                                                                 f'after {attempt} attempts')
+                    time.sleep(self.dynamo.backoff(attempt))
+                pending = unprocessed
+            written += len(batch)
+        return written
+
+    def put_items(self, items: Iterable[dict], writers: int = 4) -> int:
+        """
+        Массовая загрузка записей пользователей (импорт списка, восстановление из снимка): пачки по 25 записей
+        разбирают writers параллельных потоков, каждый пишет через _batch_write. Существующие записи заменяются,
+        журнал операций и шарды баланса не изменяются.
+        :param items: Записи с ключами chat_id, coins, username (и любыми другими атрибутами).
+        :param writers: Количество параллельных потоков записи.
+        :return: Количество записанных записей.
+        """
+        items = iter(items)
+        lock = threading.Lock()
+
+        def next_batch() -> List[dict]:
+            with lock:
+                # BatchWriteItem не принимает два запроса с одним ключом, остается последняя запись
+                batch = {item['chat_id']: item for item in islice(items, 25)}
+            return [{'PutRequest': {'Item': item}} for item in batch.values()]
+
+        def write() -> int:
+            return sum(self._batch_write(self.table_name, batch) for batch in iter(next_batch, []))
+
+        with ThreadPoolExecutor(max_workers=writers, thread_name_prefix='dynamodb-import') as executor:
+            return sum(executor.map(lambda _: write(), range(writers)))
+
+    def _insert_user(self, item: dict) -> bool:
+        """
+        Условная запись пользователя, которого еще нет в таблице; с журналом - вместе с записью 'open', как add_user.
+        :return: False, если пользователь уже существует.
+        """
+        put = {'TableName': self.table_name, 'Item': item, 'ConditionExpression': 'attribute_not_exists(chat_id)'}
+        try:
+            if self.ledger_table_name is None:
+                self.dynamo.call('PutItem', self.table.put_item, Item=item,
+                                 ConditionExpression=put['ConditionExpression'])
+            else:
+                self._transact([{'Put': put}, self._ledger_put(item['chat_id'], item.get('coins', 0), 'open')])
+            return True
+        except ClientError as e:
+            reasons = [reason.get('Code') for reason in e.response.get('CancellationReasons', [])]
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException' or \
+                    reasons[:1] == ['ConditionalCheckFailed']:
+                return False
+            raise
+
+    def insert_items(self, items: Iterable[dict], writers: int = 4) -> int:
+        """
+        Добавляет пользователей, которых еще нет в таблице (импорт списка учеников). В отличие от put_items
+        существующие записи не изменяются: баланс и username сохраняются. Каждая запись - отдельный
+        условный запрос, их выполняют writers параллельных потоков.
+        :param items: Записи с ключами chat_id, coins, username.
+        :param writers: Количество параллельных потоков записи.
+        :return: Количество добавленных пользователей.
+        """
+        items = iter(items)
+        lock = threading.Lock()
+
+        def next_item() -> Union[dict, None]:
+            with lock:
+                return next(items, None)
+
+        def insert() -> int:
+            return sum(self._insert_user(item) for item in iter(next_item, None))
+
+        with ThreadPoolExecutor(max_workers=writers, thread_name_prefix='dynamodb-import') as executor:
+            return sum(executor.map(lambda _: insert(), range(writers)))
 
     def clear_all(self):
         """
         Удаляет все данные из таблицы.
         """
         try:
-            response = self.table.scan()
-            items = response.get('Items')
-            for item in items:
-                self.table.delete_item(Key={'chat_id': item['chat_id']})
+            self.delete_all()
         except ClientError as e:
-            print(f"Error in clear_all: {e}")
+            report_error('clear_all', e)
+
+
+class AsyncDatabase:
+    """
+    Асинхронная обертка над Storage: блокирующие вызовы хранилища выполняются
+    в отдельном ограниченном пуле потоков и не останавливают event loop.
+    """
+
+    def __init__(self, database: Storage, max_workers: int = 10):
+        """
+        :param database: Синхронное хранилище (Database или SQLiteDatabase).
+        :param max_workers: Максимальное количество одновременных запросов к DynamoDB.
+        """
+        self.database = database
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='dynamodb')
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    async def warm_up(self) -> bool:
+        """
+        Запускает warm_up хранилища одновременно во всех потоках пула, чтобы первые апдейты
+        не ждали импорта boto3, создания клиентов и установки соединений.
+        """
+        return all(await asyncio.gather(*(self._run(self.database.warm_up) for _ in range(self.max_workers))))
+
+    async def user_exist(self, chat_id: int) -> Union[dict, None]:
+        return await self._run(self.database.user_exist, chat_id)
+
+    async def add_user(self, chat_id: int, coins: int, username: str) -> bool:
+        return await self._run(self.database.add_user, chat_id, coins, username)
+
+    async def is_username_correct(self, chat_id: int, username: str) -> bool:
+        return await self._run(self.database.is_username_correct, chat_id, username)
+
+    async def update_username(self, chat_id: int, new_username: str) -> bool:
+        return await self._run(self.database.update_username, chat_id, new_username)
+
+    async def add_coins(self, chat_id: int, amount: int, kind: str = 'admin') -> bool:
+        return await self._run(self.database.add_coins, chat_id, amount, kind)
+
+    async def subtract_coins(self, chat_id: int, amount: int, kind: str = 'admin') -> bool:
+        return await self._run(self.database.subtract_coins, chat_id, amount, kind)
+
+    async def get_transaction_verdict(self, chat_id: int, amount: int) -> Union[bool, None]:
+        return await self._run(self.database.get_transaction_verdict, chat_id, amount)
+
+    async def transaction(self, chat_id: int, to_chat_id: int, amount: int) -> TransferResult:
+        return await self._run(self.database.transaction, chat_id, to_chat_id, amount)
+
+    async def bulk_add_coins(self, usernames: Iterable[str], amount: int, operation_id: str) -> Dict[str, BulkResult]:
+        return await self._run(self.database.bulk_add_coins, usernames, amount, operation_id)
+
+    async def get_username(self, chat_id: int) -> Union[str, None]:
+        return await self._run(self.database.get_username, chat_id)
+
+    async def get_chat_id(self, username: str) -> Union[int, None]:
+        return await self._run(self.database.get_chat_id, username)
+
+    async def create_username_index(self) -> bool:
+        return await self._run(self.database.create_username_index)
+
+    async def get_balance(self, chat_id: int) -> Union[int, None]:
+        return await self._run(self.database.get_balance, chat_id)
+
+    async def get_history(self, chat_id: int, limit: int = 10,
+                          cursor: Union[str, None] = None) -> Tuple[List[dict], Union[str, None]]:
+        return await self._run(self.database.get_history, chat_id, limit, cursor)
+
+    async def reconcile(self) -> Dict[int, Tuple[int, int]]:
+        return await self._run(self.database.reconcile)
+
+    async def compact_balances(self) -> Dict[int, bool]:
+        return await self._run(self.database.compact_balances)
+
+    def iter_data(self, segments: int = 1) -> Iterator[Tuple[int, str]]:
+        """
+        Синхронный генератор: выполняет запросы к DynamoDB при итерации, поэтому его нужно потреблять вне event loop.
+        """
+        return self.database.iter_data(segments)
+
+    def scan_items(self, projection: Union[List[str], None] = None, segments: int = 1) -> Iterator[dict]:
+        """
+        Синхронный генератор, см. iter_data.
+        """
+        return self.database.scan_items(projection, segments)
+
+    async def delete_all(self, segments: int = 4) -> int:
+        return await self._run(self.database.delete_all, segments)
+
+    async def put_items(self, items: Iterable[dict], writers: int = 4) -> int:
+        return await self._run(self.database.put_items, items, writers)
+
+    async def insert_items(self, items: Iterable[dict], writers: int = 4) -> int:
+        return await self._run(self.database.insert_items, items, writers)
+
+    async def get_data(self) -> List[Tuple[int, str]]:
+        return await self._run(self.database.get_data)
+
+    async def print_all(self):
+        return await self._run(self.database.print_all)
+
+    async def clear_all(self):
+        return await self._run(self.database.clear_all)
+
+    def close(self):
+        """
+        Останавливает пул потоков.
+        """
+        self.executor.shutdown(wait=False)
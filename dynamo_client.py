@@ -0,0 +1,350 @@
+import random
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError as FutureTimeout, wait
+from enum import Enum
+from typing import Callable, Dict, Union
+
+from botocore.exceptions import ClientError, ConnectionError as BotoConnectionError, HTTPClientError
+
+from metrics import DB_THROTTLES
+
+THROTTLING_ERRORS = ('ProvisionedThroughputExceededException', 'ThrottlingException', 'RequestLimitExceeded',
+                     'ThrottlingError', 'TransactionConflict')
+UNAVAILABLE_ERRORS = ('InternalServerError', 'InternalFailure', 'ServiceUnavailable', 'ServiceUnavailableException')
+
+
+class StorageError(Exception):
+    """
+    Хранилище не выполнило запрос. Методы Database пробрасывают эти ошибки вместо None/False,
+    а обработчик ошибок бота показывает пользователю сообщение.
+    """
+
+    def __init__(self, operation: str, message: str):
+        super().__init__(f'{operation}: {message}')
+        self.operation = operation
+
+
+class StorageThrottled(StorageError):
+    """Запросы отклонены троттлингом, а повторы или их бюджет исчерпаны"""
+
+
+class StorageUnavailable(StorageError):
+    """Хранилище не отвечает (5xx, сетевые ошибки) или запрос отклонен открытым автоматом"""
+
+
+def may_have_applied(error: Exception) -> bool:
+    """
+    Запрос мог быть выполнен, хотя ответ не получен: таймаут чтения или разрыв соединения после отправки
+    (HTTPClientError) и ответ 5xx. Ошибки установки соединения (ConnectionError) означают, что запрос не отправлен.
+    """
+    if isinstance(error, HTTPClientError):
+        return True
+    return isinstance(error, ClientError) and classify(error) == 'unavailable'
+
+
+def classify(error: Exception) -> Union[str, None]:
+    """
+    :return: 'throttled', 'unavailable' или None для ошибок, которые повторять нельзя
+        (невыполненное условие, ошибка в запросе).
+    """
+    if isinstance(error, (BotoConnectionError, HTTPClientError)):
+        return 'unavailable'
+    if not isinstance(error, ClientError):
+        return None
+    code = error.response.get('Error', {}).get('Code')
+    if code in THROTTLING_ERRORS:
+        return 'throttled'
+    reasons = [reason.get('Code') for reason in error.response.get('CancellationReasons', [])]
+    # отмененная транзакция повторяется, только если ни одно условие не нарушено
+    if any(reason in THROTTLING_ERRORS for reason in reasons) and 'ConditionalCheckFailed' not in reasons:
+        return 'throttled'
+    if code in UNAVAILABLE_ERRORS or error.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0) >= 500:
+        return 'unavailable'
+    return None
+
+
+class RetryBudget:
+    """
+    Квота повторов для каждой операции (как retry quota в AWS SDK): повтор забирает retry_cost токенов,
+    успешный запрос возвращает один. При массовых ошибках квота заканчивается, и повторы не умножают нагрузку.
+    """
+
+    def __init__(self, capacity: int = 500, retry_cost: int = 5):
+        self.capacity = capacity
+        self.retry_cost = retry_cost
+        self.tokens: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def withdraw(self, operation: str, cost: Union[int, None] = None) -> bool:
+        cost = self.retry_cost if cost is None else cost
+        with self.lock:
+            available = self.tokens.get(operation, self.capacity)
+            if available < cost:
+                return False
+            self.tokens[operation] = available - cost
+            return True
+
+    def deposit(self, operation: str):
+        with self.lock:
+            self.tokens[operation] = min(self.capacity, self.tokens.get(operation, self.capacity) + 1)
+
+
+class AdaptiveRate:
+    """
+    Клиентское ограничение скорости запросов, которое включается при троттлинге: скорость снижается до beta
+    от фактической за последнюю секунду (не чаще раза в decrease_interval секунд, иначе одиночные отказы сводили бы
+    ее к min_rate) и за recovery секунд линейно возвращается к уровню до троттлинга, после чего ограничение снимается.
+    """
+
+    def __init__(self, beta: float = 0.7, recovery: float = 5.0, min_rate: float = 10.0,
+                 decrease_interval: float = 1.0):
+        self.beta = beta
+        self.recovery = recovery
+        self.min_rate = min_rate
+        self.decrease_interval = decrease_interval
+        self.enabled = False
+        self.low = 0.0
+        self.ceiling = 0.0
+        self.decreased_at = 0.0
+        self.tokens = 0.0
+        self.updated = 0.0
+        # время отправки запросов за последнюю секунду
+        self.sent = deque()
+        self.lock = threading.Lock()
+
+    def _rate(self, now: float) -> float:
+        progress = (now - self.decreased_at) / self.recovery
+        if progress >= 1:
+            self.enabled = False
+            return self.ceiling
+        return self.low + (self.ceiling - self.low) * progress
+
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            self.sent.append(now)
+            while now - self.sent[0] > 1:
+                self.sent.popleft()
+            if not self.enabled:
+                return
+            rate = self._rate(now)
+            if not self.enabled:
+                return
+            self.tokens = min(max(rate, 1.0), self.tokens + (now - self.updated) * rate)
+            self.updated = now
+            # токен резервируется сразу, поэтому одновременные запросы ждут по очереди
+            self.tokens -= 1
+            delay = -self.tokens / rate if self.tokens < 0 else 0
+        if delay:
+            time.sleep(delay)
+
+    def on_throttle(self):
+        with self.lock:
+            now = time.monotonic()
+            if self.enabled:
+                if now - self.decreased_at < self.decrease_interval:
+                    return
+                current = self._rate(now)
+            else:
+                current = max(float(len(self.sent)), self.min_rate)
+                self.ceiling, self.tokens, self.updated = current, 0.0, now
+            self.low = max(self.min_rate, current * self.beta)
+            self.enabled, self.decreased_at = True, now
+
+
+class BreakerState(Enum):
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """
+    Автомат отключения: после failure_threshold подряд запросов, завершившихся недоступностью хранилища,
+    запросы отклоняются сразу на reset_timeout секунд. Затем пропускается один пробный запрос:
+    при успехе автомат закрывается, при ошибке снова открывается.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 10.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = BreakerState.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self.lock:
+            if self.state is BreakerState.CLOSED:
+                return True
+            if self.state is BreakerState.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = BreakerState.HALF_OPEN
+            if self.state is BreakerState.HALF_OPEN and not self.probing:
+                self.probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.state, self.failures, self.probing = BreakerState.CLOSED, 0, False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.probing = False
+            if self.state is BreakerState.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state, self.opened_at = BreakerState.OPEN, time.monotonic()
+
+
+class ResilientClient:
+    """
+    Выполняет запросы к DynamoDB с повторами (экспоненциальная задержка со случайной составляющей),
+    бюджетом повторов на операцию, адаптивным ограничением скорости при троттлинге и автоматом отключения.
+    Встроенные повторы botocore при этом отключаются (total_max_attempts=1), чтобы повторы не умножались.
+    """
+
+    def __init__(self, max_attempts: int = 4, base_delay: float = 0.025, max_delay: float = 1.0,
+                 budget: Union[RetryBudget, None] = None, breaker: Union[CircuitBreaker, None] = None,
+                 rate: Union[AdaptiveRate, None] = None, hedge_after: Union[float, None] = None,
+                 hedge_workers: int = 16):
+        """
+        :param max_attempts: Максимальное количество попыток одного запроса.
+        :param base_delay: Базовая задержка перед повтором в секундах, удваивается с каждой попыткой.
+        :param max_delay: Максимальная задержка перед повтором.
+        :param hedge_after: Через сколько секунд без ответа отправлять второй get_item (None - не отправлять).
+        :param hedge_workers: Размер пула потоков для get_item со вторым запросом; в пуле выполняются оба запроса,
+            поэтому он должен быть вдвое больше числа потоков, вызывающих get_item, иначе запросы ждут в очереди.
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget or RetryBudget()
+        self.breaker = breaker or CircuitBreaker()
+        self.rate = rate or AdaptiveRate()
+        self.hedge_after = hedge_after
+        self.hedge_workers = hedge_workers
+        self._hedge_executor = None
+        self._hedge_lock = threading.Lock()
+        self._hedges_warm = False
+        self.stats = Counter()
+
+    def backoff(self, attempt: int) -> float:
+        """Задержка перед попыткой attempt: случайная от 0 до base_delay * 2 ** attempt (full jitter)"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def call(self, operation: str, func: Callable, *args, idempotent: bool = True, **kwargs):
+        """
+        Выполняет func(*args, **kwargs). Ошибки, которые повторять нельзя (ConditionalCheckFailed и т.п.),
+        пробрасываются без изменений.
+        :param operation: Имя операции для бюджета повторов и метрик (GetItem, TransactWriteItems, ...).
+        :param idempotent: False для записей, повтор которых применит изменение второй раз (coins = coins + :amount
+            без условия): после таймаута или 5xx они не повторяются, повторяются только троттлинг и ошибки соединения.
+        :raises StorageThrottled: Троттлинг не прошел за max_attempts попыток или бюджет повторов исчерпан.
+        :raises StorageUnavailable: Хранилище недоступно или автомат отключения открыт.
+        """
+        if not self.breaker.allow():
+            self.stats['rejected'] += 1
+            raise StorageUnavailable(operation, 'circuit breaker is open')
+        attempt = 0
+        while True:
+            self.rate.acquire()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                kind = classify(e)
+                if kind is None:
+                    # хранилище ответило, ошибка в самом запросе
+                    self.breaker.record_success()
+                    raise
+                if kind == 'throttled':
+                    self.stats['throttled'] += 1
+                    DB_THROTTLES.inc(operation)
+                    self.rate.on_throttle()
+                else:
+                    self.stats['unavailable'] += 1
+                    if not idempotent and may_have_applied(e):
+                        self.stats['not_retried'] += 1
+                        self.breaker.record_failure()
+                        message = f'{e} (not retried, the write may have been applied)'
+                        raise StorageUnavailable(operation, message) from e
+                attempt += 1
+                if attempt >= self.max_attempts or not self.budget.withdraw(operation):
+                    self.stats['gave_up'] += 1
+                    if kind == 'throttled':
+                        self.breaker.record_success()
+                        raise StorageThrottled(operation, str(e)) from e
+                    self.breaker.record_failure()
+                    raise StorageUnavailable(operation, str(e)) from e
+                self.stats['retries'] += 1
+                time.sleep(self.backoff(attempt))
+                continue
+            self.budget.deposit(operation)
+            self.breaker.record_success()
+            return result
+
+    @property
+    def hedge_executor(self) -> ThreadPoolExecutor:
+        with self._hedge_lock:
+            if self._hedge_executor is None:
+                self._hedge_executor = ThreadPoolExecutor(max_workers=self.hedge_workers,
+                                                          thread_name_prefix='dynamodb-hedge')
+            return self._hedge_executor
+
+    def warm_up_hedges(self, prepare: Callable[[], object], timeout: float = 30.0):
+        """
+        Выполняет prepare в каждом потоке пула второго get_item, чтобы потоки создали ресурс boto3 и открыли соединение
+        до первого медленного ответа, а не во время него. Выполняется один раз, повторные вызовы ничего не делают.
+        :param prepare: Функция без аргументов, например запрос DescribeTable через таблицу потока.
+        """
+        with self._hedge_lock:
+            if self.hedge_after is None or self._hedges_warm:
+                return
+            self._hedges_warm = True
+        # задача не завершается, пока не запущены остальные, поэтому пул создает все потоки и каждая задача - в своем
+        barrier = threading.Barrier(self.hedge_workers)
+
+        def warm_up_thread():
+            try:
+                prepare()
+            finally:
+                try:
+                    barrier.wait(timeout)
+                except threading.BrokenBarrierError:
+                    pass
+
+        futures = [self.hedge_executor.submit(warm_up_thread) for _ in range(self.hedge_workers)]
+        wait(futures)
+        for future in futures:
+            if future.exception() is not None:
+                print(f"Error in warm_up_hedges: {future.exception()}")
+                break
+
+    def hedged(self, operation: str, func: Callable):
+        """
+        Идемпотентное чтение со вторым запросом: если за hedge_after секунд ответа нет, отправляется второй такой же
+        запрос и возвращается первый успешный ответ. Второй запрос оплачивается из бюджета повторов и не отправляется
+        при троттлинге, поэтому при деградации хранилища их количество ограничено.
+        :param func: Функция без аргументов; выполняется в потоках пула, поэтому должна сама брать таблицу потока.
+        """
+        if self.hedge_after is None or self.rate.enabled:
+            # при троттлинге второй запрос только увеличит нагрузку
+            return self.call(operation, func)
+        first = self.hedge_executor.submit(self.call, operation, func)
+        try:
+            return first.result(timeout=self.hedge_after)
+        except FutureTimeout:
+            pass
+        if not self.budget.withdraw(operation):
+            return first.result()
+        self.stats['hedged'] += 1
+        second = self.hedge_executor.submit(self.call, operation, func)
+        done, _ = wait([first, second], return_when=FIRST_COMPLETED)
+        winner = done.pop()
+        if winner.exception() is not None:
+            return (second if winner is first else first).result()
+        if winner is second:
+            self.stats['hedge_wins'] += 1
+        return winner.result()
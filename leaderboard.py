@@ -0,0 +1,126 @@
+import bisect
+import json
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Tuple, Union
+
+
+class Leaderboard:
+    """
+    Рейтинг пользователей по балансу в памяти процесса.
+    Заполняется один раз обходом таблицы (или из снимка на диске), дальше обновляется при каждом изменении баланса
+    через CachedDatabase. Список ключей (-coins, chat_id) хранится отсортированным, поэтому top(n) - срез,
+    а rank - двоичный поиск, без обхода таблицы пользователей.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.scores: Dict[int, int] = {}
+        self.usernames: Dict[int, str] = {}
+        self.chat_ids: Dict[str, int] = {}
+        self.ranking: List[Tuple[int, int]] = []
+        self.ready = False
+
+    def __len__(self) -> int:
+        return len(self.scores)
+
+    def _build(self, users: Iterable[Tuple[int, int, str]]):
+        scores, usernames = {}, {}
+        for chat_id, coins, username in users:
+            scores[int(chat_id)] = int(coins)
+            usernames[int(chat_id)] = username
+        ranking = sorted((-coins, chat_id) for chat_id, coins in scores.items())
+        with self.lock:
+            self.scores, self.usernames, self.ranking = scores, usernames, ranking
+            self.chat_ids = {username: chat_id for chat_id, username in usernames.items() if username}
+            self.ready = True
+
+    def seed(self, items: Iterable[dict]):
+        """
+        :param items: Записи пользователей с ключами chat_id, coins, username (например, database.scan_items).
+        """
+        self._build((item['chat_id'], item.get('coins', 0), item.get('username')) for item in items)
+
+    def load(self, path: str, max_age: float) -> bool:
+        """
+        Загружает снимок, если он существует и сохранен не раньше max_age секунд назад.
+        :return: False, если снимка нет или он устарел - тогда рейтинг нужно заполнить через seed.
+        """
+        try:
+            with open(path, encoding='utf-8') as f:
+                snapshot = json.load(f)
+            if time.time() - snapshot['saved_at'] > max_age:
+                return False
+            self._build(snapshot['users'])
+        except (OSError, ValueError, KeyError, TypeError):
+            return False
+        return True
+
+    def save(self, path: str):
+        """Записывает снимок атомарно: во временный файл, затем переименование"""
+        with self.lock:
+            users = [[chat_id, coins, self.usernames.get(chat_id)] for chat_id, coins in self.scores.items()]
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'saved_at': time.time(), 'users': users}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def _remove_key(self, chat_id: int):
+        key = (-self.scores[chat_id], chat_id)
+        del self.ranking[bisect.bisect_left(self.ranking, key)]
+
+    def set(self, chat_id: int, coins: int, username: Union[str, None] = None):
+        with self.lock:
+            if chat_id in self.scores:
+                self._remove_key(chat_id)
+            self.scores[chat_id] = coins
+            bisect.insort(self.ranking, (-coins, chat_id))
+            if username is not None:
+                self._rename(chat_id, username)
+
+    def add(self, chat_id: int, delta: int):
+        """Изменяет баланс пользователя на delta; пользователи, которых нет в рейтинге, пропускаются"""
+        with self.lock:
+            if chat_id not in self.scores:
+                return
+            self._remove_key(chat_id)
+            self.scores[chat_id] += delta
+            bisect.insort(self.ranking, (-self.scores[chat_id], chat_id))
+
+    def add_by_username(self, username: str, delta: int):
+        chat_id = self.chat_ids.get(username)
+        if chat_id is not None:
+            self.add(chat_id, delta)
+
+    def _rename(self, chat_id: int, username: str):
+        old = self.usernames.get(chat_id)
+        if old and self.chat_ids.get(old) == chat_id:
+            del self.chat_ids[old]
+        self.usernames[chat_id] = username
+        self.chat_ids[username] = chat_id
+
+    def rename(self, chat_id: int, username: str):
+        with self.lock:
+            if chat_id in self.scores:
+                self._rename(chat_id, username)
+
+    def clear(self):
+        with self.lock:
+            self.scores, self.usernames, self.chat_ids, self.ranking = {}, {}, {}, []
+
+    def top(self, n: int = 10) -> List[Tuple[int, int, Union[str, None]]]:
+        """:return: Первые n пользователей: (chat_id, coins, username)."""
+        with self.lock:
+            return [(chat_id, -coins, self.usernames.get(chat_id)) for coins, chat_id in self.ranking[:n]]
+
+    def rank(self, chat_id: int) -> Union[Tuple[int, int], None]:
+        """
+        :return: (место, количество пользователей); пользователи с одинаковым балансом делят место.
+        """
+        with self.lock:
+            coins = self.scores.get(chat_id)
+            if coins is None:
+                return None
+            # (-coins,) меньше любого ключа (-coins, chat_id), поэтому находится число пользователей с большим балансом
+            return bisect.bisect_left(self.ranking, (-coins,)) + 1, len(self.ranking)
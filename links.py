@@ -0,0 +1,83 @@
+import base64
+import binascii
+import hashlib
+import hmac
+import time
+from enum import Enum
+from typing import NamedTuple, Tuple, Union
+
+# chat_id (7 байт), amount (4), expires_at (4), подпись (7): 22 байта -> 30 символов base64url
+_ID_SIZE, _AMOUNT_SIZE, _EXPIRES_SIZE, _MAC_SIZE = 7, 4, 4, 7
+_BODY_SIZE = _ID_SIZE + _AMOUNT_SIZE + _EXPIRES_SIZE
+ENCODED_SIZE = 30
+MAX_USERNAME = 32
+MAX_AMOUNT = 2 ** (8 * _AMOUNT_SIZE) - 1
+
+
+class LinkStatus(Enum):
+    VALID = 'valid'
+    INVALID = 'invalid'
+    EXPIRED = 'expired'
+
+
+class PaymentLink(NamedTuple):
+    to_id: int
+    amount: int
+    username: str
+    expires_at: int
+
+
+class LinkSigner:
+    """
+    Подписанные ссылки на оплату: получатель, снимок его username, сумма и срок действия.
+    Формат `<30 символов base64url><username>` не длиннее 62 символов, поэтому помещается и в start-параметр
+    deep link, и в callback_data кнопки подтверждения (лимит Telegram - 64). Проверка подписи не требует
+    обращений к базе данных, а подделать получателя, сумму или срок без секрета нельзя.
+    """
+
+    def __init__(self, secret: bytes, ttl: int = 86400):
+        """
+        :param secret: Ключ HMAC-SHA256, общий для всех реплик бота.
+        :param ttl: Срок действия ссылки в секундах. Срок округляется до интервалов ttl, поэтому ссылка
+            на одну и ту же сумму не меняется внутри интервала (кэши QR кодов продолжают работать) и действует
+            от ttl до 2 * ttl секунд.
+        """
+        self.ttl = ttl
+        self._mac = hmac.new(secret, digestmod=hashlib.sha256)
+
+    def _signature(self, body: bytes, username: str) -> bytes:
+        mac = self._mac.copy()
+        mac.update(body + username.encode())
+        return mac.digest()[:_MAC_SIZE]
+
+    def sign(self, to_id: int, amount: int, username: str, now: Union[float, None] = None) -> str:
+        if len(username) > MAX_USERNAME:
+            raise ValueError('username is too long')
+        now = time.time() if now is None else now
+        expires_at = (int(now) // self.ttl + 2) * self.ttl
+        body = (to_id.to_bytes(_ID_SIZE, 'big') + amount.to_bytes(_AMOUNT_SIZE, 'big')
+                + expires_at.to_bytes(_EXPIRES_SIZE, 'big'))
+        return base64.urlsafe_b64encode(body + self._signature(body, username)).decode()[:ENCODED_SIZE] + username
+
+    def verify(self, payload: str, now: Union[float, None] = None) -> Tuple[LinkStatus, Union[PaymentLink, None]]:
+        """
+        :return: Статус проверки и данные ссылки (None, если подпись или формат неверны).
+        """
+        if not ENCODED_SIZE < len(payload) <= ENCODED_SIZE + MAX_USERNAME:
+            return LinkStatus.INVALID, None
+        try:
+            raw = base64.urlsafe_b64decode(payload[:ENCODED_SIZE] + '==')
+        except (binascii.Error, ValueError):
+            return LinkStatus.INVALID, None
+        body, signature, username = raw[:_BODY_SIZE], raw[_BODY_SIZE:], payload[ENCODED_SIZE:]
+        if len(signature) != _MAC_SIZE or not hmac.compare_digest(signature, self._signature(body, username)):
+            return LinkStatus.INVALID, None
+        link = PaymentLink(
+            to_id=int.from_bytes(body[:_ID_SIZE], 'big'),
+            amount=int.from_bytes(body[_ID_SIZE:_ID_SIZE + _AMOUNT_SIZE], 'big'),
+            username=username,
+            expires_at=int.from_bytes(body[_ID_SIZE + _AMOUNT_SIZE:], 'big'),
+        )
+        if link.expires_at <= (time.time() if now is None else now):
+            return LinkStatus.EXPIRED, link
+        return LinkStatus.VALID, link
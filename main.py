@@ -1,54 +1,126 @@
 import os
 import asyncio
-import nest_asyncio
+import datetime
 import logging
+import secrets
 import sys
+import time
+from typing import Union, List
 from aiogram import Bot, Dispatcher, filters, F
 from aiogram.utils import keyboard
 from dotenv import load_dotenv
-from db_manager import Database
-from utils import make_qrcode, agree_with_num, get_table
+from db_manager import Database, AsyncDatabase, TransferResult, BulkResult
+from dynamo_client import BreakerState, ResilientClient, StorageError, StorageThrottled
+from sqlite_db import SQLiteDatabase
+from utils import make_qrcode, qrcode_url, get_qrcode_file_id, remember_qrcode_file_id, agree_with_num, get_table, \
+    warm_up_morph, SpooledInputFile
 from bot.keyboards import *
-from bot.middlewares.trottling import ThrottlingMiddleware
+from bot.middlewares.trottling import ThrottlingMiddleware, Limit, MemoryRateLimiter, DynamoRateLimiter
+from bot.middlewares.user import UserMiddleware
+from bot.middlewares.metrics import MetricsMiddleware
+from bot.webhook import run_webhook
+from bot.outbox import Outbox
+from metrics import Gauge, start_metrics_server
+from user_cache import CachedDatabase
+from leaderboard import Leaderboard
+from links import LinkSigner, LinkStatus, MAX_AMOUNT
+from roster import Roster
+from transfers import ClaimStatus, MemoryTransferStore, DynamoTransferStore
 
 load_dotenv()
-nest_asyncio.apply()
 TOKEN = os.getenv('BOT_TOKEN')
 admins = os.getenv('ADMINS').split(',')
+db_pool_size = int(os.getenv('DB_POOL_SIZE', 10))
+export_segments = int(os.getenv('EXPORT_SEGMENTS', 4))
 
 bot = Bot(token=TOKEN)
 dp = Dispatcher()
 logger = logging.getLogger(__name__)
-database = Database('Users', os.getenv('USER_STORAGE_URL'), os.getenv('AWS_ACCESS_KEY_ID'),
-                    os.getenv('AWS_SECRET_ACCESS_KEY'))
-
-
-async def correct_user(message: types.Message) -> bool:
-    """Проверяем зарегистрирован ли пользователь и обновляем username(если он был изменен)"""
-    if not database.user_exist(message.from_user.id):
+if os.getenv('STORAGE_BACKEND', 'dynamodb') == 'sqlite':
+    # SQLite пишет из одного потока, поэтому отдельный пул не нужен
+    storage = AsyncDatabase(SQLiteDatabase(os.getenv('SQLITE_PATH', 'litoken.db'),
+                                           bulk_op_ttl=int(os.getenv('BULK_OP_TTL', 7 * 86400))), max_workers=1)
+else:
+    hedge_after_ms = os.getenv('DB_HEDGE_AFTER_MS')
+    storage_client = ResilientClient(max_attempts=int(os.getenv('DB_MAX_ATTEMPTS', 4)),
+                                     hedge_after=int(hedge_after_ms) / 1000 if hedge_after_ms else None,
+                                     hedge_workers=2 * db_pool_size)
+    storage = AsyncDatabase(
+        Database('Users', os.getenv('USER_STORAGE_URL'), os.getenv('AWS_ACCESS_KEY_ID'),
+                 os.getenv('AWS_SECRET_ACCESS_KEY'), max_pool_connections=db_pool_size,
+                 ledger_table_name=os.getenv('LEDGER_TABLE'), shard_table_name=os.getenv('SHARD_TABLE'),
+                 hot_accounts=[int(i) for i in os.getenv('HOT_ACCOUNTS', '').split(',') if i],
+                 balance_shards=int(os.getenv('BALANCE_SHARDS', 8)), client=storage_client,
+                 bulk_op_ttl=int(os.getenv('BULK_OP_TTL', 7 * 86400))),
+        max_workers=db_pool_size)
+leaderboard = Leaderboard()
+# снимок рейтинга на диске ускоряет запуск, но не видит записей других реплик и snapshot.py, поэтому он включается явно
+leaderboard_snapshot = os.getenv('LEADERBOARD_SNAPSHOT')
+database = CachedDatabase(storage, ttl=int(os.getenv('USER_CACHE_TTL', 30)), leaderboard=leaderboard)
+rate_limits = {
+    'get': Limit(2, burst=3),
+    'table': Limit(30),
+    'add_std': Limit(10),
+    'add_tch': Limit(10),
+    # подтверждение перевода, callback_data c_<подписанная ссылка>
+    'c': Limit(1, burst=2),
+    'reconcile': Limit(60),
+    'broadcast': Limit(60),
+}
+outbox = Outbox(bot, rate=float(os.getenv('OUTBOX_RATE', 25)), workers=int(os.getenv('OUTBOX_WORKERS', 4)))
+background_tasks = set()
+if os.getenv('LINK_SECRET'):
+    link_secret = os.getenv('LINK_SECRET').encode()
+else:
+    link_secret = secrets.token_bytes(32)
+    logger.warning('LINK_SECRET is not set: payment links are valid only until restart and only in this process')
+links = LinkSigner(link_secret, ttl=int(os.getenv('LINK_TTL', 86400)))
+# отметка о подтверждении хранится не меньше максимального срока действия ссылки
+if os.getenv('TRANSFERS_TABLE'):
+    transfers = DynamoTransferStore(os.getenv('TRANSFERS_TABLE'), os.getenv('USER_STORAGE_URL'),
+                                    os.getenv('AWS_ACCESS_KEY_ID'), os.getenv('AWS_SECRET_ACCESS_KEY'),
+                                    ttl=int(os.getenv('TRANSFER_TTL', 2 * links.ttl)))
+else:
+    transfers = MemoryTransferStore(ttl=int(os.getenv('TRANSFER_TTL', 2 * links.ttl)))
+roster = Roster(os.getenv('ROSTER_FILE', 'students.csv'))
+transfer_errors = {
+    TransferResult.INSUFFICIENT_FUNDS: 'Недостаточно средств',
+    TransferResult.RECIPIENT_MISSING: 'Такого пользователя не существует',
+    TransferResult.SAME_USER: 'Нельзя отправить токены самому себе',
+    TransferResult.THROTTLED: 'Сервис перегружен, попробуйте еще раз',
+    TransferResult.ERROR: 'Не удалось выполнить перевод',
+}
+
+
+async def correct_user(message: types.Message, user: Union[dict, None]) -> bool:
+    """Проверяем зарегистрирован ли пользователь и обновляем username(если он был изменен).
+    user - запись пользователя, загруженная UserMiddleware"""
+    if not user:
         await message.answer('Вы не зарегистрированы')
         return False
     if message.from_user.username is None:
         await message.answer('@username не должен быть пустым')
         return False
-    if not database.is_username_correct(message.from_user.id, message.from_user.username):
-        database.update_username(message.from_user.id, message.from_user.username)
+    if user.get('username') != message.from_user.username:
+        await database.update_username(message.from_user.id, message.from_user.username)
     return True
 
 
 @dp.message(filters.Command('start'))
-async def cmd_start(message: types.Message):
+async def cmd_start(message: types.Message, user: Union[dict, None]):
     if message.from_user.username is None:
         await message.answer('@username не должен быть пустым')
         return
-    if not database.user_exist(message.from_user.id):
+    if not user:
         await register_user(message)
         await message.answer('Вы успешно зарегистрированы')
-    if not database.is_username_correct(message.from_user.id, message.from_user.username):
-        database.update_username(message.from_user.id, message.from_user.username)
+        user = await database.user_exist(message.from_user.id)
+    elif user.get('username') != message.from_user.username:
+        await database.update_username(message.from_user.id, message.from_user.username)
 
-    if message.text.split('_')[0].startswith('/start send'):
-        await cmd_send(message)
+    args = message.text.split(maxsplit=1)
+    if len(args) == 2:
+        await cmd_send(message, user, args[1])
     else:
         await message.reply('''
         Привет! В этом боте вы можете обмениваться токенами. Для получения подробной информации и инструкций по использованию бота, нажмите 'Помощь📖'.
@@ -56,79 +128,155 @@ async def cmd_start(message: types.Message):
 
 
 @dp.message(F.text == 'Помощь📖')
-async def cmd_help(message: types.Message):
-    if not await correct_user(message):
+async def cmd_help(message: types.Message, user: Union[dict, None]):
+    if not await correct_user(message, user):
         return
     await message.answer('''
 Привет в это боте ты можешь обмениваться токенами посредством сканирования qr кодов 
 /start - если нет кнопки баланса
 /get <количество> для получения qr кода на запрос определенного количества монет, например:
 /get 50
+/history - история операций
+/top - рейтинг пользователей
 Если бот не отвечает - нужно подождать
 delay = 2 сек''')
 
 
 @dp.message(filters.Command('get'))
-async def cmd_get(message: types.Message):
-    if not await correct_user(message):
+async def cmd_get(message: types.Message, user: Union[dict, None]):
+    if not await correct_user(message, user):
         return
     data = message.text.split()
     if len(data) != 2 or not data[-1].isdigit():
         await message.answer('Неправильный ввод')
         return
-    to_id = message.from_user.id
     amount = int(data[1])
-    buf, url = await make_qrcode(to_id, amount)
-    await message.answer_photo(
+    if amount > MAX_AMOUNT:
+        await message.answer('Неправильный ввод')
+        return
+    url = qrcode_url(links.sign(message.from_user.id, amount, message.from_user.username))
+    caption = f'QR code на получение {amount} {await agree_with_num("Токенов", amount)}\n{url}'
+    file_id = get_qrcode_file_id(url)
+    if file_id:
+        await message.answer_photo(photo=file_id, caption=caption)
+        return
+    buf = await make_qrcode(url)
+    sent = await message.answer_photo(
         photo=types.BufferedInputFile(
             file=buf.getvalue(),
             filename=f"{message.from_user.first_name}-profile.png",
-        ), caption=f'QR code на получение {amount} {await agree_with_num("Токенов", amount)}\n{url}')
+        ), caption=caption)
+    remember_qrcode_file_id(url, sent.photo[-1].file_id)
 
 
 @dp.message(F.text == 'Баланс💵')
-async def show_balance(message: types.Message):
-    if not await correct_user(message):
+async def show_balance(message: types.Message, user: Union[dict, None]):
+    if not await correct_user(message, user):
         return
-    balance = database.get_balance(message.from_user.id)
+    balance = user.get('coins')
     await message.answer(f'На вашем балансе {balance} {await agree_with_num("Токен", balance)}')
 
 
-async def cmd_send(message: types.Message):
-    if not await correct_user(message):
+async def cmd_send(message: types.Message, user: Union[dict, None], payload: str):
+    """
+    Подтверждение перевода по подписанной ссылке: получатель, его username и сумма берутся из ссылки,
+    поэтому обращений к базе данных нет. Существование получателя проверяет сам перевод.
+    """
+    if not await correct_user(message, user):
         return
-    args = message.text.split('_')
-    if len(args) != 3 or not args[1].isdigit() or not args[2].isdigit():
+    status, link = links.verify(payload)
+    if status is LinkStatus.INVALID:
         await message.answer('Неверная ссылка')
         return
-    to_id, amount = int(args[1]), int(args[2])
-    id_ = message.from_user.id
-    if not database.user_exist(to_id):
-        await message.answer('Такого пользователя не существует')
+    if status is LinkStatus.EXPIRED:
+        await message.answer('Срок действия QR code истек, попросите получателя создать новый')
         return
     confirm_builder = keyboard.InlineKeyboardBuilder().add(types.InlineKeyboardButton(
         text='Подтвердить',
-        callback_data=f'confirm_{id_}_{to_id}_{amount}')
+        callback_data=f'c_{payload}')
     )
     await message.answer(
-        f'Вы точно хотите отправить пользователю @{database.get_username(to_id)} {amount} {await agree_with_num("Токенов", int(amount))}',
+        f'Вы точно хотите отправить пользователю @{link.username} {link.amount} {await agree_with_num("Токенов", link.amount)}',
         reply_markup=confirm_builder.as_markup()
     )
 
 
-@dp.callback_query(F.data.startswith('confirm_'))
+@dp.callback_query(F.data.startswith('c_'))
 async def send_tokens(callback: types.CallbackQuery):
-    args = callback.data.split('_')
-    id_ = int(args[1])
-    to_id = int(args[2])
-    amount = int(args[3])
-    if database.transaction(id_, to_id, amount):
+    status, link = links.verify(callback.data.removeprefix('c_'))
+    if status is not LinkStatus.VALID:
+        await callback.message.edit_text('Подтверждение устарело, отсканируйте QR code еще раз')
+        return
+    # одно сообщение с кнопкой - один перевод, даже при двойном нажатии или повторной доставке callback
+    transfer_id = f'{callback.from_user.id}:{callback.message.message_id}'
+    id_, to_id, amount = callback.from_user.id, link.to_id, link.amount
+    status, transfer = await transfers.claim(transfer_id, {'from_id': id_, 'to_id': to_id, 'amount': amount})
+    if status is ClaimStatus.EXPIRED:
+        await callback.message.edit_text('Подтверждение устарело, отсканируйте QR code еще раз')
+        return
+    if status is ClaimStatus.DUPLICATE:
+        await callback.answer('Перевод уже обработан')
+        return
+    result = await database.transaction(id_, to_id, amount)
+    await transfers.finish(transfer_id, result)
+    if result is TransferResult.OK:
         await callback.message.edit_text(
-            f'Пользователю @{database.get_username(to_id)} отправлено {amount} {await agree_with_num("Токенов", int(amount))}')
-        await bot.send_message(chat_id=to_id,
-                               text=f'Получено {amount} {await agree_with_num("Токенов", int(amount))} от @{callback.from_user.username}')
+            f'Пользователю @{link.username} отправлено {amount} {await agree_with_num("Токенов", int(amount))}')
+        outbox.send(to_id, f'Получено {amount} {await agree_with_num("Токенов", int(amount))} от @{callback.from_user.username}')
     else:
-        await callback.message.edit_text('Недостаточно средств')
+        await callback.message.edit_text(transfer_errors[result])
+
+
+history_kinds = {
+    'open': 'Начальный баланс',
+    'admin': 'Администратор',
+    'bulk': 'Начисление',
+    'transfer': 'Перевод',
+}
+
+
+async def send_history(message: types.Message, chat_id: int, cursor: Union[str, None] = None):
+    entries, next_cursor = await database.get_history(chat_id, cursor=cursor)
+    if not entries:
+        await message.answer('История операций пуста')
+        return
+    lines = []
+    for entry in entries:
+        date = datetime.datetime.fromtimestamp(int(entry['ts'].split('-')[0]) / 1e9).strftime('%d.%m.%Y %H:%M')
+        lines.append(f'{date} {int(entry["delta"]):+} {history_kinds.get(entry["kind"], entry["kind"])}')
+    reply_markup = None
+    if next_cursor:
+        reply_markup = keyboard.InlineKeyboardBuilder().add(types.InlineKeyboardButton(
+            text='Еще', callback_data=f'history_{next_cursor}')).as_markup()
+    await message.answer('\n'.join(lines), reply_markup=reply_markup)
+
+
+@dp.message(filters.Command('history'))
+async def cmd_history(message: types.Message, user: Union[dict, None]):
+    if not await correct_user(message, user):
+        return
+    await send_history(message, message.from_user.id)
+
+
+@dp.callback_query(F.data.startswith('history_'))
+async def history_page(callback: types.CallbackQuery):
+    await send_history(callback.message, callback.from_user.id, callback.data.removeprefix('history_'))
+    await callback.answer()
+
+
+@dp.message(filters.Command('top'))
+async def cmd_top(message: types.Message, user: Union[dict, None]):
+    if not await correct_user(message, user):
+        return
+    if not leaderboard.ready:
+        await message.answer('Рейтинг еще загружается, попробуйте позже')
+        return
+    lines = [f'{place}. @{username} - {coins} {await agree_with_num("Токен", coins)}'
+             for place, (_, coins, username) in enumerate(leaderboard.top(10), start=1)]
+    rank = leaderboard.rank(message.from_user.id)
+    if rank:
+        lines.append(f'\nВаше место: {rank[0]} из {rank[1]}')
+    await message.answer('\n'.join(lines))
 
 
 async def register_user(message: types.Message):
@@ -136,12 +284,12 @@ async def register_user(message: types.Message):
     username = message.from_user.username
     chat_id = message.from_user.id
     coins = 0
-    database.add_user(chat_id, coins, username)
+    await database.add_user(chat_id, coins, username)
 
 
 @dp.message(filters.Command('add'))
-async def cmd_add(message: types.Message):
-    if not await correct_user(message):
+async def cmd_add(message: types.Message, user: Union[dict, None]):
+    if not await correct_user(message, user):
         return
     data = message.text.split()
     if len(data) != 3 or not data[1].isdigit():
@@ -150,11 +298,11 @@ async def cmd_add(message: types.Message):
     if message.from_user.username in admins:
         amount = int(data[1])
         username = data[-1]
-        id_ = database.get_chat_id(username)
-        if not database.user_exist(id_):
+        id_ = await database.get_chat_id(username)
+        if not await database.user_exist(id_):
             await message.answer('Такого пользователя не существует')
             return
-        database.add_coins(id_, amount)
+        await database.add_coins(id_, amount)
         await message.answer(
             f'Пользователю @{username} успешно добавлено {amount} {await agree_with_num("Токенов", int(amount))}')
     else:
@@ -162,8 +310,8 @@ async def cmd_add(message: types.Message):
 
 
 @dp.message(filters.Command('sub'))
-async def cmd_sub(message: types.Message):
-    if not await correct_user(message):
+async def cmd_sub(message: types.Message, user: Union[dict, None]):
+    if not await correct_user(message, user):
         return
     data = message.text.split()
     if len(data) != 3 or not data[1].isdigit():
@@ -172,16 +320,16 @@ async def cmd_sub(message: types.Message):
     if message.from_user.username in admins:
         amount = int(data[1])
         username = data[-1]
-        id_ = database.get_chat_id(username)
-        if not database.user_exist(id_):
+        id_ = await database.get_chat_id(username)
+        if not await database.user_exist(id_):
             await message.answer('Такого пользователя не существует')
             return
-        if database.get_transaction_verdict(id_, amount):
-            database.subtract_coins(id_, amount)
+        if await database.get_transaction_verdict(id_, amount):
+            await database.subtract_coins(id_, amount)
             cur_balance = amount
         else:
-            cur_balance = database.get_balance(id_)
-            database.subtract_coins(id_, cur_balance)
+            cur_balance = await database.get_balance(id_)
+            await database.subtract_coins(id_, cur_balance)
             await message.answer(
                 f'Вычитаемый баланс превышает действительный. Баланс обнулен'
             )
@@ -192,22 +340,75 @@ async def cmd_sub(message: types.Message):
 
 
 @dp.message(filters.Command('table'))
-async def cmd_table(message: types.Message):
-    if not await correct_user(message):
+async def cmd_table(message: types.Message, user: Union[dict, None]):
+    if not await correct_user(message, user):
         return
     if message.from_user.username not in admins:
         await message.answer('У вас нет прав для этой команды')
         return
 
-    excel_file = await get_table(database.get_data())
-    await message.answer_document(
-        document=types.BufferedInputFile(excel_file.read(), filename='пользователи и балансы.xlsx'))
-    excel_file.close()
+    excel_file = await get_table(database.iter_data(export_segments), roster)
+    try:
+        await message.answer_document(
+            document=SpooledInputFile(excel_file, filename='пользователи и балансы.xlsx'))
+    finally:
+        excel_file.close()
+
+
+async def bulk_credit(message: types.Message, usernames: List[str], amount: int):
+    """Массовое начисление; id сообщения служит ключом идемпотентности при повторной доставке команды"""
+    results = await database.bulk_add_coins([i.strip().lstrip('@') for i in usernames], amount,
+                                            f'{message.chat.id}:{message.message_id}')
+    added = sum(result in (BulkResult.CREDITED, BulkResult.ALREADY_CREDITED) for result in results.values())
+    await message.answer(
+        f'{added} {await agree_with_num("пользователям", added)} было добавлено {amount} {await agree_with_num("токенов", amount)}')
+    failed = [username for username, result in results.items() if result is BulkResult.ERROR]
+    if failed:
+        await message.answer(f'Не удалось начислить: {", ".join(failed)}')
+
+
+@dp.message(filters.Command('reconcile'))
+async def cmd_reconcile(message: types.Message, user: Union[dict, None]):
+    if not await correct_user(message, user):
+        return
+    if message.from_user.username not in admins:
+        await message.answer('У вас нет прав для этой команды')
+        return
+    mismatches = await database.reconcile()
+    if not mismatches:
+        await message.answer('Балансы совпадают с журналом операций')
+        return
+    lines = [f'{chat_id}: баланс {coins}, по журналу {ledger_sum}'
+             for chat_id, (coins, ledger_sum) in list(mismatches.items())[:50]]
+    await message.answer(f'Расхождений: {len(mismatches)}\n' + '\n'.join(lines))
+
+
+async def run_broadcast(admin_chat_id: int, text: str):
+    sent = await outbox.broadcast(database.scan_items(['chat_id']), text)
+    outbox.send(admin_chat_id, f'Рассылка поставлена в очередь: {sent} {await agree_with_num("пользователям", sent)}')
+
+
+@dp.message(filters.Command('broadcast'))
+async def cmd_broadcast(message: types.Message, user: Union[dict, None]):
+    if not await correct_user(message, user):
+        return
+    if message.from_user.username not in admins:
+        await message.answer('У вас нет прав для этой команды')
+        return
+    text = message.text.partition(' ')[2].strip()
+    if not text:
+        await message.answer('Неправильный ввод')
+        return
+    # рассылка идет в фоне, хендлер не ждет обхода таблицы
+    task = asyncio.create_task(run_broadcast(message.chat.id, text))
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    await message.answer('Рассылка запущена')
 
 
 @dp.message(filters.Command('add_std'))
-async def cmd_add_std(message: types.Message):
-    if not await correct_user(message):
+async def cmd_add_std(message: types.Message, user: Union[dict, None]):
+    if not await correct_user(message, user):
         return
     data = message.text.split()
     if len(data) != 2:
@@ -219,22 +420,19 @@ async def cmd_add_std(message: types.Message):
         await message.answer('Неправильный ввод')
         return
     if message.from_user.username in admins:
-        students = os.getenv('STUDENTS').split(',')
-        added_students = 0
-        for i in students:
-            id_ = database.get_chat_id(i)
-            if id_:
-                database.add_coins(id_, amount)
-                added_students += 1
-        await message.answer(
-            f'{added_students} {await agree_with_num("пользователям", added_students)} было добавлено {amount} {await agree_with_num("токенов", amount)}')
+        if os.getenv('STUDENTS'):
+            students = os.getenv('STUDENTS').split(',')
+        else:
+            await asyncio.to_thread(roster.refresh)
+            students = roster.usernames()
+        await bulk_credit(message, students, amount)
     else:
         await message.answer('У вас нет прав для этой команды')
 
 
 @dp.message(filters.Command('add_tch'))
-async def cmd_add_tch(message: types.Message):
-    if not await correct_user(message):
+async def cmd_add_tch(message: types.Message, user: Union[dict, None]):
+    if not await correct_user(message, user):
         return
     data = message.text.split()
     if len(data) != 2:
@@ -246,25 +444,125 @@ async def cmd_add_tch(message: types.Message):
         await message.answer('Неправильный ввод')
         return
     if message.from_user.username in admins:
-        students = os.getenv('TEACHERS').split(',')
-        added_teachers = 0
-        for i in students:
-            id_ = database.get_chat_id(i)
-            if id_:
-                database.add_coins(id_, amount)
-                added_teachers += 1
-        await message.answer(
-            f'{added_teachers} {await agree_with_num("пользователям", added_teachers)} было добавлено {amount} {await agree_with_num("токенов", amount)}')
+        teachers = os.getenv('TEACHERS').split(',')
+        await bulk_credit(message, teachers, amount)
     else:
         await message.answer('У вас нет прав для этой команды')
 
 
+@dp.errors(filters.ExceptionTypeFilter(StorageError))
+async def storage_error(event: types.ErrorEvent):
+    """Ошибки хранилища, оставшиеся после повторов, показываются пользователю вместо ответа хендлера"""
+    if isinstance(event.exception, StorageThrottled):
+        text = 'Сервис перегружен, попробуйте еще раз через минуту'
+    else:
+        text = 'Сервис временно недоступен, попробуйте позже'
+    logger.warning('Storage error in update %s: %s', event.update.update_id, event.exception)
+    if event.update.message:
+        await event.update.message.answer(text)
+    elif event.update.callback_query:
+        await event.update.callback_query.answer(text, show_alert=True)
+    return True
+
+
+def setup_dispatcher(limiter=None):
+    """Регистрирует middleware; limiter по умолчанию выбирается по RATE_LIMIT_TABLE"""
+    if limiter is None and os.getenv('RATE_LIMIT_TABLE'):
+        limiter = DynamoRateLimiter(os.getenv('RATE_LIMIT_TABLE'), os.getenv('USER_STORAGE_URL'),
+                                    os.getenv('AWS_ACCESS_KEY_ID'), os.getenv('AWS_SECRET_ACCESS_KEY'))
+    elif limiter is None:
+        limiter = MemoryRateLimiter()
+    throttling = ThrottlingMiddleware(limiter, limits=rate_limits)
+    dp.message.middleware(throttling)
+    dp.callback_query.middleware(throttling)
+    Gauge('litoken_throttling_events', 'Rate limiter decisions', 'decision', lambda: throttling.stats)
+    Gauge('litoken_user_cache_events', 'User cache hits, misses and saved round trips', 'event', lambda: database.stats)
+    Gauge('litoken_outbox_messages', 'Outbox counters and depth', 'event', lambda: {**outbox.stats, 'depth': outbox.depth()})
+    if isinstance(storage.database, Database):
+        dynamo = storage.database.dynamo
+        Gauge('litoken_db_client_events', 'Storage retries, throttles, hedged reads and circuit breaker state', 'event',
+              lambda: {**dynamo.stats, 'breaker_open': int(dynamo.breaker.state is not BreakerState.CLOSED)})
+    dp.message.middleware(MetricsMiddleware())
+    dp.callback_query.middleware(MetricsMiddleware())
+    dp.message.middleware(UserMiddleware(database))
+    dp.callback_query.middleware(UserMiddleware(database))
+
+
+async def load_leaderboard():
+    """
+    Рейтинг заполняется одним обходом таблицы пользователей. Если задан LEADERBOARD_SNAPSHOT, сначала загружается
+    снимок не старше LEADERBOARD_SNAPSHOT_MAX_AGE секунд - только для одной реплики без записей в обход бота.
+    """
+    max_age = int(os.getenv('LEADERBOARD_SNAPSHOT_MAX_AGE', 3600))
+    if leaderboard_snapshot and await asyncio.to_thread(leaderboard.load, leaderboard_snapshot, max_age):
+        logger.info('Leaderboard loaded from %s: %s users', leaderboard_snapshot, len(leaderboard))
+        return
+    await database.seed_leaderboard(export_segments)
+    logger.info('Leaderboard seeded from the users table: %s users', len(leaderboard))
+
+
+async def save_leaderboard_periodically(interval: int):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(leaderboard.save, leaderboard_snapshot)
+        except OSError as e:
+            print(f"Error in save_leaderboard: {e}")
+
+
+async def compact_balances_periodically(interval: int):
+    """Переносит зачисления из шардов горячих аккаунтов в записи пользователей"""
+    while True:
+        await asyncio.sleep(interval)
+        failed = [chat_id for chat_id, ok in (await database.compact_balances()).items() if not ok]
+        if failed:
+            logger.warning('Balance compaction failed for %s', failed)
+
+
+async def warm_up():
+    """Одновременно загружает словари морфологии, рейтинг и создает клиенты и соединения хранилища до приема апдейтов"""
+    start = time.perf_counter()
+    _, storage_ready, _ = await asyncio.gather(asyncio.to_thread(warm_up_morph), database.warm_up(),
+                                               load_leaderboard())
+    if not storage_ready:
+        logger.warning('Storage warm-up failed (see the errors above), first requests may be slow or fail')
+    logger.info('Warm-up finished in %.2f s', time.perf_counter() - start)
+
+
 async def main():
     logging.basicConfig(level=logging.INFO, stream=sys.stdout)
 
-    dp.message.middleware(ThrottlingMiddleware())
-    await bot.delete_webhook(drop_pending_updates=True)
-    await dp.start_polling(bot)
+    setup_dispatcher()
+    await warm_up()
+    outbox.start()
+    snapshot_interval = int(os.getenv('LEADERBOARD_SNAPSHOT_INTERVAL', 300))
+    snapshots = asyncio.create_task(save_leaderboard_periodically(snapshot_interval)) if leaderboard_snapshot else None
+    compaction = asyncio.create_task(compact_balances_periodically(int(os.getenv('BALANCE_COMPACT_INTERVAL', 60))))
+    # метрики на отдельном порту в обоих режимах: порт вебхука открыт наружу
+    metrics_runner = None
+    if os.getenv('METRICS_PORT'):
+        metrics_runner = await start_metrics_server(os.getenv('METRICS_HOST', '127.0.0.1'),
+                                                    int(os.getenv('METRICS_PORT')))
+    try:
+        if os.getenv('WEBHOOK_URL'):
+            await run_webhook(dp, bot, os.getenv('WEBHOOK_URL'),
+                              host=os.getenv('WEBHOOK_HOST', '0.0.0.0'),
+                              port=int(os.getenv('WEBHOOK_PORT', 8080)),
+                              path=os.getenv('WEBHOOK_PATH', '/webhook'),
+                              secret_token=os.getenv('WEBHOOK_SECRET'),
+                              workers=int(os.getenv('WEBHOOK_WORKERS', 8)),
+                              maxsize=int(os.getenv('WEBHOOK_QUEUE_SIZE', 1000)))
+        else:
+            await bot.delete_webhook(drop_pending_updates=True)
+            await dp.start_polling(bot)
+    finally:
+        compaction.cancel()
+        if snapshots:
+            snapshots.cancel()
+            await asyncio.to_thread(leaderboard.save, leaderboard_snapshot)
+        await outbox.stop(timeout=10)
+        if metrics_runner:
+            await metrics_runner.cleanup()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,155 @@
+import bisect
+import functools
+import inspect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Tuple, Sequence
+
+from aiohttp import web
+
+REGISTRY = []
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _format_labels(labelnames: Sequence[str], labels: Tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(labelnames, labels)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.values: Dict[Tuple, float] = {}
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, *labels, amount: float = 1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} counter'
+        for labels, value in list(self.values.items()):
+            yield f'{self.name}{_format_labels(self.labelnames, labels)} {value}'
+
+
+class Gauge:
+    """Значения вычисляются при запросе /metrics функцией collect: {значение метки: число}"""
+
+    def __init__(self, name: str, documentation: str, labelname: str, collect: Callable[[], Dict[str, float]]):
+        self.name = name
+        self.documentation = documentation
+        self.labelname = labelname
+        self.collect = collect
+        REGISTRY.append(self)
+
+    def render(self):
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} gauge'
+        for label, value in list(self.collect().items()):
+            yield f'{self.name}{{{self.labelname}="{label}"}} {value}'
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        # метки -> [счетчики по корзинам..., сумма, количество]
+        self.values: Dict[Tuple, list] = {}
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value: float, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            data = self.values.get(labels)
+            if data is None:
+                data = self.values[labels] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                data[index] += 1
+            data[-2] += value
+            data[-1] += 1
+
+    @contextmanager
+    def time(self, *labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def render(self):
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} histogram'
+        for labels, data in list(self.values.items()):
+            cumulative = 0
+            for bucket, count in zip(self.buckets, data):
+                cumulative += count
+                bucket_labels = _format_labels(self.labelnames, labels, f'le="{bucket}"')
+                yield f'{self.name}_bucket{bucket_labels} {cumulative}'
+            inf_labels = _format_labels(self.labelnames, labels, 'le="+Inf"')
+            yield f'{self.name}_bucket{inf_labels} {data[-1]}'
+            yield f'{self.name}_sum{_format_labels(self.labelnames, labels)} {data[-2]}'
+            yield f'{self.name}_count{_format_labels(self.labelnames, labels)} {data[-1]}'
+
+
+def instrument_methods(histogram: Histogram):
+    """Декоратор класса: замеряет время каждого публичного метода (генераторы не оборачиваются)"""
+
+    def decorator(cls):
+        for name, method in list(vars(cls).items()):
+            if name.startswith('_') or not inspect.isfunction(method) or inspect.isgeneratorfunction(method):
+                continue
+            setattr(cls, name, _timed(histogram, name, method))
+        return cls
+
+    return decorator
+
+
+def _timed(histogram: Histogram, name: str, method):
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            histogram.observe(time.perf_counter() - start, name)
+
+    return wrapper
+
+
+def render() -> str:
+    return '\n'.join(line for metric in REGISTRY for line in metric.render()) + '\n'
+
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    return web.Response(text=render(), content_type='text/plain', charset='utf-8')
+
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    app = web.Application()
+    app.router.add_get('/metrics', metrics_handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+DB_LATENCY = Histogram('litoken_db_request_seconds', 'Database method latency', ['method'])
+DB_ERRORS = Counter('litoken_db_errors_total', 'Database errors', ['method', 'code'])
+DB_THROTTLES = Counter('litoken_db_throttles_total', 'Throttled DynamoDB requests', ['method'])
+HANDLER_LATENCY = Histogram('litoken_handler_seconds', 'Handler latency', ['handler'])
+HANDLER_ERRORS = Counter('litoken_handler_errors_total', 'Handler exceptions', ['handler'])
+QR_RENDER = Histogram('litoken_qr_render_seconds', 'QR code render time')
+EXCEL_EXPORT = Histogram('litoken_excel_export_seconds', 'Excel export time',
+                         buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300))
@@ -0,0 +1,54 @@
+import csv
+import os
+import threading
+from typing import Union, List
+
+
+class Roster:
+    """
+    Список учеников из CSV (ФИ, Класс, телеграм), проиндексированный по телеграм-нику.
+    Файл перечитывается в refresh() и только при изменении его mtime, get и usernames читают загруженный индекс.
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self._mtime = None
+        self._index = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalize(username: str) -> str:
+        """Telegram username не чувствителен к регистру, @ в начале необязателен"""
+        return username.strip().lstrip('@').lower()
+
+    def refresh(self):
+        """Перечитывает файл, если его mtime изменился; вызывается один раз перед серией get"""
+        try:
+            mtime = os.stat(self.filename).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self._mtime:
+            return
+        with self._lock:
+            if mtime == self._mtime:
+                return
+            index = {}
+            if mtime is not None:
+                with open(self.filename, mode='r', encoding='utf-8') as file:
+                    for row in csv.DictReader(file):
+                        index[self.normalize(row['телеграм'])] = row
+            self._index, self._mtime = index, mtime
+
+    def get(self, username: str) -> Union[dict, None]:
+        """
+        :param username: Telegram username (с @ или без).
+        :return: {'ФИ': ..., 'Класс': ...} или None, если ученика нет в списке.
+        """
+        user = self._index.get(self.normalize(username))
+        return {'ФИ': user['ФИ'], 'Класс': user['Класс']} if user else None
+
+    def usernames(self) -> List[str]:
+        """
+        :return: Telegram username всех учеников без @.
+        """
+        return [row['телеграм'].strip().lstrip('@') for row in self._index.values()]
@@ -0,0 +1,177 @@
+"""
+Снимки таблицы пользователей и массовая загрузка пользователей, без запуска бота.
+
+    python snapshot.py export users.jsonl.gz --segments 8
+    python snapshot.py import users.jsonl.gz --writers 8
+    python snapshot.py import roster.csv --coins 0
+
+Снимок - JSONL, сжатый gzip, по записи на строку, и манифест <снимок>.json с количеством записей, суммой балансов
+и sha256 несжатого содержимого. Перед загрузкой снимок проверяется по манифесту целиком, поэтому поврежденный файл
+не загружается частично.
+
+Загрузка снимка заменяет записи с теми же chat_id. CSV для импорта: колонки chat_id, username (или телеграм)
+и необязательная coins; из CSV добавляются только пользователи, которых еще нет в таблице, балансы существующих
+не меняются. Строки без chat_id пропускаются: ключ таблицы - chat_id, а узнать его по username бот не может.
+Хранилище выбирается теми же переменными окружения, что и в main.py (STORAGE_BACKEND, SQLITE_PATH,
+USER_STORAGE_URL, ...).
+"""
+import argparse
+import csv
+import gzip
+import hashlib
+import json
+import os
+import sys
+import time
+from decimal import Decimal
+from typing import Iterator, Union
+
+from dotenv import load_dotenv
+
+from db_manager import Database, Storage
+from sqlite_db import SQLiteDatabase
+
+
+def make_storage() -> Storage:
+    if os.getenv('STORAGE_BACKEND', 'dynamodb') == 'sqlite':
+        return SQLiteDatabase(os.getenv('SQLITE_PATH', 'litoken.db'))
+    return Database('Users', os.getenv('USER_STORAGE_URL'), os.getenv('AWS_ACCESS_KEY_ID'),
+                    os.getenv('AWS_SECRET_ACCESS_KEY'), max_pool_connections=int(os.getenv('DB_POOL_SIZE', 10)),
+                    ledger_table_name=os.getenv('LEDGER_TABLE'), shard_table_name=os.getenv('SHARD_TABLE'),
+                    hot_accounts=[int(i) for i in os.getenv('HOT_ACCOUNTS', '').split(',') if i],
+                    balance_shards=int(os.getenv('BALANCE_SHARDS', 8)))
+
+
+def manifest_path(path: str) -> str:
+    return f'{path}.json'
+
+
+def _plain(value):
+    """Decimal из boto3 -> int/float для JSON"""
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    return value
+
+
+def _storable(value):
+    """float -> Decimal: boto3 не записывает float в DynamoDB"""
+    if isinstance(value, float):
+        return Decimal(str(value))
+    return value
+
+
+def export_snapshot(storage: Storage, path: str, segments: int = 4) -> dict:
+    """
+    Выгружает таблицу пользователей параллельным постраничным сканированием.
+    Файл и манифест записываются во временные файлы и переименовываются, поэтому прерванная выгрузка
+    не оставляет неполный снимок под итоговым именем.
+    :return: Манифест снимка.
+    """
+    digest = hashlib.sha256()
+    items, coins = 0, 0
+    tmp_path = f'{path}.tmp'
+    with gzip.open(tmp_path, 'wt', encoding='utf-8', compresslevel=6) as f:
+        for item in storage.scan_items(None, segments):
+            item = {key: _plain(value) for key, value in item.items()}
+            line = json.dumps(item, ensure_ascii=False, separators=(',', ':')) + '\n'
+            digest.update(line.encode('utf-8'))
+            f.write(line)
+            items += 1
+            coins += item.get('coins', 0)
+    manifest = {'format': 'jsonl.gz', 'items': items, 'coins': coins, 'sha256': digest.hexdigest(),
+                'created_at': time.time()}
+    with open(manifest_path(tmp_path), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, path)
+    os.replace(manifest_path(tmp_path), manifest_path(path))
+    return manifest
+
+
+def _snapshot_lines(path: str) -> Iterator[str]:
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        yield from f
+
+
+def verify_snapshot(path: str) -> dict:
+    """
+    Сверяет снимок с манифестом: количество записей, сумму балансов и sha256.
+    :raises ValueError: Снимок не совпадает с манифестом.
+    :return: Манифест.
+    """
+    with open(manifest_path(path), encoding='utf-8') as f:
+        manifest = json.load(f)
+    digest = hashlib.sha256()
+    items, coins = 0, 0
+    for line in _snapshot_lines(path):
+        digest.update(line.encode('utf-8'))
+        items += 1
+        coins += json.loads(line).get('coins', 0)
+    if (items, coins, digest.hexdigest()) != (manifest['items'], manifest['coins'], manifest['sha256']):
+        raise ValueError(f'{path} does not match its manifest')
+    return manifest
+
+
+def read_snapshot(path: str) -> Iterator[dict]:
+    for line in _snapshot_lines(path):
+        # пустой username (снимок SQLite) не записывается: атрибут - ключ индекса username
+        yield {key: _storable(value) for key, value in json.loads(line).items() if value is not None}
+
+
+def read_roster(path: str, coins: int = 0) -> Iterator[dict]:
+    """
+    :param coins: Баланс для строк без колонки coins.
+    :return: Генератор записей пользователей; строки без chat_id пропускаются с сообщением в stderr.
+    """
+    with open(path, encoding='utf-8', newline='') as f:
+        for line, row in enumerate(csv.DictReader(f), start=2):
+            chat_id = (row.get('chat_id') or '').strip()
+            username = (row.get('username') or row.get('телеграм') or '').strip().lstrip('@')
+            if not chat_id.lstrip('-').isdigit():
+                print(f'{path}:{line}: skipped, no chat_id for {username or row}', file=sys.stderr)
+                continue
+            balance = (row.get('coins') or '').strip()
+            item = {'chat_id': int(chat_id), 'coins': int(balance) if balance else coins}
+            if username:
+                item['username'] = username
+            yield item
+
+
+def import_items(storage: Storage, path: str, writers: int = 4, coins: int = 0) -> int:
+    """
+    Загружает пользователей из снимка (*.jsonl.gz, проверяется по манифесту, записи заменяются) или CSV
+    (добавляются только новые пользователи).
+    :return: Количество записанных записей.
+    """
+    if path.endswith('.csv'):
+        return storage.insert_items(read_roster(path, coins), writers)
+    verify_snapshot(path)
+    return storage.put_items(read_snapshot(path), writers)
+
+
+def main(argv: Union[list, None] = None):
+    load_dotenv()
+    parser = argparse.ArgumentParser(description='Снимки таблицы пользователей и массовая загрузка пользователей')
+    commands = parser.add_subparsers(dest='command', required=True)
+    export_parser = commands.add_parser('export', help='выгрузить таблицу в снимок')
+    export_parser.add_argument('path')
+    export_parser.add_argument('--segments', type=int, default=int(os.getenv('EXPORT_SEGMENTS', 4)))
+    import_parser = commands.add_parser('import', help='загрузить пользователей из снимка или CSV')
+    import_parser.add_argument('path')
+    import_parser.add_argument('--writers', type=int, default=4)
+    import_parser.add_argument('--coins', type=int, default=0, help='баланс для строк CSV без колонки coins')
+    args = parser.parse_args(argv)
+
+    storage = make_storage()
+    start = time.perf_counter()
+    if args.command == 'export':
+        manifest = export_snapshot(storage, args.path, args.segments)
+        items = manifest['items']
+        print(json.dumps(manifest))
+    else:
+        items = import_items(storage, args.path, args.writers, args.coins)
+    elapsed = time.perf_counter() - start
+    print(f'{args.command}: {items} items in {elapsed:.1f} s ({items / max(elapsed, 1e-9):.0f} items/s)')
+
+
+if __name__ == '__main__':
+    main()
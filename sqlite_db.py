@@ -0,0 +1,268 @@
+import secrets
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from itertools import islice
+from typing import Union, List, Tuple, Iterator, Iterable, Dict
+
+from db_manager import TransferResult, BulkResult
+from metrics import instrument_methods, DB_LATENCY
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS users (
+    chat_id INTEGER PRIMARY KEY,
+    coins INTEGER NOT NULL,
+    username TEXT
+);
+CREATE INDEX IF NOT EXISTS users_username ON users (username);
+CREATE TABLE IF NOT EXISTS bulk_ops (
+    chat_id INTEGER NOT NULL,
+    operation_id TEXT NOT NULL,
+    expires_at INTEGER NOT NULL,
+    PRIMARY KEY (chat_id, operation_id)
+);
+CREATE TABLE IF NOT EXISTS ledger (
+    chat_id INTEGER NOT NULL,
+    ts TEXT NOT NULL,
+    delta INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    counterparty INTEGER,
+    PRIMARY KEY (chat_id, ts)
+);
+'''
+
+
+@instrument_methods(DB_LATENCY)
+class SQLiteDatabase:
+    """
+    Встроенное хранилище SQLite с тем же интерфейсом, что и Database (DynamoDB).
+    Используется для разработки, тестов и небольших установок: WAL, индекс по username,
+    переводы и журнал операций в одной транзакции. Асинхронный доступ - через AsyncDatabase с max_workers=1.
+    """
+
+    def __init__(self, path: str, page_size: int = 1000, bulk_op_ttl: int = 7 * 86400):
+        """
+        :param path: Путь к файлу базы данных (':memory:' - база в памяти).
+        :param page_size: Размер страницы при потоковом обходе таблицы.
+        :param bulk_op_ttl: Сколько секунд хранится отметка массового начисления, как в Database.
+        """
+        self.path = path
+        self.page_size = page_size
+        self.bulk_op_ttl = bulk_op_ttl
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(SCHEMA)
+
+    @contextmanager
+    def _transaction(self):
+        with self.lock:
+            self.connection.execute('BEGIN IMMEDIATE')
+            try:
+                yield self.connection
+            except BaseException:
+                self.connection.execute('ROLLBACK')
+                raise
+            self.connection.execute('COMMIT')
+
+    def _fetchone(self, query: str, params: tuple) -> Union[sqlite3.Row, None]:
+        with self.lock:
+            return self.connection.execute(query, params).fetchone()
+
+    @staticmethod
+    def _ledger_insert(connection: sqlite3.Connection, chat_id: int, delta: int, kind: str,
+                       counterparty: Union[int, None] = None):
+        connection.execute(
+            'INSERT INTO ledger (chat_id, ts, delta, kind, counterparty) VALUES (?, ?, ?, ?, ?)',
+            (chat_id, f'{time.time_ns():020d}-{secrets.token_hex(3)}', delta, kind, counterparty))
+
+    def warm_up(self) -> bool:
+        self._fetchone('SELECT 1', ())
+        return True
+
+    def user_exist(self, chat_id: int) -> Union[dict, None]:
+        row = self._fetchone('SELECT chat_id, coins, username FROM users WHERE chat_id = ?', (chat_id,))
+        return dict(row) if row else None
+
+    def add_user(self, chat_id: int, coins: int, username: str) -> bool:
+        with self._transaction() as connection:
+            connection.execute('INSERT OR REPLACE INTO users (chat_id, coins, username) VALUES (?, ?, ?)',
+                               (chat_id, coins, username))
+            self._ledger_insert(connection, chat_id, coins, 'open')
+        return True
+
+    def is_username_correct(self, chat_id: int, username: str) -> bool:
+        user = self.user_exist(chat_id)
+        return bool(user) and user['username'] == username
+
+    def update_username(self, chat_id: int, new_username: str) -> bool:
+        with self.lock:
+            self.connection.execute('UPDATE users SET username = ? WHERE chat_id = ?', (new_username, chat_id))
+        return True
+
+    def add_coins(self, chat_id: int, amount: int, kind: str = 'admin') -> bool:
+        with self._transaction() as connection:
+            if connection.execute('UPDATE users SET coins = coins + ? WHERE chat_id = ?',
+                                  (amount, chat_id)).rowcount == 0:
+                return False
+            self._ledger_insert(connection, chat_id, amount, kind)
+        return True
+
+    def subtract_coins(self, chat_id: int, amount: int, kind: str = 'admin') -> bool:
+        with self._transaction() as connection:
+            if connection.execute('UPDATE users SET coins = coins - ? WHERE chat_id = ?',
+                                  (amount, chat_id)).rowcount == 0:
+                return False
+            self._ledger_insert(connection, chat_id, -amount, kind)
+        return True
+
+    def get_transaction_verdict(self, chat_id: int, amount: int) -> Union[bool, None]:
+        user = self.user_exist(chat_id)
+        return bool(user) and user['coins'] >= amount
+
+    def transaction(self, chat_id: int, to_chat_id: int, amount: int) -> TransferResult:
+        if chat_id == to_chat_id:
+            return TransferResult.SAME_USER
+        # BEGIN IMMEDIATE берет блокировку записи, поэтому проверки и списание не разделяются другими записями
+        with self._transaction() as connection:
+            # порядок проверок как в Database: сначала средства отправителя, затем получатель
+            sender = connection.execute('SELECT coins FROM users WHERE chat_id = ?', (chat_id,)).fetchone()
+            if sender is None or sender['coins'] < amount:
+                return TransferResult.INSUFFICIENT_FUNDS
+            if connection.execute('SELECT 1 FROM users WHERE chat_id = ?', (to_chat_id,)).fetchone() is None:
+                return TransferResult.RECIPIENT_MISSING
+            connection.execute('UPDATE users SET coins = coins - ? WHERE chat_id = ?', (amount, chat_id))
+            connection.execute('UPDATE users SET coins = coins + ? WHERE chat_id = ?', (amount, to_chat_id))
+            self._ledger_insert(connection, chat_id, -amount, 'transfer', to_chat_id)
+            self._ledger_insert(connection, to_chat_id, amount, 'transfer', chat_id)
+        return TransferResult.OK
+
+    def bulk_add_coins(self, usernames: Iterable[str], amount: int, operation_id: str) -> Dict[str, BulkResult]:
+        results = {}
+        now = int(time.time())
+        with self._transaction() as connection:
+            # устаревшие отметки удаляются здесь же, таблица не растет вместе с историей начислений
+            connection.execute('DELETE FROM bulk_ops WHERE expires_at <= ?', (now,))
+            for username in dict.fromkeys(usernames):
+                row = connection.execute('SELECT chat_id FROM users WHERE username = ?', (username,)).fetchone()
+                if row is None:
+                    results[username] = BulkResult.NOT_FOUND
+                elif connection.execute('INSERT OR IGNORE INTO bulk_ops VALUES (?, ?, ?)',
+                                        (row['chat_id'], operation_id, now + self.bulk_op_ttl)).rowcount == 0:
+                    results[username] = BulkResult.ALREADY_CREDITED
+                else:
+                    connection.execute('UPDATE users SET coins = coins + ? WHERE chat_id = ?',
+                                       (amount, row['chat_id']))
+                    self._ledger_insert(connection, row['chat_id'], amount, 'bulk')
+                    results[username] = BulkResult.CREDITED
+        return results
+
+    def get_username(self, chat_id: int) -> Union[str, None]:
+        user = self.user_exist(chat_id)
+        return user['username'] if user else None
+
+    def get_chat_id(self, username: str) -> Union[int, None]:
+        row = self._fetchone('SELECT chat_id FROM users WHERE username = ?', (username,))
+        return row['chat_id'] if row else None
+
+    def create_username_index(self) -> bool:
+        # индекс создается вместе со схемой
+        return True
+
+    def get_balance(self, chat_id: int) -> Union[int, None]:
+        user = self.user_exist(chat_id)
+        return user['coins'] if user else None
+
+    def get_history(self, chat_id: int, limit: int = 10,
+                    cursor: Union[str, None] = None) -> Tuple[List[dict], Union[str, None]]:
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT chat_id, ts, delta, kind, counterparty FROM ledger WHERE chat_id = ? AND ts < ? '
+                'ORDER BY ts DESC LIMIT ?', (chat_id, cursor or '~', limit + 1)).fetchall()
+        entries = [dict(row) for row in rows[:limit]]
+        return entries, entries[-1]['ts'] if len(rows) > limit else None
+
+    def reconcile(self) -> Dict[int, Tuple[int, int]]:
+        with self.lock:
+            # записи журнала без пользователя сверяются с нулевым балансом, как в Database.reconcile
+            rows = self.connection.execute(
+                'SELECT chat_id, coins, ledger_sum FROM ('
+                'SELECT users.chat_id, users.coins, COALESCE(SUM(ledger.delta), 0) AS ledger_sum '
+                'FROM users LEFT JOIN ledger ON ledger.chat_id = users.chat_id GROUP BY users.chat_id '
+                'UNION ALL '
+                'SELECT chat_id, 0, SUM(delta) FROM ledger WHERE chat_id NOT IN (SELECT chat_id FROM users) '
+                'GROUP BY chat_id) WHERE coins <> ledger_sum').fetchall()
+        return {row['chat_id']: (row['coins'], row['ledger_sum']) for row in rows}
+
+    def scan_items(self, projection: Union[List[str], None] = None, segments: int = 1) -> Iterator[dict]:
+        """
+        Постраничный обход по первичному ключу; блокировка держится только на время чтения страницы.
+        """
+        columns = ', '.join(f'"{column}"' for column in projection) if projection else 'chat_id, coins, username'
+        last_chat_id = None
+        while True:
+            with self.lock:
+                rows = self.connection.execute(
+                    f'SELECT chat_id AS _key, {columns} FROM users WHERE ? IS NULL OR chat_id > ? '
+                    f'ORDER BY chat_id LIMIT ?', (last_chat_id, last_chat_id, self.page_size)).fetchall()
+            for row in rows:
+                item = dict(row)
+                last_chat_id = item.pop('_key')
+                yield item
+            if len(rows) < self.page_size:
+                return
+
+    def iter_data(self, segments: int = 1) -> Iterator[Tuple[int, str]]:
+        for item in self.scan_items(['coins', 'username']):
+            yield item['coins'], item['username']
+
+    def get_data(self) -> List[Tuple[int, str]]:
+        return list(self.iter_data())
+
+    def print_all(self):
+        for item in self.scan_items():
+            print(item)
+
+    def delete_all(self, segments: int = 4) -> int:
+        with self._transaction() as connection:
+            return connection.execute('DELETE FROM users').rowcount
+
+    def put_items(self, items: Iterable[dict], writers: int = 4) -> int:
+        """
+        Загрузка пачками по page_size записей, каждая пачка в своей транзакции; writers не используется,
+        SQLite пишет из одного потока. Журнал операций не изменяется.
+        """
+        items = iter(items)
+        written = 0
+        for batch in iter(lambda: list(islice(items, self.page_size)), []):
+            with self._transaction() as connection:
+                connection.executemany('INSERT OR REPLACE INTO users (chat_id, coins, username) VALUES (?, ?, ?)',
+                                       [(item['chat_id'], item['coins'], item.get('username')) for item in batch])
+            written += len(batch)
+        return written
+
+    def insert_items(self, items: Iterable[dict], writers: int = 4) -> int:
+        """
+        Добавляет только новых пользователей (INSERT OR IGNORE) с записью 'open' в журнале, как add_user;
+        writers не используется.
+        """
+        items = iter(items)
+        inserted = 0
+        for batch in iter(lambda: list(islice(items, self.page_size)), []):
+            with self._transaction() as connection:
+                for item in batch:
+                    if connection.execute('INSERT OR IGNORE INTO users (chat_id, coins, username) VALUES (?, ?, ?)',
+                                          (item['chat_id'], item['coins'], item.get('username'))).rowcount:
+                        self._ledger_insert(connection, item['chat_id'], item['coins'], 'open')
+                        inserted += 1
+        return inserted
+
+    def clear_all(self):
+        self.delete_all()
+
+    def compact_balances(self) -> Dict[int, bool]:
+        # записи SQLite не конкурируют за ключ, шарды баланса не используются
+        return {}
@@ -0,0 +1,85 @@
+"""
+Тесты выполняются без сети: DynamoDB заменяется moto, SQLite - база в памяти.
+
+    pip install -r requirements-dev.txt
+    python -m pytest
+"""
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db_manager import Database  # noqa: E402
+
+
+def create_tables(resource, ledger: bool = True, shards: bool = False, username_index: bool = True):
+    """Таблицы в той же схеме, что и в DynamoDB: Users с индексом username, журнал и шарды баланса"""
+    users = {
+        'TableName': 'Users',
+        'KeySchema': [{'AttributeName': 'chat_id', 'KeyType': 'HASH'}],
+        'AttributeDefinitions': [{'AttributeName': 'chat_id', 'AttributeType': 'N'}],
+        'BillingMode': 'PAY_PER_REQUEST',
+    }
+    if username_index:
+        users['AttributeDefinitions'].append({'AttributeName': 'username', 'AttributeType': 'S'})
+        users['GlobalSecondaryIndexes'] = [{
+            'IndexName': 'username-index',
+            'KeySchema': [{'AttributeName': 'username', 'KeyType': 'HASH'}],
+            'Projection': {'ProjectionType': 'KEYS_ONLY'},
+        }]
+    resource.create_table(**users)
+    if ledger:
+        resource.create_table(
+            TableName='Ledger',
+            KeySchema=[{'AttributeName': 'chat_id', 'KeyType': 'HASH'}, {'AttributeName': 'ts', 'KeyType': 'RANGE'}],
+            AttributeDefinitions=[{'AttributeName': 'chat_id', 'AttributeType': 'N'},
+                                  {'AttributeName': 'ts', 'AttributeType': 'S'}],
+            BillingMode='PAY_PER_REQUEST')
+    if shards:
+        resource.create_table(
+            TableName='Shards',
+            KeySchema=[{'AttributeName': 'chat_id', 'KeyType': 'HASH'}, {'AttributeName': 'shard', 'KeyType': 'RANGE'}],
+            AttributeDefinitions=[{'AttributeName': 'chat_id', 'AttributeType': 'N'},
+                                  {'AttributeName': 'shard', 'AttributeType': 'N'}],
+            BillingMode='PAY_PER_REQUEST')
+
+
+@pytest.fixture
+def aws(monkeypatch):
+    """Ресурс DynamoDB moto; все клиенты boto3, созданные внутри теста, обращаются к нему"""
+    import boto3
+    from moto import mock_aws
+    from moto.dynamodb.models import DynamoDBBackend
+    # moto копирует таблицы в transact_write_items без блокировки, а Database выполняет транзакции из нескольких потоков
+    lock = threading.Lock()
+    transact_write_items = DynamoDBBackend.transact_write_items
+
+    def serialized(self, *args, **kwargs):
+        with lock:
+            return transact_write_items(self, *args, **kwargs)
+
+    monkeypatch.setattr(DynamoDBBackend, 'transact_write_items', serialized)
+    with mock_aws():
+        yield boto3.resource('dynamodb', region_name='us-east-1', aws_access_key_id='test',
+                             aws_secret_access_key='test')
+
+
+@pytest.fixture
+def dynamo(aws) -> Database:
+    create_tables(aws)
+    return Database('Users', None, 'test', 'test', ledger_table_name='Ledger')
+
+
+@pytest.fixture(params=['dynamodb', 'sqlite'])
+def storage(request):
+    """Общие тесты интерфейса Storage выполняются для DynamoDB (moto) и SQLite"""
+    if request.param == 'sqlite':
+        from sqlite_db import SQLiteDatabase
+        database = SQLiteDatabase(':memory:')
+        yield database
+        database.connection.close()
+    else:
+        yield request.getfixturevalue('dynamo')
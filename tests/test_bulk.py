@@ -0,0 +1,67 @@
+import time
+
+from conftest import create_tables
+from db_manager import BULK_MARKER, BulkResult, Database
+
+
+def test_bulk_add_coins_is_idempotent(storage):
+    storage.add_user(1, 0, 'alice')
+    storage.add_user(2, 5, 'bob')
+    assert storage.bulk_add_coins(['alice', 'bob', 'carol'], 10, 'op-1') == {
+        'alice': BulkResult.CREDITED, 'bob': BulkResult.CREDITED, 'carol': BulkResult.NOT_FOUND}
+    assert storage.bulk_add_coins(['alice', 'bob'], 10, 'op-1') == {
+        'alice': BulkResult.ALREADY_CREDITED, 'bob': BulkResult.ALREADY_CREDITED}
+    assert (storage.get_balance(1), storage.get_balance(2)) == (10, 15)
+
+
+def test_older_operation_redelivered_after_newer_one(storage):
+    storage.add_user(1, 0, 'alice')
+    assert storage.bulk_add_coins(['alice'], 10, 'op-1')['alice'] is BulkResult.CREDITED
+    assert storage.bulk_add_coins(['alice'], 20, 'op-2')['alice'] is BulkResult.CREDITED
+    # повторная доставка op-1 после op-2 не начисляет монеты второй раз
+    assert storage.bulk_add_coins(['alice'], 10, 'op-1')['alice'] is BulkResult.ALREADY_CREDITED
+    assert storage.get_balance(1) == 30
+    assert storage.reconcile() == {}
+
+
+def test_bulk_credit_without_ledger(aws):
+    create_tables(aws, ledger=False)
+    database = Database('Users', None, 'test', 'test')
+    database.add_user(1, 0, 'alice')
+    assert database.bulk_add_coins(['alice'], 10, 'op-1')['alice'] is BulkResult.CREDITED
+    assert database.bulk_add_coins(['alice'], 10, 'op-2')['alice'] is BulkResult.CREDITED
+    # без журнала метку операции хранить негде, повторная доставка начисляет еще раз
+    assert database.bulk_add_coins(['alice'], 10, 'op-1')['alice'] is BulkResult.CREDITED
+    assert database.get_balance(1) == 30
+
+
+def test_user_deleted_after_lookup_is_not_found(dynamo, monkeypatch):
+    dynamo.add_user(1, 0, 'alice')
+    # запись индекса еще указывает на пользователя, которого уже нет в таблице
+    monkeypatch.setattr(dynamo, 'get_chat_id', lambda username: 2)
+    assert dynamo.bulk_add_coins(['alice'], 10, 'op-1')['alice'] is BulkResult.NOT_FOUND
+    assert dynamo.user_exist(2) is None
+
+
+def test_bulk_marker_expires_and_stays_out_of_history(dynamo):
+    dynamo.add_user(1, 0, 'alice')
+    before = int(time.time())
+    assert dynamo.bulk_add_coins(['alice'], 10, 'op-1')['alice'] is BulkResult.CREDITED
+    marker = dynamo.ledger_table.get_item(Key={'chat_id': 1, 'ts': f'{BULK_MARKER}op-1'})['Item']
+    assert marker['expires_at'] >= before + dynamo.bulk_op_ttl
+    # запись пользователя не растет с количеством операций
+    assert set(dynamo.table.get_item(Key={'chat_id': 1})['Item']) == {'chat_id', 'coins', 'username'}
+    entries, _ = dynamo.get_history(1)
+    assert [entry['kind'] for entry in entries] == ['bulk', 'open']
+    assert dynamo.reconcile() == {}
+
+
+def test_sqlite_expired_bulk_ops_are_removed():
+    from sqlite_db import SQLiteDatabase
+    database = SQLiteDatabase(':memory:', bulk_op_ttl=0)
+    database.add_user(1, 0, 'alice')
+    assert database.bulk_add_coins(['alice'], 10, 'op-1')['alice'] is BulkResult.CREDITED
+    # отметка устарела сразу и удаляется при следующем начислении
+    assert database.bulk_add_coins(['alice'], 10, 'op-1')['alice'] is BulkResult.CREDITED
+    assert database.connection.execute('SELECT COUNT(*) FROM bulk_ops').fetchone()[0] == 1
+    database.connection.close()
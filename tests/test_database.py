@@ -0,0 +1,50 @@
+import asyncio
+
+import pytest
+
+from conftest import create_tables
+from db_manager import AsyncDatabase, Database, TransferResult
+from dynamo_client import StorageError
+
+
+def test_add_user_and_lookup(dynamo):
+    assert dynamo.add_user(1, 100, 'alice')
+    assert dynamo.user_exist(1)['coins'] == 100
+    assert dynamo.user_exist(2) is None
+    assert dynamo.get_chat_id('alice') == 1
+    assert dynamo.get_chat_id('bob') is None
+
+
+def test_update_username_moves_index_entry(dynamo):
+    dynamo.add_user(1, 0, 'alice')
+    assert dynamo.update_username(1, 'alicia')
+    assert dynamo.get_chat_id('alicia') == 1
+    assert dynamo.get_chat_id('alice') is None
+
+
+def test_async_database_runs_calls_concurrently(dynamo):
+    async def scenario():
+        database = AsyncDatabase(dynamo, max_workers=4)
+        try:
+            assert await database.warm_up()
+            await asyncio.gather(*(database.add_user(chat_id, 10, f'user{chat_id}') for chat_id in range(20)))
+            results = await asyncio.gather(*(database.transaction(chat_id, chat_id + 1, 10)
+                                             for chat_id in range(0, 20, 2)))
+            balances = await asyncio.gather(*(database.get_balance(chat_id) for chat_id in range(20)))
+            return results, balances
+        finally:
+            database.close()
+
+    results, balances = asyncio.run(scenario())
+    assert all(result is TransferResult.OK for result in results)
+    assert balances == [0, 20] * 10
+
+
+def test_missing_username_index_fails_loudly(aws):
+    create_tables(aws, username_index=False)
+    database = Database('Users', None, 'test', 'test', ledger_table_name='Ledger')
+    database.add_user(1, 0, 'alice')
+    assert not database.warm_up()
+    # без индекса нельзя отвечать "пользователь не существует"
+    with pytest.raises(StorageError):
+        database.get_chat_id('alice')
@@ -0,0 +1,229 @@
+import threading
+import time
+
+import pytest
+from botocore.exceptions import ClientError, EndpointConnectionError, ReadTimeoutError
+
+from conftest import create_tables
+from db_manager import Database
+from dynamo_client import (BreakerState, CircuitBreaker, ResilientClient, RetryBudget, StorageThrottled,
+                           StorageUnavailable)
+
+
+def throttled():
+    return ClientError({'Error': {'Code': 'ProvisionedThroughputExceededException'}}, 'GetItem')
+
+
+def read_timeout():
+    return ReadTimeoutError(endpoint_url='http://dynamodb')
+
+
+class Flaky:
+    """Завершается ошибками из errors, затем возвращает 'ok'"""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return 'ok'
+
+
+def make_client(**kwargs) -> ResilientClient:
+    return ResilientClient(base_delay=0, **kwargs)
+
+
+def test_throttled_request_is_retried():
+    client = make_client()
+    func = Flaky(throttled(), throttled())
+    assert client.call('GetItem', func) == 'ok'
+    assert func.calls == 3
+    assert client.stats['retries'] == 2
+
+
+def test_throttling_gives_up_after_max_attempts():
+    client = make_client(max_attempts=3)
+    func = Flaky(*(throttled() for _ in range(5)))
+    with pytest.raises(StorageThrottled):
+        client.call('GetItem', func)
+    assert func.calls == 3
+    # троттлинг не открывает автомат отключения
+    assert client.breaker.state is BreakerState.CLOSED
+
+
+def test_retry_budget_limits_retries():
+    client = make_client(budget=RetryBudget(capacity=10, retry_cost=5))
+    for _ in range(2):
+        assert client.call('GetItem', Flaky(throttled())) == 'ok'
+    func = Flaky(throttled())
+    with pytest.raises(StorageThrottled):
+        client.call('GetItem', func)
+    assert func.calls == 1
+    # бюджет считается по операциям
+    assert client.call('Query', Flaky(throttled())) == 'ok'
+
+
+def test_breaker_opens_and_half_opens():
+    client = make_client(max_attempts=1, breaker=CircuitBreaker(failure_threshold=2, reset_timeout=0.05))
+    for _ in range(2):
+        with pytest.raises(StorageUnavailable):
+            client.call('GetItem', Flaky(read_timeout()))
+    assert client.breaker.state is BreakerState.OPEN
+    func = Flaky()
+    with pytest.raises(StorageUnavailable, match='circuit breaker is open'):
+        client.call('GetItem', func)
+    assert func.calls == 0
+
+    time.sleep(0.06)
+    # пробный запрос закрывает автомат
+    assert client.call('GetItem', func) == 'ok'
+    assert client.breaker.state is BreakerState.CLOSED
+
+
+def test_failed_probe_reopens_breaker():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    client = make_client(max_attempts=1, breaker=breaker)
+    with pytest.raises(StorageUnavailable):
+        client.call('GetItem', Flaky(read_timeout()))
+    time.sleep(0.06)
+    assert breaker.allow() and not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state is BreakerState.OPEN
+
+
+def test_non_idempotent_write_is_not_retried_after_timeout():
+    client = make_client()
+    func = Flaky(read_timeout())
+    with pytest.raises(StorageUnavailable, match='not retried'):
+        client.call('UpdateItem', func, idempotent=False)
+    assert func.calls == 1
+    assert client.stats['not_retried'] == 1
+    # 5xx тоже мог примениться
+    server_error = ClientError({'Error': {'Code': 'InternalServerError'},
+                                'ResponseMetadata': {'HTTPStatusCode': 500}}, 'UpdateItem')
+    with pytest.raises(StorageUnavailable):
+        client.call('UpdateItem', Flaky(server_error), idempotent=False)
+
+
+def test_non_idempotent_write_is_retried_when_not_sent():
+    client = make_client()
+    func = Flaky(EndpointConnectionError(endpoint_url='http://dynamodb'), throttled())
+    assert client.call('UpdateItem', func, idempotent=False) == 'ok'
+    assert func.calls == 3
+    # идемпотентный запрос повторяется и после таймаута
+    assert client.call('GetItem', Flaky(read_timeout())) == 'ok'
+
+
+def test_hedged_request_wins_over_slow_one():
+    client = make_client(hedge_after=0.02, hedge_workers=4)
+    calls = []
+
+    def get_item():
+        calls.append(None)
+        if len(calls) == 1:
+            time.sleep(0.5)
+            return 'slow'
+        return 'fast'
+
+    start = time.perf_counter()
+    assert client.hedged('GetItem', get_item) == 'fast'
+    assert time.perf_counter() - start < 0.4
+    assert (client.stats['hedged'], client.stats['hedge_wins']) == (1, 1)
+
+
+def test_no_hedge_without_hedge_after():
+    client = make_client()
+    assert client.hedged('GetItem', Flaky()) == 'ok'
+    assert client._hedge_executor is None
+
+
+def test_warm_up_hedges_runs_once_in_every_thread():
+    client = make_client(hedge_after=0.01, hedge_workers=4)
+    threads = []
+    client.warm_up_hedges(lambda: threads.append(threading.get_ident()))
+    client.warm_up_hedges(lambda: threads.append(threading.get_ident()))
+    assert len(threads) == len(set(threads)) == 4
+
+
+def test_add_coins_is_not_applied_twice_after_lost_response(aws):
+    create_tables(aws, ledger=False)
+    database = Database('Users', None, 'test', 'test', client=make_client())
+    database.add_user(1, 0, 'alice')
+    table = database.table
+
+    class LostResponse:
+        """Запись выполняется, а ответ теряется по таймауту чтения"""
+
+        def __getattr__(self, name):
+            return getattr(table, name)
+
+        def update_item(self, **kwargs):
+            table.update_item(**kwargs)
+            raise read_timeout()
+
+    database._local.table = LostResponse()
+    with pytest.raises(StorageUnavailable):
+        database.add_coins(1, 10)
+    database._local.table = table
+    assert database.get_balance(1) == 10
+
+
+def test_warm_up_prepares_hedge_threads(dynamo):
+    dynamo.dynamo = make_client(hedge_after=0.01, hedge_workers=3)
+    assert dynamo.warm_up()
+    prepared = [dynamo.dynamo.hedge_executor.submit(lambda: getattr(dynamo._local, 'table', None)).result()
+                for _ in range(3)]
+    assert all(table is not None for table in prepared)
+
+
+class UnprocessedResource:
+    """BatchWriteItem и BatchGetItem, которые обрабатывают не больше `processed` запросов за вызов"""
+
+    def __init__(self, processed: int):
+        self.processed = processed
+        self.calls = 0
+
+    def batch_write_item(self, RequestItems):
+        self.calls += 1
+        (table_name, requests), = RequestItems.items()
+        unprocessed = requests[self.processed:]
+        return {'UnprocessedItems': {table_name: unprocessed} if unprocessed else {}}
+
+    def batch_get_item(self, RequestItems):
+        self.calls += 1
+        (table_name, request), = RequestItems.items()
+        keys = request['Keys'][self.processed:]
+        return {'Responses': {table_name: request['Keys'][:self.processed]},
+                'UnprocessedKeys': {table_name: {'Keys': keys}} if keys else {}}
+
+
+class UnprocessedDatabase(Database):
+    def __init__(self, resource: UnprocessedResource):
+        super().__init__('Users', None, 'test', 'test', client=make_client(max_attempts=3))
+        self._local.resource = resource
+
+
+def test_batch_write_gives_up_without_progress():
+    resource = UnprocessedResource(processed=0)
+    with pytest.raises(StorageThrottled):
+        UnprocessedDatabase(resource)._batch_write('Users', [{'PutRequest': {'Item': {'chat_id': 1}}}])
+    assert resource.calls == 3
+
+
+def test_batch_write_keeps_going_while_items_are_written():
+    resource = UnprocessedResource(processed=2)
+    requests = [{'PutRequest': {'Item': {'chat_id': i}}} for i in range(10)]
+    assert UnprocessedDatabase(resource)._batch_write('Users', requests) == 10
+    assert resource.calls == 5
+
+
+def test_batch_get_gives_up_on_unprocessed_keys():
+    resource = UnprocessedResource(processed=1)
+    database = UnprocessedDatabase(resource)
+    keys = [{'chat_id': i} for i in range(2)]
+    assert database._batch_get({'Users': {'Keys': keys}}) == {'Users': keys}
+    with pytest.raises(StorageThrottled):
+        database._batch_get({'Users': {'Keys': [{'chat_id': i} for i in range(5)]}})
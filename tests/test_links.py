@@ -0,0 +1,63 @@
+import base64
+
+import pytest
+
+from links import ENCODED_SIZE, MAX_USERNAME, LinkSigner, LinkStatus, PaymentLink
+
+NOW = 1_700_000_000
+
+
+def tamper(payload: str, offset: int) -> str:
+    """Меняет байт тела ссылки, оставляя подпись прежней"""
+    raw = bytearray(base64.urlsafe_b64decode(payload[:ENCODED_SIZE] + '=='))
+    raw[offset] ^= 1
+    return base64.urlsafe_b64encode(bytes(raw)).decode()[:ENCODED_SIZE] + payload[ENCODED_SIZE:]
+
+
+def test_signed_link_round_trip():
+    signer = LinkSigner(b'secret', ttl=3600)
+    payload = signer.sign(2 ** 40, 150, 'alice', now=NOW)
+    status, link = signer.verify(payload, now=NOW)
+    assert status is LinkStatus.VALID
+    assert link == PaymentLink(to_id=2 ** 40, amount=150, username='alice', expires_at=(NOW // 3600 + 2) * 3600)
+    # внутри интервала ttl ссылка не меняется
+    assert signer.sign(2 ** 40, 150, 'alice', now=NOW + 1) == payload
+
+
+@pytest.mark.parametrize('change', [
+    lambda payload: tamper(payload, 6),  # to_id
+    lambda payload: tamper(payload, 10),  # amount
+    lambda payload: tamper(payload, 14),  # expires_at
+    lambda payload: payload[:ENCODED_SIZE] + 'mallory',  # username
+    lambda payload: LinkSigner(b'other').sign(2, 150, 'alice', now=NOW),  # другой секрет
+])
+def test_tampered_link_is_invalid(change):
+    signer = LinkSigner(b'secret')
+    assert signer.verify(change(signer.sign(2, 150, 'alice', now=NOW)), now=NOW) == (LinkStatus.INVALID, None)
+
+
+def test_link_expires():
+    signer = LinkSigner(b'secret', ttl=60)
+    payload = signer.sign(2, 1, 'alice', now=NOW)
+    status, link = signer.verify(payload, now=NOW)
+    assert status is LinkStatus.VALID and NOW + 60 <= link.expires_at <= NOW + 120
+    assert signer.verify(payload, now=link.expires_at - 1)[0] is LinkStatus.VALID
+    assert signer.verify(payload, now=link.expires_at)[0] is LinkStatus.EXPIRED
+
+
+@pytest.mark.parametrize('payload', ['', 'a' * ENCODED_SIZE, 'a' * (ENCODED_SIZE + MAX_USERNAME + 1), '!' * 40])
+def test_malformed_payload_is_invalid(payload):
+    assert LinkSigner(b'secret').verify(payload, now=NOW) == (LinkStatus.INVALID, None)
+
+
+def test_longest_link_fits_callback_data():
+    signer = LinkSigner(b'secret')
+    payload = signer.sign(2 ** 56 - 1, 2 ** 32 - 1, 'u' * MAX_USERNAME, now=NOW)
+    assert len(payload) == ENCODED_SIZE + MAX_USERNAME
+    assert len('c_' + payload) <= 64
+    assert signer.verify(payload, now=NOW)[0] is LinkStatus.VALID
+
+
+def test_long_username_is_rejected():
+    with pytest.raises(ValueError):
+        LinkSigner(b'secret').sign(2, 1, 'u' * (MAX_USERNAME + 1))
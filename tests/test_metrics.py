@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+
+import metrics
+from metrics import Counter, Gauge, Histogram, instrument_methods
+
+
+@pytest.fixture(autouse=True)
+def registry(monkeypatch):
+    """Метрики теста не попадают в общий REGISTRY"""
+    monkeypatch.setattr(metrics, 'REGISTRY', [])
+    return metrics.REGISTRY
+
+
+def test_counter_render():
+    counter = Counter('test_errors_total', 'Errors', ['method', 'code'])
+    counter.inc('get', 'Throttling')
+    counter.inc('get', 'Throttling', amount=2)
+    assert list(counter.render()) == [
+        '# HELP test_errors_total Errors',
+        '# TYPE test_errors_total counter',
+        'test_errors_total{method="get",code="Throttling"} 3',
+    ]
+
+
+def test_gauge_render_collects_on_request():
+    values = {'main': 1}
+    gauge = Gauge('test_queue', 'Queue size', 'queue', lambda: values)
+    values['main'] = 5
+    assert list(gauge.render())[2:] == ['test_queue{queue="main"} 5']
+
+
+def test_histogram_render_is_cumulative():
+    histogram = Histogram('test_seconds', 'Latency', ['method'], buckets=(0.1, 1))
+    for value in (0.05, 0.5, 0.7, 3):
+        histogram.observe(value, 'get')
+    assert list(histogram.render())[2:] == [
+        'test_seconds_bucket{method="get",le="0.1"} 1',
+        'test_seconds_bucket{method="get",le="1"} 3',
+        'test_seconds_bucket{method="get",le="+Inf"} 4',
+        'test_seconds_sum{method="get"} 4.25',
+        'test_seconds_count{method="get"} 4',
+    ]
+
+
+def test_render_joins_registry(registry):
+    Counter('test_a_total', 'A').inc()
+    Histogram('test_b_seconds', 'B', buckets=(1,)).observe(0.5)
+    text = metrics.render()
+    assert text.endswith('\n')
+    assert 'test_a_total 1\n' in text
+    assert 'test_b_seconds_bucket{le="1"} 1\n' in text
+    assert text.count('# TYPE') == len(registry) == 2
+
+
+def test_instrument_methods_times_public_methods():
+    histogram = Histogram('test_db_seconds', 'DB', ['method'])
+
+    @instrument_methods(histogram)
+    class Backend:
+        def get_balance(self, chat_id):
+            return chat_id * 2
+
+        def _private(self):
+            return 1
+
+        def scan(self):
+            yield 1
+
+    backend = Backend()
+    assert backend.get_balance(2) == 4
+    assert backend._private() == 1
+    assert list(backend.scan()) == [1]
+    assert Backend.get_balance.__name__ == 'get_balance'
+    assert set(histogram.values) == {('get_balance',)}
+    assert histogram.values[('get_balance',)][-1] == 1
+
+
+def test_metrics_handler():
+    from aiohttp.test_utils import make_mocked_request
+    Counter('test_requests_total', 'Requests').inc()
+    response = asyncio.run(metrics.metrics_handler(make_mocked_request('GET', '/metrics')))
+    assert response.content_type == 'text/plain'
+    assert 'test_requests_total 1' in response.text
@@ -0,0 +1,69 @@
+import asyncio
+import time
+
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+from bot.outbox import Outbox
+
+
+class FakeBot:
+    """Отвечает 429 на первые retry_after_responses вызовов send_message"""
+
+    def __init__(self, retry_after_responses: int = 0, retry_after: float = 0.0):
+        self.retry_after_responses = retry_after_responses
+        self.retry_after = retry_after
+        self.calls = []
+
+    async def send_message(self, chat_id: int, text: str):
+        self.calls.append((chat_id, time.monotonic()))
+        if len(self.calls) <= self.retry_after_responses:
+            raise TelegramRetryAfter(method=SendMessage(chat_id=chat_id, text=text), message='Too Many Requests',
+                                     retry_after=self.retry_after)
+
+
+def test_retry_after_pauses_sending_and_requeues():
+    async def scenario():
+        bot = FakeBot(retry_after_responses=1, retry_after=0.2)
+        outbox = Outbox(bot, rate=1000, per_chat_interval=0, workers=1)
+        outbox.start()
+        outbox.send(1, 'first')
+        outbox.send(2, 'second')
+        await outbox.stop(timeout=5)
+        return bot.calls, outbox.stats
+
+    calls, stats = asyncio.run(scenario())
+    # сообщение 1 вернулось в очередь после сообщения 2, и оба ушли только после паузы
+    assert [chat_id for chat_id, _ in calls] == [1, 2, 1]
+    assert calls[1][1] - calls[0][1] >= 0.19
+    assert stats == {'queued': 2, 'retry_after': 1, 'retried': 1, 'sent': 2}
+
+
+def test_message_is_dropped_after_max_attempts():
+    async def scenario():
+        bot = FakeBot(retry_after_responses=10)
+        outbox = Outbox(bot, rate=1000, per_chat_interval=0, workers=1, max_attempts=3)
+        outbox.start()
+        outbox.send(1, 'text')
+        await outbox.stop(timeout=5)
+        return len(bot.calls), outbox.stats
+
+    attempts, stats = asyncio.run(scenario())
+    assert attempts == 3
+    assert stats == {'queued': 1, 'retry_after': 3, 'retried': 2, 'failed': 1}
+
+
+def test_broadcast_waits_for_space_in_full_queue():
+    async def scenario():
+        bot = FakeBot()
+        outbox = Outbox(bot, rate=1000, per_chat_interval=0, workers=1, maxsize=2)
+        broadcast = asyncio.create_task(outbox.broadcast(iter({'chat_id': i} for i in range(5)), 'text'))
+        await asyncio.sleep(0.1)
+        # воркеры не запущены: в очереди не больше maxsize сообщений, рассылка ждет
+        blocked = broadcast.done(), outbox.depth()
+        outbox.start()
+        queued = await asyncio.wait_for(broadcast, 5)
+        await outbox.stop(timeout=5)
+        return blocked, queued, sorted(chat_id for chat_id, _ in bot.calls)
+
+    assert asyncio.run(scenario()) == ((False, 2), 5, [0, 1, 2, 3, 4])
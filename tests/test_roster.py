@@ -0,0 +1,18 @@
+import os
+
+from roster import Roster
+
+
+def test_get_reads_the_index_loaded_by_refresh(tmp_path):
+    path = tmp_path / 'students.csv'
+    path.write_text('ФИ,Класс,телеграм\nИванов Иван,7А,@Alice\n', encoding='utf-8')
+    roster = Roster(str(path))
+    assert roster.get('alice') is None
+    roster.refresh()
+    assert roster.get('@ALICE') == {'ФИ': 'Иванов Иван', 'Класс': '7А'}
+
+    path.write_text('ФИ,Класс,телеграм\nПетров Петр,8Б,@bob\n', encoding='utf-8')
+    os.utime(path, ns=(0, 0))
+    assert roster.usernames() == ['Alice']
+    roster.refresh()
+    assert roster.get('alice') is None and roster.usernames() == ['bob']
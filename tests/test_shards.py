@@ -0,0 +1,58 @@
+import pytest
+
+from conftest import create_tables
+from db_manager import Database, TransferResult
+
+TEACHER, MISSING = 100, 200
+
+
+@pytest.fixture
+def sharded(aws) -> Database:
+    create_tables(aws, shards=True)
+    database = Database('Users', None, 'test', 'test', ledger_table_name='Ledger', shard_table_name='Shards',
+                        hot_accounts=[TEACHER, MISSING], balance_shards=4)
+    database.add_user(1, 50, 'alice')
+    database.add_user(TEACHER, 0, 'teacher')
+    return database
+
+
+def stored_coins(database: Database, chat_id: int) -> int:
+    return database.table.get_item(Key={'chat_id': chat_id})['Item']['coins']
+
+
+def shard_rows(database: Database) -> list:
+    return database.shard_table.scan()['Items']
+
+
+def test_credit_to_hot_account_goes_to_a_shard(sharded):
+    assert sharded.transaction(1, TEACHER, 10) is TransferResult.OK
+    assert sharded.add_coins(TEACHER, 5)
+    # запись пользователя не меняется, зачисления лежат в шардах и учитываются при чтении
+    assert stored_coins(sharded, TEACHER) == 0
+    assert sum(row['coins'] for row in shard_rows(sharded)) == 15
+    assert sharded.get_balance(TEACHER) == 15
+    assert {item['chat_id']: item['coins'] for item in sharded.scan_items(['chat_id', 'coins'])} == {1: 40, TEACHER: 15}
+    assert sharded.reconcile() == {}
+
+
+def test_missing_hot_recipient_is_checked(sharded):
+    # ConditionCheck на записи получателя отменяет транзакцию, шард не создается
+    assert sharded.transaction(1, MISSING, 10) is TransferResult.RECIPIENT_MISSING
+    assert sharded.get_balance(1) == 50 and shard_rows(sharded) == []
+
+
+def test_hot_sender_compacts_shards_before_spending(sharded):
+    assert sharded.transaction(1, TEACHER, 30) is TransferResult.OK
+    # в записи пользователя 0, в шардах 30: перевод выполняется после переноса шардов в запись
+    assert sharded.transaction(TEACHER, 1, 25) is TransferResult.OK
+    assert stored_coins(sharded, TEACHER) == 5
+    assert sum(row['coins'] for row in shard_rows(sharded)) == 0
+    assert (sharded.get_balance(1), sharded.get_balance(TEACHER)) == (45, 5)
+    assert sharded.transaction(TEACHER, 1, 6) is TransferResult.INSUFFICIENT_FUNDS
+    assert sharded.reconcile() == {}
+
+
+def test_delete_all_removes_shards(sharded):
+    sharded.transaction(1, TEACHER, 10)
+    assert sharded.delete_all() == 2
+    assert shard_rows(sharded) == [] and sharded.get_balance(TEACHER) is None
@@ -0,0 +1,80 @@
+import gzip
+import json
+
+import pytest
+
+import snapshot
+from conftest import create_tables
+from db_manager import BulkResult, Database
+
+
+def read_lines(path) -> dict:
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        return {item['chat_id']: item for item in map(json.loads, f)}
+
+
+def test_export_import_round_trip(storage, tmp_path, monkeypatch):
+    users = 300
+    # 300 записей по 4 КБ не помещаются в одну страницу Scan (1 МБ)
+    storage.put_items({'chat_id': chat_id, 'coins': chat_id * 10, 'username': f'user{chat_id}', 'note': 'x' * 4096}
+                      for chat_id in range(users))
+    storage.bulk_add_coins(['user1', 'user2'], 5, 'op-1')
+    operations = []
+    if isinstance(storage, Database):
+        call = storage.dynamo.call
+
+        def counted(operation, *args, **kwargs):
+            operations.append(operation)
+            return call(operation, *args, **kwargs)
+
+        monkeypatch.setattr(storage.dynamo, 'call', counted)
+    first, second = str(tmp_path / 'first.jsonl.gz'), str(tmp_path / 'second.jsonl.gz')
+    manifest = snapshot.export_snapshot(storage, first, segments=1)
+    assert manifest['items'] == users and manifest['coins'] == sum(range(0, users * 10, 10)) + 10
+    if isinstance(storage, Database):
+        assert operations.count('Scan') > 1
+        assert len(read_lines(first)[1]['note']) == 4096
+
+    assert storage.delete_all() == users
+    assert snapshot.import_items(storage, first) == users
+    snapshot.export_snapshot(storage, second, segments=3)
+    assert read_lines(first) == read_lines(second)
+    # метки массовых начислений хранятся вне таблицы пользователей и переживают замену записей
+    assert storage.bulk_add_coins(['user1'], 5, 'op-1')['user1'] is BulkResult.ALREADY_CREDITED
+
+
+def test_corrupted_snapshot_is_not_imported(storage, tmp_path):
+    storage.add_user(1, 10, 'alice')
+    path = str(tmp_path / 'users.jsonl.gz')
+    snapshot.export_snapshot(storage, path)
+    with gzip.open(path, 'wt', encoding='utf-8') as f:
+        f.write(json.dumps({'chat_id': 1, 'coins': 1000, 'username': 'alice'}) + '\n')
+    with pytest.raises(ValueError):
+        snapshot.import_items(storage, path)
+    assert storage.get_balance(1) == 10
+
+
+def test_roster_import_adds_only_new_users(storage, tmp_path):
+    storage.add_user(1, 50, 'alice')
+    storage.bulk_add_coins(['alice'], 5, 'op-1')
+    roster = tmp_path / 'roster.csv'
+    roster.write_text('chat_id,телеграм,coins\n1,@alice,0\n2,@bob,\n,@carol,\n', encoding='utf-8')
+    assert snapshot.import_items(storage, str(roster), coins=20) == 1
+    assert storage.get_balance(1) == 55
+    assert storage.user_exist(2) == {'chat_id': 2, 'coins': 20, 'username': 'bob'}
+    assert storage.bulk_add_coins(['alice'], 5, 'op-1')['alice'] is BulkResult.ALREADY_CREDITED
+    # новые пользователи записываются в журнал, как при /start
+    assert storage.reconcile() == {}
+    # повторный импорт ничего не меняет
+    assert snapshot.import_items(storage, str(roster), coins=20) == 0
+    assert storage.get_balance(2) == 20
+
+
+def test_insert_items_without_ledger(aws):
+    create_tables(aws, ledger=False)
+    database = Database('Users', None, 'test', 'test')
+    database.add_user(1, 50, 'alice')
+    items = [{'chat_id': chat_id, 'coins': 0, 'username': f'user{chat_id}'} for chat_id in range(1, 40)]
+    assert database.insert_items(items, writers=3) == 38
+    assert database.user_exist(1) == {'chat_id': 1, 'coins': 50, 'username': 'alice'}
+    assert database.get_balance(39) == 0
@@ -0,0 +1,63 @@
+"""Поведение, общее для Database (moto) и SQLiteDatabase"""
+from db_manager import Database, TransferResult
+from sqlite_db import SQLiteDatabase
+
+
+def test_transaction_results(storage):
+    storage.add_user(1, 100, 'alice')
+    storage.add_user(2, 0, 'bob')
+    assert storage.transaction(1, 2, 30) is TransferResult.OK
+    assert storage.transaction(1, 2, 71) is TransferResult.INSUFFICIENT_FUNDS
+    assert storage.transaction(1, 3, 10) is TransferResult.RECIPIENT_MISSING
+    assert storage.transaction(1, 1, 10) is TransferResult.SAME_USER
+    # средства отправителя проверяются раньше получателя
+    assert storage.transaction(1, 3, 71) is TransferResult.INSUFFICIENT_FUNDS
+    assert storage.transaction(3, 1, 10) is TransferResult.INSUFFICIENT_FUNDS
+    assert (storage.get_balance(1), storage.get_balance(2)) == (70, 30)
+
+
+def test_ledger_history_and_reconcile(storage):
+    storage.add_user(1, 100, 'alice')
+    storage.add_user(2, 0, 'bob')
+    storage.transaction(1, 2, 30)
+    storage.add_coins(2, 5)
+    storage.subtract_coins(1, 20)
+    page, cursor = storage.get_history(1, limit=2)
+    assert [(entry['delta'], entry['kind']) for entry in page] == [(-20, 'admin'), (-30, 'transfer')]
+    assert page[1]['counterparty'] == 2
+    rest, cursor = storage.get_history(1, limit=2, cursor=cursor)
+    assert [(entry['delta'], entry['kind']) for entry in rest] == [(100, 'open')]
+    assert cursor is None
+    assert storage.reconcile() == {}
+
+
+def test_reconcile_reports_ledger_without_user(storage):
+    storage.add_user(1, 100, 'alice')
+    storage.add_user(2, 0, 'bob')
+    # записи пользователя удаляются, журнал остается
+    storage.delete_all()
+    storage.put_items([{'chat_id': 2, 'coins': 7, 'username': 'bob'}])
+    assert storage.reconcile() == {1: (0, 100), 2: (7, 0)}
+
+
+def test_scan_items_across_pages_and_segments(storage):
+    if isinstance(storage, SQLiteDatabase):
+        storage.page_size = 7
+        note = ''
+    else:
+        # страница Scan ограничена 1 МБ: 300 записей по 4 КБ занимают несколько страниц
+        note = 'x' * 4096
+    users = 300
+    assert storage.put_items({'chat_id': chat_id, 'coins': chat_id, 'username': f'user{chat_id}', 'note': note}
+                             for chat_id in range(users)) == users
+    for segments in (1, 3):
+        items = list(storage.scan_items(['chat_id', 'coins'], segments))
+        assert sorted(item['chat_id'] for item in items) == list(range(users))
+        assert all(item['coins'] == item['chat_id'] and 'note' not in item for item in items)
+    assert sorted(storage.iter_data(2)) == [(chat_id, f'user{chat_id}') for chat_id in range(users)]
+
+
+def test_scan_pages_are_bounded(dynamo: Database):
+    dynamo.put_items({'chat_id': chat_id, 'coins': 0, 'note': 'x' * 4096} for chat_id in range(300))
+    pages = [len(page) for page in dynamo._scan_pages('table', ['chat_id'])]
+    assert len(pages) > 1 and sum(pages) == 300
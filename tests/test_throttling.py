@@ -0,0 +1,101 @@
+import asyncio
+import threading
+import time
+
+from aiogram.types import CallbackQuery, User
+
+from bot.middlewares.trottling import DynamoRateLimiter, Limit, MemoryRateLimiter, ThrottlingMiddleware
+
+
+def make_limiter(aws, create: bool = True) -> DynamoRateLimiter:
+    if create:
+        aws.create_table(TableName='RateLimits', KeySchema=[{'AttributeName': 'key', 'KeyType': 'HASH'}],
+                         AttributeDefinitions=[{'AttributeName': 'key', 'AttributeType': 'S'}],
+                         BillingMode='PAY_PER_REQUEST')
+    return DynamoRateLimiter('RateLimits', None, 'test', 'test')
+
+
+def test_dynamo_rate_limiter_allows_burst(aws):
+    limiter = make_limiter(aws)
+    limit = Limit(interval=60, burst=2)
+    assert [limiter._allow('1:get', limit) for _ in range(3)] == [True, True, False]
+    assert limiter._allow('2:get', limit)
+
+
+def test_dynamo_rate_limiter_fails_open(aws):
+    # get_item к отсутствующей таблице завершается ошибкой: пользователи не блокируются
+    limiter = make_limiter(aws, create=False)
+    assert limiter._allow('1:get', Limit(60))
+
+
+class Message:
+    """Достаточно полей, которые читает ThrottlingMiddleware"""
+
+    def __init__(self, chat_id: int, text: str, answers: list):
+        self.from_user = User(id=chat_id, is_bot=False, first_name='test')
+        self.text = text
+        self.answers = answers
+
+    async def answer(self, text: str, **kwargs):
+        self.answers.append(text)
+
+
+def throttle(events, limiter=None, limits=None):
+    middleware = ThrottlingMiddleware(limiter or MemoryRateLimiter(), limits=limits)
+    handled = []
+
+    async def handler(event, data):
+        handled.append(event)
+
+    async def feed():
+        for event in events:
+            await middleware(handler, event, {})
+
+    asyncio.run(feed())
+    return handled, middleware
+
+
+def test_memory_rate_limiter_refills_after_interval(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(time, 'monotonic', lambda: now[0])
+    limiter = MemoryRateLimiter(purge_every=2)
+    limit = Limit(interval=10, burst=2)
+    allow = lambda key: asyncio.run(limiter.allow(key, limit))  # noqa: E731
+    assert [allow('1:get') for _ in range(3)] == [True, True, False]
+    now[0] += 10
+    assert [allow('1:get') for _ in range(2)] == [True, False]
+    now[0] += 100
+    assert allow('2:get') and list(limiter.tat) == ['2:get']
+
+
+def test_commands_have_their_own_limits():
+    answers = []
+    events = [Message(1, text, answers) for text in ['/get 10', '/get@bot 5', '/get', '/table', '/table', 'Баланс💵']]
+    handled, middleware = throttle(events, limits={'get': Limit(60, burst=2), 'table': Limit(60)})
+    assert [event.text for event in handled] == ['/get 10', '/get@bot 5', '/table', 'Баланс💵']
+    assert dict(middleware.stats) == {'allowed': 4, 'rejected': 2}
+
+
+def test_callback_prefix_limit_and_single_notification():
+    answers = []
+
+    class Callback(CallbackQuery):
+        async def answer(self, text=None, **kwargs):
+            answers.append(text)
+
+    callbacks = [Callback(id=str(i), chat_instance='test', data=f'c_payload{i}',
+                          from_user=User(id=1, is_bot=False, first_name='test')) for i in range(4)]
+    handled, middleware = throttle(callbacks + [Message(1, 'Баланс💵', answers)], limits={'c': Limit(60)})
+    # подтверждения перевода ограничены лимитом `c`, остальные события пользователя - нет
+    assert [getattr(event, 'data', None) for event in handled] == ['c_payload0', None]
+    assert middleware.stats == {'allowed': 2, 'rejected': 3}
+    assert answers == ['Слишком много запросов, подождите']
+
+
+def test_dynamo_rate_limiter_uses_a_table_per_thread(aws):
+    limiter = make_limiter(aws)
+    tables = [limiter.table]
+    thread = threading.Thread(target=lambda: tables.append(limiter.table))
+    thread.start()
+    thread.join()
+    assert tables[0] is limiter.table and tables[0] is not tables[1]
@@ -0,0 +1,45 @@
+import asyncio
+
+import pytest
+
+from db_manager import TransferResult
+from dynamo_client import ResilientClient, StorageError
+from transfers import ClaimStatus, DynamoTransferStore, MemoryTransferStore
+
+
+def make_store(aws, create: bool = True) -> DynamoTransferStore:
+    if create:
+        aws.create_table(TableName='Transfers', KeySchema=[{'AttributeName': 'transfer_id', 'KeyType': 'HASH'}],
+                         AttributeDefinitions=[{'AttributeName': 'transfer_id', 'AttributeType': 'S'}],
+                         BillingMode='PAY_PER_REQUEST')
+    return DynamoTransferStore('Transfers', None, 'test', 'test', client=ResilientClient(max_attempts=1))
+
+
+@pytest.fixture(params=['memory', 'dynamodb'])
+def store(request):
+    if request.param == 'memory':
+        return MemoryTransferStore()
+    return make_store(request.getfixturevalue('aws'))
+
+
+def test_second_claim_is_a_duplicate(store):
+    async def scenario():
+        transfer = {'from_id': 1, 'to_id': 2, 'amount': 5}
+        first = await store.claim('1:10', transfer)
+        duplicate = await store.claim('1:10', transfer)
+        await store.finish('1:10', TransferResult.OK)
+        finished = await store.claim('1:10', transfer)
+        other = await store.claim('1:11', transfer)
+        return first, duplicate, finished, other
+
+    first, duplicate, finished, other = asyncio.run(scenario())
+    assert first[0] is ClaimStatus.CLAIMED and other[0] is ClaimStatus.CLAIMED
+    assert duplicate[0] is ClaimStatus.DUPLICATE and duplicate[1]['amount'] == 5
+    assert finished[0] is ClaimStatus.DUPLICATE and finished[1]['result'] == TransferResult.OK.value
+
+
+def test_dynamo_claim_error_is_raised(aws):
+    # таблицы нет: отметку записать нельзя, перевод не должен выполняться молча как устаревший
+    store = make_store(aws, create=False)
+    with pytest.raises(StorageError):
+        asyncio.run(store.claim('1:10', {'from_id': 1, 'to_id': 2, 'amount': 5}))
@@ -0,0 +1,99 @@
+import asyncio
+
+from db_manager import AsyncDatabase
+from sqlite_db import SQLiteDatabase
+from user_cache import CachedDatabase
+
+
+def run(scenario):
+    async def wrapper():
+        database = CachedDatabase(AsyncDatabase(SQLiteDatabase(':memory:'), max_workers=1))
+        try:
+            return await scenario(database)
+        finally:
+            database.database.close()
+
+    return asyncio.run(wrapper())
+
+
+def test_leaderboard_follows_writes():
+    async def scenario(database: CachedDatabase):
+        await database.add_user(1, 10, 'alice')
+        await database.seed_leaderboard()
+        await database.add_user(2, 50, 'bob')
+        await database.transaction(2, 1, 45)
+        return database.leaderboard.top(2)
+
+    assert run(scenario) == [(1, 55, 'alice'), (2, 5, 'bob')]
+
+
+def test_bulk_writes_reseed_leaderboard_and_clear_cache():
+    async def scenario(database: CachedDatabase):
+        await database.add_user(1, 10, 'alice')
+        await database.seed_leaderboard()
+        assert (await database.user_exist(1))['coins'] == 10
+        await database.put_items([{'chat_id': 1, 'coins': 99, 'username': 'alice'},
+                                  {'chat_id': 2, 'coins': 5, 'username': 'bob'}])
+        balance = (await database.user_exist(1))['coins']
+        top = database.leaderboard.top(2)
+        await database.delete_all()
+        return balance, top, len(database.leaderboard)
+
+    assert run(scenario) == (99, [(1, 99, 'alice'), (2, 5, 'bob')], 0)
+
+
+def test_reads_are_served_from_cache():
+    async def scenario(database: CachedDatabase):
+        await database.add_user(1, 10, 'alice')
+        await database.user_exist(1)
+        await database.get_balance(1)
+        await database.get_username(1)
+        await database.is_username_correct(1, 'alice')
+        await database.user_exist(2)
+        return dict(database.stats)
+
+    assert run(scenario) == {'misses': 2, 'hits': 3, 'saved_round_trips': 3}
+
+
+def test_writes_invalidate_cached_users():
+    async def scenario(database: CachedDatabase):
+        await database.add_user(1, 10, 'alice')
+        await database.add_user(2, 0, 'bob')
+        assert (await database.user_exist(1))['coins'] == 10
+        await database.add_coins(1, 5)
+        assert (await database.user_exist(1))['coins'] == 15
+        await database.user_exist(2)
+        await database.transaction(1, 2, 7)
+        balances = await database.get_balance(1), await database.get_balance(2)
+        await database.update_username(1, 'alice2')
+        return balances, await database.get_username(1), database.stats['misses']
+
+    # после каждой записи следующее чтение идет в базу, кроме update_username, который обновляет запись в кэше
+    assert run(scenario) == ((8, 7), 'alice2', 5)
+
+
+def test_user_middleware_loads_user_only_for_handlers_that_take_it():
+    from aiogram.dispatcher.event.handler import HandlerObject
+    from aiogram.types import User
+    from bot.middlewares.user import UserMiddleware
+
+    async def with_user(event, user):
+        return user
+
+    async def without_user(event):
+        return None
+
+    async def scenario(database: CachedDatabase):
+        await database.add_user(1, 10, 'alice')
+        database.invalidate(1)
+        middleware = UserMiddleware(database)
+        event = type('Event', (), {'from_user': User(id=1, is_bot=False, first_name='alice')})()
+        results = []
+        for callback in (without_user, with_user):
+            handler = HandlerObject(callback=callback)
+            results.append(await middleware(lambda event, data: handler.call(event, **data), event,
+                                            {'handler': handler}))
+        return results, database.stats['misses']
+
+    (skipped, loaded), misses = run(scenario)
+    assert skipped is None and loaded['username'] == 'alice' and misses == 1
@@ -0,0 +1,85 @@
+import asyncio
+import random
+
+from aiogram import Bot
+from aiohttp.test_utils import TestClient, TestServer
+
+from bot.webhook import UpdateQueue, create_app
+
+
+class RecordingDispatcher:
+    """Вместо Dispatcher: запоминает порядок обработки апдейтов каждого чата"""
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.processed = {}
+
+    async def feed_update(self, bot, update):
+        await asyncio.sleep(random.uniform(0, self.delay))
+        self.processed.setdefault(update.message.chat.id, []).append(update.update_id)
+
+
+def update(update_id: int, chat_id: int) -> dict:
+    return {'update_id': update_id, 'message': {'message_id': update_id, 'date': 0, 'text': 'x',
+                                                'chat': {'id': chat_id, 'type': 'private'}}}
+
+
+def run(scenario, workers: int = 4, maxsize: int = 1000, secret_token=None, delay: float = 0.0):
+    async def wrapper():
+        dp = RecordingDispatcher(delay)
+        update_queue = UpdateQueue(dp, Bot(token='42:test'), workers=workers, maxsize=maxsize)
+        async with TestClient(TestServer(create_app(update_queue, secret_token=secret_token))) as client:
+            return await scenario(client, update_queue, dp)
+
+    return asyncio.run(wrapper())
+
+
+def test_updates_of_one_chat_are_processed_in_order():
+    async def scenario(client, update_queue, dp):
+        update_queue.start()
+        for update_id in range(60):
+            response = await client.post('/webhook', json=update(update_id, update_id % 3))
+            assert response.status == 200
+        await update_queue.stop()
+        return dp.processed
+
+    processed = run(scenario, delay=0.005)
+    assert processed == {chat_id: list(range(chat_id, 60, 3)) for chat_id in range(3)}
+
+
+def test_full_queue_is_rejected_with_503():
+    async def scenario(client, update_queue, dp):
+        # воркеры не запущены, очередь единственного воркера вмещает один апдейт
+        statuses = [(await client.post('/webhook', json=update(update_id, 1))).status for update_id in range(2)]
+        return statuses, dict(update_queue.stats)
+
+    assert run(scenario, workers=1, maxsize=1) == ([200, 503], {'accepted': 1, 'rejected': 1})
+
+
+def test_wrong_secret_token_is_rejected():
+    async def scenario(client, update_queue, dp):
+        wrong = await client.post('/webhook', json=update(1, 1), headers={'X-Telegram-Bot-Api-Secret-Token': 'x'})
+        missing = await client.post('/webhook', json=update(2, 1))
+        right = await client.post('/webhook', json=update(3, 1),
+                                  headers={'X-Telegram-Bot-Api-Secret-Token': 'secret'})
+        return wrong.status, missing.status, right.status, update_queue.depth()
+
+    assert run(scenario, secret_token='secret') == (401, 401, 200, 1)
+
+
+def test_metrics_are_not_served_on_the_webhook_port():
+    async def scenario(client, update_queue, dp):
+        return [(await client.get(path)).status for path in ('/metrics', '/stats')]
+
+    assert run(scenario) == [404, 404]
+
+
+def test_stop_drains_accepted_updates():
+    async def scenario(client, update_queue, dp):
+        for update_id in range(20):
+            await client.post('/webhook', json=update(update_id, update_id))
+        update_queue.start()
+        await update_queue.stop()
+        return sum(map(len, dp.processed.values())), update_queue.depth(), update_queue.stats['processed']
+
+    assert run(scenario, delay=0.01) == (20, 0, 20)
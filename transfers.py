@@ -0,0 +1,135 @@
+import asyncio
+import threading
+import time
+from enum import Enum
+from typing import Tuple, Union
+
+from botocore.exceptions import ClientError
+from cachetools import TTLCache
+
+from db_manager import TransferResult, report_error
+from dynamo_client import ResilientClient, StorageError
+
+
+class ClaimStatus(Enum):
+    """
+    CLAIMED - первое подтверждение, перевод нужно выполнить;
+    DUPLICATE - перевод уже подтвержден (двойное нажатие или повторная доставка callback);
+    EXPIRED - отметка уже есть, но прочитать ее не удалось (удалена TTL), перевод выполнять нельзя.
+    """
+    CLAIMED = 'claimed'
+    DUPLICATE = 'duplicate'
+    EXPIRED = 'expired'
+
+
+class MemoryTransferStore:
+    """
+    Подтвержденные переводы в памяти процесса. Данные перевода приходят в подписанной callback_data,
+    поэтому хранится только отметка о подтверждении по ключу идемпотентности; устаревшие удаляются TTLCache.
+    """
+
+    def __init__(self, ttl: int = 600, maxsize: int = 100_000):
+        """
+        :param ttl: Время хранения отметки; должно быть не меньше срока действия ссылки на оплату.
+        """
+        self.transfers = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    async def claim(self, transfer_id: str, transfer: dict) -> Tuple[ClaimStatus, Union[dict, None]]:
+        """
+        :param transfer_id: Ключ идемпотентности подтверждения (отправитель и сообщение с кнопкой).
+        :param transfer: Данные перевода (from_id, to_id, amount).
+        """
+        existing = self.transfers.get(transfer_id)
+        if existing is not None:
+            return ClaimStatus.DUPLICATE, existing
+        claimed = self.transfers[transfer_id] = {**transfer, 'status': 'claimed'}
+        return ClaimStatus.CLAIMED, claimed
+
+    async def finish(self, transfer_id: str, result: TransferResult):
+        transfer = self.transfers.get(transfer_id)
+        if transfer is not None:
+            transfer['result'] = result.value
+
+
+class DynamoTransferStore:
+    """
+    Подтвержденные переводы в таблице DynamoDB (ключ `transfer_id` (S)): условная запись фиксирует
+    подтверждение ровно один раз для всех реплик бота.
+    Устаревшие записи удаляет TTL DynamoDB по атрибуту `expires_at`, без сканирования таблицы.
+    """
+
+    def __init__(self, table_name: str, endpoint_url: str, access_key: str, secret_key: str, ttl: int = 600,
+                 client: Union[ResilientClient, None] = None):
+        """
+        :param ttl: Время хранения отметки; должно быть не меньше срока действия ссылки на оплату.
+        :param client: Повторы троттлинга и автомат отключения, как в Database.
+        """
+        self.table_name = table_name
+        self.endpoint_url = endpoint_url
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.ttl = ttl
+        self.dynamo = client or ResilientClient()
+        self._local = threading.local()
+        from boto3.dynamodb.types import TypeDeserializer
+        self.deserializer = TypeDeserializer()
+
+    @property
+    def table(self):
+        """Запросы выполняются в потоках asyncio.to_thread, ресурс boto3 у каждого потока свой, как в Database"""
+        table = getattr(self._local, 'table', None)
+        if table is None:
+            import boto3
+            table = self._local.table = boto3.session.Session().resource(
+                'dynamodb',
+                endpoint_url=self.endpoint_url,
+                region_name='us-east-1',
+                aws_access_key_id=self.access_key,
+                aws_secret_access_key=self.secret_key
+            ).Table(self.table_name)
+        return table
+
+    def _claim(self, transfer_id: str, transfer: dict) -> Tuple[ClaimStatus, Union[dict, None]]:
+        """
+        :raises StorageError: Отметку записать не удалось; перевод не выполняется, пользователь может нажать кнопку
+            еще раз. После таймаута запись не повторяется: повтор нашел бы собственную отметку и вернул DUPLICATE.
+        """
+        item = {**transfer, 'transfer_id': transfer_id, 'status': 'claimed', 'expires_at': int(time.time()) + self.ttl}
+        try:
+            self.dynamo.call(
+                'PutItem', self.table.put_item, idempotent=False,
+                Item=item,
+                ConditionExpression='attribute_not_exists(transfer_id)',
+                ReturnValuesOnConditionCheckFailure='ALL_OLD'
+            )
+            return ClaimStatus.CLAIMED, item
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                report_error('claim_transfer', e)
+                raise StorageError('claim_transfer', str(e)) from e
+            # запись, не прошедшая условие, возвращается в той же ошибке - второй запрос не нужен
+            item = e.response.get('Item')
+            if not item:
+                return ClaimStatus.EXPIRED, None
+            return ClaimStatus.DUPLICATE, {key: self.deserializer.deserialize(value) for key, value in item.items()}
+
+    def _finish(self, transfer_id: str, result: TransferResult):
+        # результат записывается для повторных нажатий; перевод уже выполнен, поэтому ошибка только логируется
+        try:
+            self.dynamo.call(
+                'UpdateItem', self.table.update_item,
+                Key={'transfer_id': transfer_id},
+                UpdateExpression='SET #result = :result',
+                ExpressionAttributeNames={'#result': 'result'},
+                ExpressionAttributeValues={':result': result.value}
+            )
+        except ClientError as e:
+            report_error('finish_transfer', e)
+        except StorageError as e:
+            print(f"Error in finish_transfer: {e}")
+
+    async def claim(self, transfer_id: str, transfer: dict) -> Tuple[ClaimStatus, Union[dict, None]]:
+        return await asyncio.to_thread(self._claim, transfer_id, transfer)
+
+    async def finish(self, transfer_id: str, result: TransferResult):
+        await asyncio.to_thread(self._finish, transfer_id, result)
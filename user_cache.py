@@ -0,0 +1,156 @@
+import asyncio
+from collections import Counter
+from typing import Union, Iterable, Dict
+
+from cachetools import TTLCache
+
+from db_manager import AsyncDatabase, TransferResult, BulkResult
+from leaderboard import Leaderboard
+
+
+class CachedDatabase:
+    """
+    Кэш записей пользователей перед AsyncDatabase.
+    Чтения (user_exist, is_username_correct, get_username, get_balance) обслуживаются из TTL/LRU кэша,
+    записи через этот слой обновляют или сбрасывают закэшированную запись и обновляют рейтинг.
+    """
+
+    def __init__(self, database: AsyncDatabase, maxsize: int = 10_000, ttl: int = 30,
+                 leaderboard: Union[Leaderboard, None] = None):
+        """
+        :param database: Асинхронная база данных.
+        :param maxsize: Максимальное количество закэшированных пользователей.
+        :param ttl: Время жизни записи в секундах (ограничивает рассинхронизацию между репликами).
+        :param leaderboard: Рейтинг, который обновляется при успешных изменениях балансов.
+        """
+        self.database = database
+        self.leaderboard = leaderboard if leaderboard is not None else Leaderboard()
+        self.users = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.stats = Counter()
+
+    def __getattr__(self, name):
+        return getattr(self.database, name)
+
+    def invalidate(self, *chat_ids: int):
+        for chat_id in chat_ids:
+            self.users.pop(chat_id, None)
+
+    async def user_exist(self, chat_id: int) -> Union[dict, None]:
+        user = self.users.get(chat_id)
+        if user is not None:
+            self.stats['hits'] += 1
+            self.stats['saved_round_trips'] += 1
+            return user
+        self.stats['misses'] += 1
+        user = await self.database.user_exist(chat_id)
+        if user is not None:
+            self.users[chat_id] = user
+        return user
+
+    async def add_user(self, chat_id: int, coins: int, username: str) -> bool:
+        try:
+            result = await self.database.add_user(chat_id, coins, username)
+        finally:
+            self.invalidate(chat_id)
+        if result:
+            self.leaderboard.set(chat_id, coins, username)
+        return result
+
+    async def is_username_correct(self, chat_id: int, username: str) -> bool:
+        user = await self.user_exist(chat_id)
+        return bool(user) and user.get('username') == username
+
+    async def update_username(self, chat_id: int, new_username: str) -> bool:
+        result = await self.database.update_username(chat_id, new_username)
+        user = self.users.get(chat_id)
+        if result and user is not None:
+            self.users[chat_id] = {**user, 'username': new_username}
+        else:
+            self.invalidate(chat_id)
+        if result:
+            self.leaderboard.rename(chat_id, new_username)
+        return result
+
+    async def add_coins(self, chat_id: int, amount: int, kind: str = 'admin') -> bool:
+        try:
+            result = await self.database.add_coins(chat_id, amount, kind)
+        finally:
+            self.invalidate(chat_id)
+        if result:
+            self.leaderboard.add(chat_id, amount)
+        return result
+
+    async def subtract_coins(self, chat_id: int, amount: int, kind: str = 'admin') -> bool:
+        try:
+            result = await self.database.subtract_coins(chat_id, amount, kind)
+        finally:
+            self.invalidate(chat_id)
+        if result:
+            self.leaderboard.add(chat_id, -amount)
+        return result
+
+    async def get_transaction_verdict(self, chat_id: int, amount: int) -> Union[bool, None]:
+        user = await self.user_exist(chat_id)
+        return bool(user) and user.get('coins') >= amount
+
+    async def transaction(self, chat_id: int, to_chat_id: int, amount: int) -> TransferResult:
+        try:
+            result = await self.database.transaction(chat_id, to_chat_id, amount)
+        finally:
+            self.invalidate(chat_id, to_chat_id)
+        if result is TransferResult.OK:
+            self.leaderboard.add(chat_id, -amount)
+            self.leaderboard.add(to_chat_id, amount)
+        return result
+
+    async def bulk_add_coins(self, usernames: Iterable[str], amount: int, operation_id: str) -> Dict[str, BulkResult]:
+        try:
+            results = await self.database.bulk_add_coins(usernames, amount, operation_id)
+        finally:
+            self.users.clear()
+        for username, result in results.items():
+            if result is BulkResult.CREDITED:
+                self.leaderboard.add_by_username(username, amount)
+        return results
+
+    async def seed_leaderboard(self, segments: int = 1):
+        """Заполняет рейтинг одним обходом таблицы пользователей"""
+        await asyncio.to_thread(self.leaderboard.seed,
+                                self.database.scan_items(['chat_id', 'coins', 'username'], segments))
+
+    async def put_items(self, items: Iterable[dict], writers: int = 4) -> int:
+        """Записи загружаются в обход кэша: закэшированные пользователи сбрасываются, рейтинг заполняется заново"""
+        try:
+            return await self.database.put_items(items, writers)
+        finally:
+            self.users.clear()
+            await self.seed_leaderboard()
+
+    async def insert_items(self, items: Iterable[dict], writers: int = 4) -> int:
+        try:
+            return await self.database.insert_items(items, writers)
+        finally:
+            self.users.clear()
+            await self.seed_leaderboard()
+
+    async def get_username(self, chat_id: int) -> Union[str, None]:
+        user = await self.user_exist(chat_id)
+        return user.get('username') if user else None
+
+    async def get_balance(self, chat_id: int) -> Union[int, None]:
+        user = await self.user_exist(chat_id)
+        return user.get('coins') if user else None
+
+    async def delete_all(self, segments: int = 4) -> int:
+        try:
+            return await self.database.delete_all(segments)
+        finally:
+            self.users.clear()
+            self.leaderboard.clear()
+
+    async def clear_all(self):
+        try:
+            return await self.database.clear_all()
+        finally:
+            self.users.clear()
+            self.leaderboard.clear()
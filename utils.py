@@ -1,67 +1,131 @@
 import io
-import qrcode
-import pymorphy3
-import csv
+import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from tempfile import SpooledTemporaryFile
+from typing import Iterable, Tuple, AsyncGenerator, TYPE_CHECKING
 
-from openpyxl import Workbook
+from aiogram.types import InputFile
+from cachetools import LRUCache
 
+from metrics import QR_RENDER, EXCEL_EXPORT
+from roster import Roster
 
-async def make_qrcode(to_chat_id: int, amount: int):
-    url = f'https://t.me/LiToken_bot?start=send_{to_chat_id}_{amount}'
-    qrcode_img = qrcode.make(url)
+if TYPE_CHECKING:
+    import pymorphy3
+
+
+EXPORT_SPOOL_SIZE = 8 * 1024 * 1024
+QR_BACKEND = os.getenv('QR_BACKEND', 'qrcode')
+_qr_executor = ThreadPoolExecutor(max_workers=int(os.getenv('QR_WORKERS', 2)), thread_name_prefix='qrcode')
+_qr_png_cache = LRUCache(maxsize=int(os.getenv('QR_CACHE_SIZE', 1024)))
+_qr_file_ids = LRUCache(maxsize=int(os.getenv('QR_CACHE_SIZE', 1024)))
+
+
+def qrcode_url(payload: str) -> str:
+    """:param payload: Подписанная ссылка на оплату (links.LinkSigner.sign)."""
+    return f'https://t.me/LiToken_bot?start={payload}'
+
+
+def _render_qrcode(url: str, backend: str) -> bytes:
+    # qrcode/segno (и PIL) нужны только для /get, поэтому загружаются при первом рендере в потоке пула
     buf = io.BytesIO()
-    qrcode_img.save(buf)
-    buf.seek(0)
-    return buf, url
+    with QR_RENDER.time():
+        if backend == 'segno':
+            import segno
+            segno.make(url, error='m').save(buf, kind='png', scale=10, border=4)
+        else:
+            import qrcode
+            qrcode.make(url).save(buf)
+    return buf.getvalue()
+
+
+async def make_qrcode(url: str) -> io.BytesIO:
+    """Рендер выполняется в пуле потоков, готовые PNG кэшируются по url (ссылка не меняется, пока не истек ее срок)"""
+    png = _qr_png_cache.get(url)
+    if png is None:
+        loop = asyncio.get_running_loop()
+        png = await loop.run_in_executor(_qr_executor, _render_qrcode, url, QR_BACKEND)
+        _qr_png_cache[url] = png
+    return io.BytesIO(png)
+
+
+def get_qrcode_file_id(url: str):
+    """file_id уже загруженного в Telegram QR кода, чтобы отправить его повторно без рендера и загрузки"""
+    return _qr_file_ids.get(url)
+
+
+def remember_qrcode_file_id(url: str, file_id: str):
+    _qr_file_ids[url] = file_id
+
+
+_morph = None
+
+
+def get_morph() -> 'pymorphy3.MorphAnalyzer':
+    """Анализатор загружает словари DAWG, поэтому создается один раз на процесс"""
+    global _morph
+    if _morph is None:
+        import pymorphy3
+        _morph = pymorphy3.MorphAnalyzer()
+    return _morph
+
+
+def warm_up_morph():
+    """Загружает словари и заполняет кэш форм слов, которые бот склоняет в ответах"""
+    get_morph()
+    for word in ('Токен', 'Токенов', 'токенов', 'пользователям'):
+        for number in range(100):
+            _agree_with_num(word, number)
+
+
+@lru_cache(maxsize=1024)
+def _agree_with_num(word: str, number_class: int) -> str:
+    return get_morph().parse(word)[0].make_agree_with_number(number_class).word
 
 
 async def agree_with_num(word: str, number: int) -> str:
-    morph = pymorphy3.MorphAnalyzer()
-    return morph.parse(word)[0].make_agree_with_number(number).word
-
-
-async def load_data(filename):
-    data = []
-    with open(filename, mode='r', encoding='utf-8') as file:
-        reader = csv.DictReader(file)
-        for row in reader:
-            data.append(row)
-    return data
-
-
-async def find_user_by_username(username, data):
-    for user in data:
-        if user['телеграм'] == username:
-            return {
-                'ФИ': user['ФИ'],
-                'Класс': user['Класс']
-            }
-    return None
-
-
-async def get_table(table) -> io.BytesIO:
-    wb = Workbook()
-    ws = wb.active
-    ws.title = 'Пользователи и балансы'
-    data = await load_data('students.csv')
-
-    for row, (coins, username) in enumerate(table):
-        row += 1
-        student = await find_user_by_username(f'@{username}', data)
-        if student:
-            name, class_ = student['ФИ'], student['Класс']
-            ws[f'A{row}'] = name
-            ws[f'B{row}'] = class_
-        else:
-            ws[f'A{row}'] = '_'
-            ws[f'B{row}'] = '_'
-        ws[f'C{row}'] = username
-        ws[f'D{row}'] = str(coins)
+    # форма слова зависит только от двух последних цифр числа
+    return _agree_with_num(word, int(number) % 100)
+
+
+@EXCEL_EXPORT.time()
+def _write_table(table: Iterable[Tuple[int, str]], roster: Roster) -> SpooledTemporaryFile:
+    # openpyxl нужен только для /table и загружается при первом экспорте
+    from openpyxl import Workbook
+    roster.refresh()
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet('Пользователи и балансы')
     ws.column_dimensions['A'].width = 20
     ws.column_dimensions['C'].width = 20
 
+    for coins, username in table:
+        student = roster.get(username)
+        if student:
+            name, class_ = student['ФИ'], student['Класс']
+        else:
+            name, class_ = '_', '_'
+        ws.append([name, class_, username, str(coins)])
 
-    excel_file = io.BytesIO()
+    excel_file = SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE)
     wb.save(excel_file)
     excel_file.seek(0)
     return excel_file
+
+
+async def get_table(table: Iterable[Tuple[int, str]], roster: Roster) -> SpooledTemporaryFile:
+    """Строки table читаются и записываются в xlsx потоково в отдельном потоке, результат - во временном файле"""
+    return await asyncio.to_thread(_write_table, table, roster)
+
+
+class SpooledInputFile(InputFile):
+    """Отправляет файл в Telegram частями, не читая его целиком в память"""
+
+    def __init__(self, file, filename: str, **kwargs):
+        super().__init__(filename=filename, **kwargs)
+        self.file = file
+
+    async def read(self, bot) -> AsyncGenerator[bytes, None]:
+        while chunk := self.file.read(self.chunk_size):
+            yield chunk